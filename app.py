@@ -1,42 +1,51 @@
-from flask import Flask, render_template, request, jsonify, redirect
-from flask_socketio import SocketIO, send
+from flask import Flask, Response, render_template, request, jsonify, redirect, stream_with_context
+from flask_socketio import SocketIO, emit, join_room, send
 import os
 import sys
-from esptool import main as esptool_main
-import serial.tools.list_ports
-from firebase_admin import credentials, firestore, initialize_app, auth
-from google.cloud import storage
+from esptool import FlashSession
+from esptool.util import ProgressReporter
+from firebase_admin import credentials, initialize_app, auth
+import functools
 import threading
 import time
+import shutil
 import subprocess
 from datetime import datetime
 from dotenv import load_dotenv
-from serial_reader import restart_and_get_value
 from eventlet.hubs import epolls, kqueue, selects
 import eventlet
 from resetcibtron import resetcibtron
+from cloud_clients import (
+    get_firestore_client,
+    get_http_session,
+    get_service_account_info,
+    get_storage_client,
+    get_token_provider,
+    warm_up_clients,
+)
+from firmware_cache import FirmwareCache
+from serial_lookup import get_serial_lookup
+from port_watcher import PortWatcher
+from worker_pool import HubDispatcher, WorkerPool
+from lector_firestore2 import DEFAULT_PAGE_SIZE, get_documents_page, iter_documents_by_serial
+from firmware_stream import ChunkPipe, flash_stream, iter_file_chunks, start_blob_download
+from job_registry import (
+    JobRegistry,
+    PuertoOcupadoError,
+    ESTADO_COMPILANDO,
+    ESTADO_DESCARGANDO,
+    ESTADO_PROGRAMANDO,
+    ESTADO_FINALIZADO,
+    ESTADO_ERROR,
+)
 import json
 import base64
-from google.oauth2 import service_account
-from google.auth.transport.requests import Request
 import requests
 
 def generate_access_token():
     try:
-        # Cargar las credenciales de la cuenta de servicio
-        credentials = get_decoded_credentials()
-        creds = service_account.Credentials.from_service_account_info(credentials)
-
-        # Definir el scope (permisos) para Cloud Run Jobs
-        scopes = ["https://www.googleapis.com/auth/cloud-platform"]
-
-        # Solicitar el token de acceso
-        request = Request()
-        creds = creds.with_scopes(scopes)
-        creds.refresh(request)
-
-        access_token = creds.token
-        return access_token
+        # El token se guarda y se renueva en segundo plano antes de vencer
+        return get_token_provider().get_token()
     except Exception as e:
         print(f"Error al generar el token de acceso: {e}")
         return None
@@ -61,7 +70,8 @@ def run_job_with_rest_api(project_id, region, job_name, parameters, args=None):
                      }]
                }
              }
-        response = requests.post(url, headers=headers, json=data)
+        # Sesión persistente: reutiliza la conexión y reintenta errores transitorios
+        response = get_http_session().post(url, headers=headers, json=data, timeout=30)
         response.raise_for_status()  # Lanza una excepción para errores HTTP
         return response.json()
     except requests.exceptions.RequestException as e:
@@ -71,18 +81,6 @@ def run_job_with_rest_api(project_id, region, job_name, parameters, args=None):
          print(f"Error al ejecutar el Cloud Run Job con el API REST: {e}")
          raise
 
-def get_firestore_client():
-    try:
-        # Asegúrate de que no estás inicializando dos veces
-        if not firestore.client():
-            print("Inicializando cliente Firestore...")
-            return firestore.client()
-        return firestore.client()
-    except Exception as e:
-        print(f"Error obteniendo cliente Firestore: {e}")
-        raise
-
-
 def get_base_dir():
     if getattr(sys, "frozen", False):
         return sys._MEIPASS
@@ -100,7 +98,6 @@ def get_resource_path(relative_path):
 BASE_DIR = get_base_dir()
 
 CIBTRON_CRED = os.path.join(BASE_DIR, "cibtron.txt")
-TEMP_BIN_PATH = os.path.join(BASE_DIR, "firmware.bin")
 DOTENV_PATH = os.path.join(BASE_DIR, ".env")
 load_dotenv(DOTENV_PATH)
 
@@ -109,17 +106,31 @@ CIBTRON_API = base64.b64decode(CIBTRON_API_KEY).decode("utf-8")
 
 
 def get_decoded_credentials():
-    with open(CIBTRON_CRED, "r") as f:
-        base64_credentials = f.read()
-    return json.loads(base64.b64decode(base64_credentials))
+    return get_service_account_info()
 
 decoded_credentials = get_decoded_credentials()
 
-numero_serial = None
-current_job_status = "Listo"
-monitor_thread = None
-listeners = {}
-is_programming = False
+# Trabajos de programación en curso, uno por puerto
+jobs = JobRegistry(BASE_DIR)
+# Último número de serie leído en cada puerto
+seriales_por_puerto = {}
+# Caché local de binarios descargados desde GCS
+firmware_cache = FirmwareCache()
+# Programar mientras se descarga el binario (FIRMWARE_STREAMING=0 lo desactiva)
+FIRMWARE_STREAMING = os.getenv("FIRMWARE_STREAMING", "1") != "0"
+# Sesiones de esptool abiertas, una por puerto. Se reutilizan entre el reset,
+# la lectura del número de serie y la programación del mismo equipo.
+flash_sessions = {}
+flash_sessions_lock = threading.Lock()
+# Baudios para programar: "auto" usa el más alto que el adaptador soporta de
+# forma estable (se recuerda por adaptador); un número lo fija
+BAUDRATE_PROGRAMACION = os.getenv("BAUDRATE_PROGRAMACION", "auto")
+if BAUDRATE_PROGRAMACION != "auto":
+    BAUDRATE_PROGRAMACION = int(BAUDRATE_PROGRAMACION)
+# Segundos entre eventos de progreso del flasheo enviados al navegador
+PROGRESS_INTERVAL = 0.5
+# Lista de puertos de taxímetros, actualizada en segundo plano
+port_watcher = PortWatcher()
 
 try:
     if not os.path.isfile(CIBTRON_CRED):
@@ -127,11 +138,6 @@ try:
             f"Archivo Base64 de credenciales no encontrado: {CIBTRON_CRED}"
         )
 
-    # Leer y decodificar las credenciales en Base64
-    with open(CIBTRON_CRED, "r") as f:
-        base64_credentials = f.read()
-        
-    decoded_credentials = json.loads(base64.b64decode(base64_credentials))
     cred = credentials.Certificate(decoded_credentials)
     initialize_app(cred)
 except ValueError as e:
@@ -143,6 +149,8 @@ except Exception as e:
 try:
     db = get_firestore_client()
     print("Cliente Firestore obtenido correctamente.")
+    # Abre las conexiones de Firestore y Storage sin bloquear el arranque
+    warm_up_clients()
 except Exception as e:
     print(f"Error al obtener cliente Firestore: {e}")
     sys.exit(1)
@@ -150,56 +158,148 @@ except Exception as e:
 app = Flask(__name__)
 socketio = SocketIO(app, cors_allowed_origins="*", logger=True, engineio_logger=True)
 
-def reset_state():
-    global current_job_status, is_programming, monitor_thread
-    current_job_status = "Listo"
-    is_programming = False
-    if monitor_thread:
-        if hasattr(monitor_thread, 'is_alive') and monitor_thread.is_alive():
-            print(f"Cerrando el hilo")
-            monitor_thread = None
-        else:
-             print(f"El hilo no esta vivo")
-             monitor_thread= None
-    print(f"Se limpio el estado")
-
-def emit_status_update(status):
-    global current_job_status
-    current_job_status = status
-    #print(f"Emitiendo estado: {current_job_status}")
-    socketio.emit("job_status_update", {"status": current_job_status}, to=None)
-
-def list_serial_ports():
+# Las llamadas a socketio desde hilos nativos pasan por el hub
+hub = HubDispatcher(sleep=socketio.sleep)
+# El trabajo bloqueante de puerto serie y flasheo corre fuera del hub
+workers = WorkerPool(hub)
+
+def reset_state(job):
+    jobs.finish(job)
+    # Un trabajo nuevo puede haber creado la subcolección del usuario
+    get_serial_lookup().invalidate(job.numero_serial)
+    print(f"Se limpio el estado del trabajo {job.job_id} ({job.port})")
+
+def job_room(job_id):
+    return f"job:{job_id}"
+
+def emit_status_update(job, status):
+    event = job.set_status(status)
+    #print(f"Emitiendo estado: {status}")
+    # Solo a las estaciones suscritas al trabajo (ver subscribe_job). Se
+    # llama también desde el pool de trabajo, así que se emite desde el hub.
+    hub.call_soon(socketio.emit, "job_status_update", event, to=job_room(job.job_id))
+
+def make_progress_emitter(job):
+    """Callback de progreso de esptool que reenvía los eventos al trabajo."""
+
+    def emit_progress(event):
+        data = event.to_dict()
+        data.update(job_id=job.job_id, port=job.port)
+        hub.call_soon(socketio.emit, "job_progress", data, to=job_room(job.job_id))
+
+    # A lo sumo dos eventos por segundo por trabajo
+    return ProgressReporter(emit_progress, interval=PROGRESS_INTERVAL)
+
+@socketio.on("subscribe_job")
+def subscribe_job(data):
+    """
+    Suscribe al cliente a los eventos de un trabajo y le reenvía los que
+    tengan un número de secuencia mayor que last_seq (por ejemplo, los
+    emitidos mientras estaba desconectado).
+    """
+    job_id = (data or {}).get("job_id")
+    job = jobs.get(job_id) if job_id else None
+    if job is None:
+        return {"status": "error", "message": "Trabajo no encontrado."}
+
+    join_room(job_room(job.job_id))
     try:
-        ids_conocidos = ["1A86:7523", "10C4:EA60", "0403:6001"]
-        ports = serial.tools.list_ports.comports()
-        filtered_ports = [
-            {"device": port.device, "description": port.description, "hwid": port.hwid}
-            for port in ports
-            if any(id_conocido in port.hwid for id_conocido in ids_conocidos)
-        ]
-        return filtered_ports
-    except Exception as e:
-        print(f"Error al listar puertos: {e}")
-        return []
-
-
+        last_seq = int(data.get("last_seq") or 0)
+    except (TypeError, ValueError):
+        last_seq = 0
+    for event in job.events_since(last_seq):
+        emit("job_status_update", event)
+    return {"status": "success", "seq": job.seq, "state": job.state}
+
+def get_flash_session(port):
+    with flash_sessions_lock:
+        session = flash_sessions.get(port)
+        if session is None:
+            session = FlashSession(port, baud=BAUDRATE_PROGRAMACION, chip="esp32")
+            flash_sessions[port] = session
+        return session
+
+def close_flash_session(port):
+    """Cierra el puerto de la sesión, por ejemplo tras un error o al terminar."""
+    with flash_sessions_lock:
+        session = flash_sessions.pop(port, None)
+    if session is not None:
+        try:
+            session.close()
+        except Exception as e:
+            print(f"Error cerrando la sesión del puerto {port}: {e}")
 
-def download_binary(gcs_path):
+def list_serial_ports():
+    # Lista mantenida por el watcher: no escanea los puertos en cada petición
+    return port_watcher.get_ports()
+
+def ports_payload():
+    version, ports = port_watcher.snapshot()
+    return {"version": version, "ports": ports}
+
+def emit_ports_update(version, ports):
+    # Llamado desde el hilo del watcher
+    hub.call_soon(socketio.emit, "update_ports", {"version": version, "ports": ports})
+
+port_watcher.on_change = emit_ports_update
+port_watcher.start()
+# Aquí y no en __main__: con gunicorn el módulo solo se importa, y sin este
+# bucle ningún evento encolado con hub.call_soon llegaría a los clientes
+hub.start(socketio.start_background_task)
+
+@socketio.on("connect")
+def on_connect():
+    # El cliente recibe la lista actual sin tener que pedirla
+    emit("update_ports", ports_payload())
+
+
+def open_firmware_source(gcs_path):
+    """
+    Resuelve un binario de GCS. Devuelve (ruta_objeto, ruta_en_cache, blob);
+    si el binario ya está en la caché, blob es None.
+    """
+    if not gcs_path.startswith("gs://"):
+        raise ValueError("La ruta no es válida para GCS.")
+
+    gcs_path = gcs_path[5:]
+    # Admite la forma gs://bucket/objeto#generacion
+    gcs_path, _, generation = gcs_path.partition("#")
+    generation = generation or None
+    bucket_name, *file_path_parts = gcs_path.split("/")
+    file_path = "/".join(file_path_parts)
+
+    # Con la generación en la ruta no hace falta consultar GCS
+    cached_path = firmware_cache.lookup(gcs_path, generation)
+    if cached_path:
+        return gcs_path, cached_path, None
+
+    bucket = get_storage_client().bucket(bucket_name)
+    # Solo metadatos: la generación identifica el contenido del objeto
+    blob = bucket.get_blob(file_path, generation=generation)
+    if blob is None:
+        raise FileNotFoundError(f"No existe el binario gs://{gcs_path} en GCS.")
+
+    if generation is None:
+        cached_path = firmware_cache.lookup(gcs_path, blob.generation)
+        if cached_path:
+            return gcs_path, cached_path, None
+    return gcs_path, None, blob
+
+def download_binary(gcs_path, destination_path):
     try:
-        if not gcs_path.startswith("gs://"):
-            raise ValueError("La ruta no es válida para GCS.")
-
-        gcs_path = gcs_path[5:]
-        bucket_name, *file_path_parts = gcs_path.split("/")
-        file_path = "/".join(file_path_parts)
-
-        # Usar credenciales decodificadas
-        storage_client = storage.Client.from_service_account_info(decoded_credentials)
-        bucket = storage_client.bucket(bucket_name)
-        blob = bucket.blob(file_path)
-        blob.download_to_filename(TEMP_BIN_PATH)
-        return TEMP_BIN_PATH
+        object_path, cached_path, blob = open_firmware_source(gcs_path)
+        if not cached_path:
+            temp_path = firmware_cache.new_temp_path()
+            try:
+                blob.download_to_filename(temp_path)
+                cached_path = firmware_cache.store(
+                    object_path, blob.generation, temp_path, blob.md5_hash
+                )
+            finally:
+                # store() lo movió a la caché; si falló, no debe quedar el .part
+                firmware_cache.discard_temp(temp_path)
+        shutil.copyfile(cached_path, destination_path)
+        return destination_path
     except Exception as e:
         print(f"Error descargando binario desde GCS: {e}")
         raise
@@ -242,102 +342,104 @@ def verify_token(token):
         print(f"Error verificando el token: {e}")
         return None
 
-def listen_to_job_status(user, uuid, port):
-    global numero_serial
-    global current_job_status
-    document_path = f"logs/{numero_serial}/{user}/{uuid}"
+def listen_to_job_status(job):
+    document_path = f"logs/{job.numero_serial}/{job.user}/{job.job_id}"
     #print(f"Escuchando logs en: {document_path}")
 
-    # Verifica si ya existe un listener activo para este documento
-    if document_path in listeners:
-        #print(f"Eliminando listener previo para {document_path}")
-        listeners[document_path].unsubscribe()
-        del listeners[document_path]
+    # Verifica si ya existe un listener activo para este trabajo
+    if job.listener is not None:
+        job.listener.unsubscribe()
+        job.listener = None
 
     def on_snapshot(doc_snapshot, changes, read_time):
-        global current_job_status
-
+        # El log del serial cambió: la búsqueda del más reciente ya no vale
+        get_serial_lookup().invalidate(job.numero_serial)
         with app.app_context():
             for doc in doc_snapshot:
                 if doc.exists:
                     log_data = doc.to_dict()
                     job_status = log_data.get("status", "unknown")
-                    current_job_status = job_status
                     #print(f"Estado actualizado del job: {job_status}")
 
                     try:
+                        # Todo estado pasa por emit_status_update: un número de
+                        # secuencia sin evento haría que la estación se vuelva a suscribir
                         if job_status == "success":
-                            current_job_status = "Success"
+                            emit_status_update(job, "Success")
                         elif job_status == "completed":
+                            # Un snapshot repetido no debe volver a programar el equipo
+                            if not job.transition(ESTADO_DESCARGANDO):
+                                continue
                             print("El proceso se completó con éxito.")
-                            emit_status_update("completed")
-                            if port:
-                                program_device_thread(port, log_data)
+                            emit_status_update(job, "completed")
+                            # Fuera del hilo del listener y del hub
+                            workers.submit(job.port, program_device_thread, job, log_data)
+                        else:
+                            emit_status_update(job, job_status)
 
                     except Exception as e:
                         error_message = f"Error en la programación del taxímetro WavesByte Cibtron WB-001: {str(e)}"
-                        emit_status_update(error_message)
+                        emit_status_update(job, error_message)
                 else:
                     print("El documento ya no existe.")
 
-    # Crea un nuevo listener y guárdalo en el diccionario
-    listener = db.document(document_path).on_snapshot(on_snapshot)
-    listeners[document_path] = listener
+    # Crea un nuevo listener y lo asocia al trabajo
+    job.listener = db.document(document_path).on_snapshot(on_snapshot)
 
-def program_device_thread(port, log_data):
-    global current_job_status
-    global is_programming
+def program_device_thread(job, log_data):
     try:
         with app.app_context():
             binary_path = log_data.get("path")
-            if binary_path:
-                emit_status_update("Descargando Recursos...")
-                current_job_status = "Descargando Recursos..."
-                download_binary(binary_path)
-
-            current_job_status = "Programando WavesByte Cibtron WB-001..."
-            program_status = program_esp32(port)
-            current_job_status = program_status
-            current_job_status = "Programación completa."
-            current_job_status = "Finalizado"
-            time.sleep(3)
-            reset_state()
+            if binary_path and FIRMWARE_STREAMING:
+                job.transition(ESTADO_PROGRAMANDO)
+                emit_status_update(job, "Descargando y programando WavesByte Cibtron WB-001...")
+                program_status = stream_and_program_esp32(
+                    job.port, binary_path, make_progress_emitter(job)
+                )
+            else:
+                if binary_path:
+                    emit_status_update(job, "Descargando Recursos...")
+                    download_binary(binary_path, job.firmware_path)
+
+                job.transition(ESTADO_PROGRAMANDO)
+                emit_status_update(job, "Programando WavesByte Cibtron WB-001...")
+                program_status = program_esp32(
+                    job.port, job.firmware_path, make_progress_emitter(job)
+                )
+            emit_status_update(job, program_status)
+            job.transition(ESTADO_FINALIZADO)
+            emit_status_update(job, "Finalizado")
+            reset_state(job)
 
     except Exception as e:
         with app.app_context():
             error_message = f"Error en la programación del taxímetro WavesByte Cibtron WB-001: {str(e)}"
-            emit_status_update(error_message)
-            emit_status_update("Error")
-            reset_state()
-
-def program_esp32(port, baud_rate="115200"):
-    global current_job_status
+            emit_status_update(job, error_message)
+            job.transition(ESTADO_ERROR)
+            emit_status_update(job, "Error")
+            reset_state(job)
+    finally:
+        close_flash_session(job.port)
+
+def program_esp32(port, firmware_path, progress_callback=None):
     try:
-        if not os.path.isfile(TEMP_BIN_PATH):
+        if not os.path.isfile(firmware_path):
             raise FileNotFoundError(
-                f"El archivo firmware.bin no se encuentra en la ruta especificada: {TEMP_BIN_PATH}"
+                f"El archivo de firmware no se encuentra en la ruta especificada: {firmware_path}"
             )
 
-        command = [
-            "--port",
-            port,
-            "--baud",
-            baud_rate,
-            "write_flash",
-            "--flash_mode",
-            "dio",
-            "--flash_size",
-            "4MB",
-            "0x10000",
-            TEMP_BIN_PATH,
-        ]
-        #print("Ejecutando esptool con los siguientes argumentos:", command)
-        sys.argv = ["esptool.py"] + command
-        esptool_main()
+        session = get_flash_session(port)
+        session.write(
+            [(0x10000, firmware_path)],
+            flash_mode="dio",
+            flash_size="4MB",
+            progress_callback=progress_callback,
+        )
+        session.hard_reset()
 
         # Eliminar el archivo binario tras la programación
-        os.remove(TEMP_BIN_PATH)
-        #print(f"Archivo binario eliminado: {TEMP_BIN_PATH}")
+        os.remove(firmware_path)
+        #print(f"Archivo binario eliminado: {firmware_path}")
 
         return "WavesByte Cibtron WB-001 programado exitosamente."
     except Exception as e:
@@ -345,6 +447,32 @@ def program_esp32(port, baud_rate="115200"):
 
 
 
+def stream_and_program_esp32(port, gcs_path, progress_callback=None):
+    """
+    Programa el ESP32 mientras se descarga el binario: los bloques leídos de
+    GCS pasan por una cola acotada directamente al compresor y a la flash.
+    """
+    object_path, cached_path, blob = open_firmware_source(gcs_path)
+    pipe = ChunkPipe()
+    if cached_path:
+        size = os.path.getsize(cached_path)
+        chunks = iter_file_chunks(cached_path)
+    else:
+        size = blob.size
+        start_blob_download(blob, pipe, firmware_cache, object_path)
+        chunks = pipe
+
+    try:
+        flash_stream(
+            get_flash_session(port), 0x10000, size, chunks, progress_callback=progress_callback
+        )
+    finally:
+        # Detiene la descarga si el flasheo terminó con error
+        pipe.cancel()
+    return "WavesByte Cibtron WB-001 programado exitosamente."
+
+
+
 @app.route("/login", methods=["GET"])
 def login_page():
     return render_template("login.html", api_key=CIBTRON_API)
@@ -395,51 +523,54 @@ def logout():
 
 @app.route("/execute_and_program", methods=["POST"])
 def execute_and_program():
-    global current_job_status, monitor_thread, is_programming, numero_serial
-    if is_programming:
-        return jsonify({"status": "error", "message": "Ya hay un trabajo en curso."})
+    parameters = request.form.to_dict()
+    port = parameters.get("port")
+    if not port:
+        return jsonify(
+            {
+                "status": "error",
+                "message": "Debe seleccionar un puerto antes de ejecutar el trabajo.",
+            }
+        )
 
-    if numero_serial == "ERROR":
+    numero_serial = seriales_por_puerto.get(port) or parameters.get("NUMERO_SERIAL")
+    if not numero_serial or numero_serial == "ERROR":
         return jsonify({"status": "error", "message": "No se puede programar con un número de serie inválido."})
 
     try:
-        is_programming = True
-        current_job_status = "Listo"
-        parameters = request.form.to_dict()
+        job = jobs.create(
+            port, parameters.get("USER"), numero_serial, job_id=parameters.get("UUID")
+        )
+    except PuertoOcupadoError as e:
+        return jsonify({"status": "error", "message": str(e)})
+
+    try:
         project_id = "wavesbyte-taximetro"
         region = "us-central1"
         job_name = "esp32-compiler"
-        user = parameters.get("USER")
-        uuid_val = parameters.get("UUID")
         args = ["/workspace/compile_and_upload.py"]
 
-        port = parameters.get("port")
-        if not port:
-            return jsonify(
-                {
-                    "status": "error",
-                    "message": "Debe seleccionar un puerto antes de ejecutar el trabajo.",
-                }
-            )
-
-        emit_status_update("Compilando WavesByte Cibtron WB-001...")
+        job.transition(ESTADO_COMPILANDO)
+        emit_status_update(job, "Compilando WavesByte Cibtron WB-001...")
         run_job_with_rest_api(project_id, region, job_name, parameters, args)
-        monitor_thread = socketio.start_background_task(listen_to_job_status, user, uuid_val, port)
+        socketio.start_background_task(listen_to_job_status, job)
         return jsonify(
             {
                 "status": "success",
                 "message": "Cloud Run Job iniciado y monitoreando Firebase.",
+                "job_id": job.job_id,
             }
         )
     except Exception as e:
         error_message = f"Error al ejecutar el trabajo: {str(e)}"
         print(error_message)
-        reset_state()
+        job.transition(ESTADO_ERROR)
+        emit_status_update(job, error_message)
+        reset_state(job)
         return jsonify({"status": "error", "message": error_message})
 
 @app.route("/search_serial", methods=["GET"])
 def search_serial():
-    global numero_serial
     serial_number = request.args.get("serial_number")
     if not serial_number:
         return (
@@ -451,7 +582,6 @@ def search_serial():
         from lector_firestore import get_most_recent_document_by_serial
 
         result = get_most_recent_document_by_serial(serial_number)
-        numero_serial = serial_number
         if result:
             return jsonify({"status": "success", "data": result})
         else:
@@ -471,6 +601,12 @@ def search_serial():
 
 @app.route("/search_certificates", methods=["GET"])
 def search_certificates():
+    """
+    Historial de certificados de un serial, del más reciente al más antiguo.
+    Por defecto devuelve una página (page_size, cursor) y el cursor de la
+    siguiente; con format=ndjson envía un documento por línea a medida que
+    se leen de Firestore.
+    """
     serial_number = request.args.get("serial_number")
     if not serial_number:
         return (
@@ -478,18 +614,33 @@ def search_certificates():
             400,
         )
 
+    cursor = request.args.get("cursor") or None
     try:
-        from lector_firestore2 import get_all_documents_by_serial
+        page_size = int(request.args.get("page_size", DEFAULT_PAGE_SIZE))
+    except ValueError:
+        return jsonify({"status": "error", "message": "page_size inválido."}), 400
 
+    try:
         print(f"Buscando certificados para el número serial: {serial_number}")
 
-        result = get_all_documents_by_serial(serial_number)
-        print(f"Resultados obtenidos: {result}")
+        if request.args.get("format") == "ndjson":
+            documents = iter_documents_by_serial(serial_number, cursor)
 
-        if result:
-            return jsonify({"status": "success", "data": result})
-        else:
-            return jsonify({"status": "success", "data": []})
+            def generate():
+                try:
+                    for doc_data in documents:
+                        yield app.json.dumps(doc_data) + "\n"
+                except Exception as e:
+                    print(f"Error al enviar certificados: {e}")
+                    yield app.json.dumps({"status": "error", "message": str(e)}) + "\n"
+
+            return Response(stream_with_context(generate()), mimetype="application/x-ndjson")
+
+        result, next_cursor = get_documents_page(serial_number, page_size, cursor)
+        print(f"Certificados obtenidos: {len(result)}")
+        return jsonify({"status": "success", "data": result, "next_cursor": next_cursor})
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
     except Exception as e:
         print(f"Error al buscar certificados: {e}")
         return jsonify({"status": "error", "message": f"Error interno: {str(e)}"}), 500
@@ -497,25 +648,14 @@ def search_certificates():
 @app.route("/get_ports", methods=["GET"])
 def get_ports():
     try:
-        ports = list_serial_ports()
-        ids_conocidos = ["1A86:7523", "10C4:EA60", "0403:6001"]
-        current_ports = [
-            {
-                "device": port["device"],
-                "description": port["description"],
-                "hwid": port["hwid"],
-            }
-            for port in ports
-            if any(id_conocido in port["hwid"] for id_conocido in ids_conocidos)
-        ]
-        return jsonify({"status": "success", "ports": current_ports})
+        payload = ports_payload()
+        return jsonify({"status": "success", **payload})
     except Exception as e:
         print(f"Error al obtener los puertos: {e}")
         return jsonify({"status": "error", "message": str(e)})
 
 @app.route("/get_serial_number", methods=["POST"])
 def get_serial_number():
-    global numero_serial
     data = request.json
     port = data.get("port")
 
@@ -523,13 +663,14 @@ def get_serial_number():
         return jsonify({"status": "error", "message": "Puerto no proporcionado."}), 400
 
     try:
-        BAUDRATE = 115200
         TIMEOUT = 5
 
-        serial_number = restart_and_get_value(port, BAUDRATE, TIMEOUT)
-        numero_serial = serial_number.upper()
+        session = get_flash_session(port)
+        line = workers.run(port, session.read_serial_monitor, "NUMERO_SERIAL", TIMEOUT)
+        serial_number = line.split(":")[1].strip() if line and ":" in line else None
 
         if serial_number:
+            seriales_por_puerto[port] = serial_number.upper()
             return jsonify({"status": "success", "serial_number": serial_number})
         else:
             return (
@@ -543,6 +684,7 @@ def get_serial_number():
             )
     except Exception as e:
         print(f"Error al obtener el número de serie: {e}")
+        close_flash_session(port)
         return jsonify({"status": "error", "message": str(e)}), 500
 
 @app.route("/check_port_status", methods=["POST"])
@@ -554,13 +696,13 @@ def check_port_status():
         return jsonify({"status": "error", "message": "Puerto no proporcionado."}), 400
 
     try:
-        ports = list_serial_ports()
-        port_devices = [p["device"] for p in ports]
-
-        if port in port_devices:
-            return jsonify({"status": "success", "connected": True})
-        else:
-            return jsonify({"status": "success", "connected": False})
+        return jsonify(
+            {
+                "status": "success",
+                "connected": port_watcher.is_connected(port),
+                "version": port_watcher.version,
+            }
+        )
     except Exception as e:
         print(f"Error al verificar el puerto: {e}")
         return jsonify({"status": "error", "message": str(e)}), 500
@@ -568,8 +710,31 @@ def check_port_status():
 
 @app.route("/get_job_status", methods=["GET"])
 def get_job_status():
-    global current_job_status
-    return jsonify({"status": current_job_status})
+    job_id = request.args.get("job_id")
+    port = request.args.get("port")
+    if job_id:
+        job = jobs.get(job_id)
+    elif port:
+        job = jobs.get_by_port(port)
+    else:
+        job = jobs.latest()
+
+    if job is None:
+        return jsonify({"status": "Listo"})
+    data = job.to_dict(include_history=True)
+    # Respaldo sin Socket.IO: since=N devuelve solo los eventos posteriores
+    since = request.args.get("since", type=int)
+    if since is not None:
+        data["history"] = job.events_since(since)
+    return jsonify(data)
+
+@app.route("/firmware_cache_stats", methods=["GET"])
+def firmware_cache_stats():
+    return jsonify({"status": "success", "stats": firmware_cache.get_stats()})
+
+@app.route("/jobs", methods=["GET"])
+def list_jobs():
+    return jsonify({"status": "success", "jobs": [job.to_dict() for job in jobs.all_jobs()]})
 
 @app.route("/get_user_data", methods=["GET"])
 def get_user_data():
@@ -589,11 +754,17 @@ def reset_cibtron_route():
         return jsonify({"status": "error", "message": "Port no proporcionado"}), 400
 
     try:
-        resetcibtron(port, firmware_path)
+        workers.run(
+            port,
+            functools.partial(resetcibtron, session=get_flash_session(port)),
+            port,
+            firmware_path,
+        )
         return jsonify({"status": "success", "message": "Reset completado con éxito"})
     except Exception as e:
         error_message = f"Error al realizar el reset: {str(e)}"
         print(error_message)
+        close_flash_session(port)
         return jsonify({"status": "error", "message": error_message}), 500
 
 
@@ -0,0 +1,95 @@
+# SPDX-FileCopyrightText: 2014-2022 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""ESPLoader.checksum against the byte-by-byte loop it replaced.
+
+Checks both give the same result for every length up to a few hundred
+bytes, then times them on every block size used by the ROM and stub
+loaders of all chips (FLASH_WRITE_SIZE, ESP_RAM_BLOCK) and on whole
+segment sizes, as used by BaseFirmwareImage.calculate_checksum.
+
+Usage: python benchmarks/bench_checksum.py [--repeat 5]
+"""
+
+import argparse
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from esptool.loader import ESPLoader  # noqa: E402
+from esptool.targets import CHIP_DEFS  # noqa: E402
+
+# Typical IRAM/DRAM/flash segment sizes of an application image
+SEGMENT_SIZES = [0x4000, 0x20000, 0x100000]
+
+
+def legacy_checksum(data, state=ESPLoader.ESP_CHECKSUM_MAGIC):
+    """ESPLoader.checksum before XOR-folding"""
+    for b in data:
+        state ^= b
+    return state
+
+
+def block_sizes():
+    """{size: [where it is used]} for all ROM and stub loader classes"""
+    sizes = {}
+    for chip in CHIP_DEFS.values():
+        for cls in (chip, getattr(chip, "STUB_CLASS", None)):
+            if cls is None:
+                continue
+            for attr in ("FLASH_WRITE_SIZE", "ESP_RAM_BLOCK"):
+                sizes.setdefault(getattr(cls, attr), set()).add(attr)
+    for size in SEGMENT_SIZES:
+        sizes.setdefault(size, set()).add("segment")
+    return sizes
+
+
+def check_equivalence():
+    for size in list(range(0, 300)) + [0x3FFF, 0x4001]:
+        data = os.urandom(size)
+        for state in (ESPLoader.ESP_CHECKSUM_MAGIC, 0, 0x5A):
+            expected = legacy_checksum(data, state)
+            assert ESPLoader.checksum(data, state) == expected, size
+            assert ESPLoader.checksum(memoryview(data), state) == expected, size
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    check_equivalence()
+    print("checksum results match the byte-by-byte loop")
+    print(
+        "%9s %-28s %12s %12s %8s"
+        % ("size", "used as", "legacy us", "current us", "speedup")
+    )
+    for size, uses in sorted(block_sizes().items()):
+        data = os.urandom(size)
+        number = max(1, 0x100000 // size)
+        timings = []
+        for checksum in (legacy_checksum, ESPLoader.checksum):
+            best = min(
+                timeit.repeat(
+                    lambda: checksum(data), number=number, repeat=args.repeat
+                )
+            )
+            timings.append(best / number * 1e6)
+        print(
+            "%9d %-28s %12.1f %12.1f %7.1fx"
+            % (
+                size,
+                ", ".join(sorted(uses)),
+                timings[0],
+                timings[1],
+                timings[0] / timings[1],
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,116 @@
+# SPDX-FileCopyrightText: 2014-2022 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Link throughput measured during stub upload, as the stub loader reports it.
+
+Uploads the real ESP32 flasher stub through ESPLoader.run_stub() to a
+simulated ROM loader on a serial link which charges the wire time of every
+byte plus a fixed latency per command, as USB-serial adapters do. Checks that
+the stub loader returned by run_stub() reports the throughput measured during
+the upload, not the nominal wire speed: that is what --compress-level auto
+prices the first image with.
+
+Usage: python benchmarks/bench_link_throughput.py [--baud 115200] [--latency 1,4,16]
+"""
+
+import argparse
+import io
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from esptool.loader import slip_encode, slip_reader  # noqa: E402
+from esptool.targets import ESP32ROM  # noqa: E402
+
+
+class SimulatedLink(object):
+    """Serial port to a ROM loader answering every command after a latency"""
+
+    def __init__(self, baud, latency):
+        self.baudrate = baud
+        self.latency = latency
+        self.timeout = 3
+        self._replies = []  # [time the reply has fully arrived, bytes]
+
+    def flushInput(self):
+        self._replies = []
+
+    def inWaiting(self):
+        return sum(len(r) for t, r in self._replies if t <= time.perf_counter())
+
+    def write(self, buf):
+        time.sleep(len(buf) * 10.0 / self.baudrate)  # 8N1
+        for frame in bytes(buf).split(b"\xc0"):
+            if not frame:
+                continue
+            op = frame[1]
+            reply = slip_encode(struct.pack("<BBHI", 1, op, 4, 0) + b"\x00" * 4)
+            if op == ESP32ROM.ESP_MEM_END:
+                reply += slip_encode(b"OHAI")
+            self._replies.append([time.perf_counter() + self.latency, reply])
+
+    def read(self, size=1):
+        if not self._replies:
+            return b""
+        ready, reply = self._replies[0]
+        wait = ready - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        data = reply[:size]
+        if len(data) == len(reply):
+            self._replies.pop(0)
+        else:
+            self._replies[0][1] = reply[size:]
+        return data
+
+
+def upload_stub(link):
+    rom = ESP32ROM.__new__(ESP32ROM)
+    rom._port = link
+    rom._trace_enabled = False
+    rom._slip_reader = slip_reader(link, rom.trace)
+    rom.cache = {}
+    rom.secure_download_mode = False
+    rom.sync_stub_detected = False
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()  # run_stub progress lines
+    try:
+        stub = rom.run_stub()
+    finally:
+        sys.stdout = stdout
+    return rom, stub
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument(
+        "--latency", default="1,4,16", help="comma separated latencies in ms"
+    )
+    args = parser.parse_args()
+
+    print("%7s %12s %12s %11s" % ("latency", "nominal kB/s", "stub kB/s", "efficiency"))
+    for latency in [float(ms) / 1000 for ms in args.latency.split(",")]:
+        rom, stub = upload_stub(SimulatedLink(args.baud, latency))
+        nominal = args.baud / 10.0
+        measured = stub.link_throughput()
+        assert rom.link_efficiency() is not None, "no samples during upload"
+        assert measured == rom.link_throughput() < nominal, (measured, nominal)
+        print(
+            "%5.0fms %12.1f %12.1f %10.1f%%"
+            % (
+                latency * 1000,
+                nominal / 1000,
+                measured / 1000,
+                measured / nominal * 100,
+            )
+        )
+
+
+if __name__ == "__main__":
+    main()
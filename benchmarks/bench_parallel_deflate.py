@@ -0,0 +1,91 @@
+# SPDX-FileCopyrightText: 2014-2022 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""util.parallel_compress against single-threaded zlib.compress.
+
+Compresses a firmware-like image (compressible code and data, random data,
+erased 0xFF padding) with zlib.compress(image, level), the path write_flash
+used before, and with parallel_compress for several worker counts. Prints
+wall time and compressed size, and checks every stream inflates back to
+the image, also when fed to the inflater block by block as the stub does.
+
+Usage: python benchmarks/bench_parallel_deflate.py [--mb 4] [--level 9]
+"""
+
+import argparse
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from esptool.util import parallel_compress  # noqa: E402
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+# Block size of the stub's compressed writes (FLASH_WRITE_SIZE)
+BLOCK_SIZE = 0x4000
+
+
+def firmware_like(size):
+    """Half repository sources (text-like), a quarter random, the rest 0xFF"""
+    sources = b""
+    for root, _, files in os.walk(os.path.join(ROOT, "esptool")):
+        for name in sorted(files):
+            if name.endswith(".py"):
+                with open(os.path.join(root, name), "rb") as f:
+                    sources += f.read()
+    code = (sources * (size // max(len(sources), 1) + 1))[: size // 2]
+    noise = os.urandom(size // 4)
+    return code + noise + b"\xff" * (size - len(code) - len(noise))
+
+
+def inflate_blockwise(stream):
+    decompress = zlib.decompressobj()
+    out = [
+        decompress.decompress(stream[i : i + BLOCK_SIZE])
+        for i in range(0, len(stream), BLOCK_SIZE)
+    ]
+    assert decompress.eof, "stream not terminated"
+    return b"".join(out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=int, default=4, help="image size in MB")
+    parser.add_argument("--level", type=int, default=9)
+    parser.add_argument(
+        "--workers",
+        default=",".join(str(n) for n in sorted({2, 4, os.cpu_count() or 1})),
+        help="comma separated worker counts",
+    )
+    args = parser.parse_args()
+
+    image = firmware_like(args.mb * 1024 * 1024)
+    print("%d MB image, level %d, %d CPUs" % (args.mb, args.level, os.cpu_count()))
+    print("%-22s %10s %12s %8s" % ("compressor", "time s", "size", "ratio"))
+
+    runs = [("zlib.compress", lambda: zlib.compress(image, args.level))]
+    for workers in [int(n) for n in args.workers.split(",")]:
+        runs.append(
+            (
+                "parallel, %d workers" % workers,
+                lambda workers=workers: parallel_compress(image, args.level, workers),
+            )
+        )
+    for name, compress in runs:
+        t = time.perf_counter()
+        stream = compress()
+        t = time.perf_counter() - t
+        assert zlib.decompress(stream) == image, name
+        assert inflate_blockwise(stream) == image, name
+        print(
+            "%-22s %10.2f %12d %7.1f%%"
+            % (name, t, len(stream), len(stream) * 100.0 / len(image))
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,175 @@
+# SPDX-FileCopyrightText: 2014-2022 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Chip identification time with single READ_REG round trips and batched reads.
+
+Runs what esptool prints after connecting (get_chip_description,
+get_chip_features, get_crystal_freq, read_mac) through the real ESPLoader
+command path against a simulated ROM loader, once reading registers one
+at a time as before and once inside prefetched_regs(), which sends the
+READ_REG requests back-to-back. The simulated link charges the wire time
+of every byte at the given baud rate plus a fixed latency per direction
+change, as USB-serial adapters do (1 ms for most CP210x/CH340 setups, up to
+16 ms with the default FTDI latency timer). Both runs must report the same
+chip. A last run on a link which drops all but the first reply of each burst
+checks that identification falls back to single reads.
+
+Usage: python benchmarks/bench_read_regs.py [--baud 115200] [--latency 1,4,16]
+"""
+
+import argparse
+import io
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from esptool.loader import slip_encode, slip_reader  # noqa: E402
+from esptool.targets import ESP32C3ROM, ESP32ROM, ESP32S3ROM  # noqa: E402
+
+
+class SimulatedLink(object):
+    """Serial port to a ROM loader answering READ_REG after a latency"""
+
+    def __init__(self, baud, latency, status_length, regs, drop_replies=False):
+        self.baudrate = baud
+        self.latency = latency
+        self.status = b"\x00" * status_length
+        self.regs = regs
+        self.drop_replies = drop_replies  # only answer the first of a burst
+        self.timeout = 3
+        self.requests = 0
+        self._replies = []  # [time the reply has fully arrived, bytes]
+        self._busy_until = 0.0  # end of the chip's transmission
+
+    def _wire_time(self, size):
+        return size * 10.0 / self.baudrate  # 8N1
+
+    def flushInput(self):
+        self._replies = []
+
+    def inWaiting(self):
+        return sum(len(r) for t, r in self._replies if t <= time.perf_counter())
+
+    def write(self, buf):
+        arrived = time.perf_counter() + self.latency
+        time.sleep(self._wire_time(len(buf)))
+        for i, frame in enumerate(f for f in bytes(buf).split(b"\xc0") if f):
+            if i and self.drop_replies:
+                continue
+            pkt = frame.replace(b"\xdb\xdc", b"\xc0").replace(b"\xdb\xdd", b"\xdb")
+            _, op, _, _ = struct.unpack("<BBHI", pkt[:8])
+            (addr,) = struct.unpack("<I", pkt[8:12])
+            self.requests += 1
+            arrived += self._wire_time(len(frame) + 2)
+            reply = slip_encode(
+                struct.pack("<BBHI", 1, op, len(self.status), self.regs.get(addr, 0))
+                + self.status
+            )
+            self._busy_until = max(self._busy_until, arrived) + self._wire_time(
+                len(reply)
+            )
+            self._replies.append([self._busy_until + self.latency, reply])
+
+    def read(self, size=1):
+        if not self._replies:
+            return b""
+        ready, reply = self._replies[0]
+        wait = ready - time.perf_counter()
+        if wait > 0:
+            time.sleep(wait)
+        data = reply[:size]
+        if len(data) == len(reply):
+            self._replies.pop(0)
+        else:
+            self._replies[0][1] = reply[size:]
+        return data
+
+
+def identify(cls, link, batched):
+    esp = cls.__new__(cls)
+    esp._port = link
+    esp._trace_enabled = False
+    esp._slip_reader = slip_reader(link, esp.trace)
+    esp.cache = {}
+    esp.secure_download_mode = False
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()  # warnings of the helpers
+    try:
+        t = time.perf_counter()
+        if batched:
+            with esp.prefetched_regs(esp.get_identification_regs()):
+                result = identify_calls(esp)
+        else:
+            result = identify_calls(esp)
+        t = time.perf_counter() - t
+    finally:
+        sys.stdout = stdout
+    return t, result
+
+
+def identify_calls(esp):
+    return (
+        esp.get_chip_description(),
+        esp.get_chip_features(),
+        esp.get_crystal_freq(),
+        esp.read_mac(),
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--baud", type=int, default=115200)
+    parser.add_argument(
+        "--latency", default="1,4,16", help="comma separated latencies in ms"
+    )
+    args = parser.parse_args()
+
+    print(
+        "%-9s %7s %9s %9s %9s %9s %7s"
+        % ("chip", "latency", "single", "requests", "batched", "requests", "speedup")
+    )
+    for cls in (ESP32ROM, ESP32S3ROM, ESP32C3ROM):
+        # Non-zero MAC words and a UART divider matching a 40 MHz crystal
+        mac_reg = getattr(cls, "MAC_EFUSE_REG", cls.EFUSE_RD_REG_BASE + 4)
+        regs = {
+            mac_reg: 0x12345678,
+            mac_reg + 4: 0x9ABC,
+            cls.UART_CLKDIV_REG: int(40e6 * cls.XTAL_CLK_DIVIDER / args.baud),
+        }
+        for latency in [float(ms) / 1000 for ms in args.latency.split(",")]:
+            runs = []
+            for batched in (False, True):
+                link = SimulatedLink(args.baud, latency, cls.STATUS_BYTES_LENGTH, regs)
+                t, result = identify(cls, link, batched)
+                runs.append((t, link.requests, result))
+            assert runs[0][2] == runs[1][2], (runs[0][2], runs[1][2])
+            print(
+                "%-9s %5.0fms %8.1fms %9d %8.1fms %9d %6.1fx"
+                % (
+                    cls.CHIP_NAME,
+                    latency * 1000,
+                    runs[0][0] * 1000,
+                    runs[0][1],
+                    runs[1][0] * 1000,
+                    runs[1][1],
+                    runs[0][0] / runs[1][0],
+                )
+            )
+        link = SimulatedLink(
+            args.baud, 0.0, cls.STATUS_BYTES_LENGTH, regs, drop_replies=True
+        )
+        result = identify(cls, link, True)[1]
+        assert result == runs[0][2], (result, runs[0][2])
+        print(
+            "%-9s dropped replies: identified with %d requests"
+            % (cls.CHIP_NAME, link.requests)
+        )
+
+
+if __name__ == "__main__":
+    main()
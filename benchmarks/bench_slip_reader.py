@@ -0,0 +1,237 @@
+# SPDX-FileCopyrightText: 2014-2022 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Microbenchmark for esptool.loader.slip_reader.
+
+Decodes synthetic serial traffic shaped like a READ_FLASH session (4 KB data
+packets with random payload, so all SLIP escapes occur, interleaved with
+short command responses) through the current slip_reader and the previous
+byte-at-a-time implementation, checks that both yield the same packets and
+raise the same errors on corrupt input, and prints the time per MB.
+
+Usage: python benchmarks/bench_slip_reader.py [--mb N] [--read-size BYTES]
+"""
+
+import argparse
+import os
+import random
+import re
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from esptool.loader import HexFormatter, slip_reader  # noqa: E402
+from esptool.util import FatalError, hexify  # noqa: E402
+
+
+def legacy_slip_reader(port, trace_function):
+    """Generator to read SLIP packets from a serial port.
+    Yields one full SLIP packet at a time, raises exception on timeout or invalid data.
+
+    Designed to avoid too many calls to serial.read(1), which can bog
+    down on slow systems.
+    """
+
+    def detect_panic_handler(input):
+        """
+        Checks the input bytes for panic handler messages.
+        Raises a FatalError if Guru Meditation or Fatal Exception is found, as both
+        of these are used between different ROM versions.
+        Tries to also parse the error cause (e.g. IllegalInstruction).
+        """
+
+        guru_meditation = (
+            rb"G?uru Meditation Error: (?:Core \d panic'ed \(([a-zA-Z ]*)\))?"
+        )
+        fatal_exception = rb"F?atal exception \(\d+\): (?:([a-zA-Z ]*)?.*epc)?"
+
+        # Search either for Guru Meditation or Fatal Exception
+        data = re.search(
+            rb"".join([rb"(?:", guru_meditation, rb"|", fatal_exception, rb")"]),
+            input,
+            re.DOTALL,
+        )
+        if data is not None:
+            cause = [
+                "({})".format(i.decode("utf-8"))
+                for i in [data.group(1), data.group(2)]
+                if i is not None
+            ]
+            cause = f" {cause[0]}" if len(cause) else ""
+            msg = f"Guru Meditation Error detected{cause}"
+            raise FatalError(msg)
+
+    partial_packet = None
+    in_escape = False
+    successful_slip = False
+    while True:
+        waiting = port.inWaiting()
+        read_bytes = port.read(1 if waiting == 0 else waiting)
+        if read_bytes == b"":
+            if partial_packet is None:  # fail due to no data
+                msg = (
+                    "Serial data stream stopped: Possible serial noise or corruption."
+                    if successful_slip
+                    else "No serial data received."
+                )
+            else:  # fail during packet transfer
+                msg = "Packet content transfer stopped (received {} bytes)".format(
+                    len(partial_packet)
+                )
+            trace_function(msg)
+            raise FatalError(msg)
+        trace_function("Read %d bytes: %s", len(read_bytes), HexFormatter(read_bytes))
+        for b in read_bytes:
+            b = bytes([b])
+            if partial_packet is None:  # waiting for packet header
+                if b == b"\xc0":
+                    partial_packet = b""
+                else:
+                    trace_function("Read invalid data: %s", HexFormatter(read_bytes))
+                    remaining_data = port.read(port.inWaiting())
+                    trace_function(
+                        "Remaining data in serial buffer: %s",
+                        HexFormatter(remaining_data),
+                    )
+                    detect_panic_handler(read_bytes + remaining_data)
+                    raise FatalError(
+                        "Invalid head of packet (0x%s): "
+                        "Possible serial noise or corruption." % hexify(b)
+                    )
+            elif in_escape:  # part-way through escape sequence
+                in_escape = False
+                if b == b"\xdc":
+                    partial_packet += b"\xc0"
+                elif b == b"\xdd":
+                    partial_packet += b"\xdb"
+                else:
+                    trace_function("Read invalid data: %s", HexFormatter(read_bytes))
+                    remaining_data = port.read(port.inWaiting())
+                    trace_function(
+                        "Remaining data in serial buffer: %s",
+                        HexFormatter(remaining_data),
+                    )
+                    detect_panic_handler(read_bytes + remaining_data)
+                    raise FatalError("Invalid SLIP escape (0xdb, 0x%s)" % (hexify(b)))
+            elif b == b"\xdb":  # start of escape sequence
+                in_escape = True
+            elif b == b"\xc0":  # end of packet
+                trace_function("Received full packet: %s", HexFormatter(partial_packet))
+                yield partial_packet
+                partial_packet = None
+                successful_slip = True
+            else:  # normal byte in packet
+                partial_packet += b
+
+
+class RecordedPort(object):
+    """Replays captured bytes, returning up to read_size bytes per read"""
+
+    def __init__(self, data, read_size):
+        self.data = data
+        self.pos = 0
+        self.read_size = read_size
+
+    def inWaiting(self):
+        return min(self.read_size, len(self.data) - self.pos)
+
+    def read(self, size=1):
+        chunk = self.data[self.pos : self.pos + size]
+        self.pos += len(chunk)
+        return chunk
+
+
+def slip_frame(packet):
+    return (
+        b"\xc0"
+        + packet.replace(b"\xdb", b"\xdb\xdd").replace(b"\xc0", b"\xdb\xdc")
+        + b"\xc0"
+    )
+
+
+def make_traffic(total_bytes, seed=0):
+    rng = random.Random(seed)
+    packets = []
+    size = 0
+    while size < total_bytes:
+        # READ_FLASH data block followed by a status response
+        packets.append(bytes(rng.getrandbits(8) for _ in range(4096)))
+        packets.append(struct.pack("<BBHI", 1, 0xD2, 2, 0) + b"\x00\x00")
+        size += 4096
+    return packets, b"".join(slip_frame(p) for p in packets)
+
+
+def no_trace(*args):
+    pass
+
+
+def decode_all(reader, data, read_size):
+    port = RecordedPort(data, read_size)
+    packets = []
+    try:
+        for packet in reader(port, no_trace):
+            packets.append(bytes(packet))
+    except FatalError as e:
+        return packets, str(e)
+    return packets, None
+
+
+def check_equivalence(packets, data, read_size):
+    new = decode_all(slip_reader, data, read_size)
+    old = decode_all(legacy_slip_reader, data, read_size)
+    assert new[0] == packets, "decoded packets differ from the originals"
+    assert new == old, "results differ from the previous implementation"
+    corruptions = [
+        data + b"\x00",  # garbage after the last packet
+        b"\x55" + data,  # invalid packet head
+        data[:100] + b"\xdb\x00" + data[100:],  # invalid escape
+        data[:100] + b"\xdb\xc0" + data[100:],  # escape before end of packet
+        data[:-1],  # truncated packet
+        data[:50] + b"Guru Meditation Error: Core 0 panic'ed (LoadProhibited)",
+    ]
+    for corrupt in corruptions:
+        assert decode_all(slip_reader, corrupt, read_size) == decode_all(
+            legacy_slip_reader, corrupt, read_size
+        ), "errors differ from the previous implementation"
+
+
+def bench(reader, data, read_size, repeat):
+    best = None
+    for _ in range(repeat):
+        t = time.perf_counter()
+        decode_all(reader, data, read_size)
+        t = time.perf_counter() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=float, default=1.0, help="MB of payload")
+    parser.add_argument("--read-size", type=int, default=4096)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    packets, data = make_traffic(int(args.mb * 1024 * 1024))
+    check_equivalence(packets, data, args.read_size)
+    # Small reads split packets and escape sequences across reads
+    small_packets = packets[:20]
+    small_data = b"".join(slip_frame(p) for p in small_packets)
+    for read_size in (1, 7, 64):
+        check_equivalence(small_packets, small_data, read_size)
+
+    mb = len(data) / 1024 / 1024
+    old = bench(legacy_slip_reader, data, args.read_size, args.repeat)
+    new = bench(slip_reader, data, args.read_size, args.repeat)
+    print("Traffic: %.2f MB in %d packets" % (mb, len(packets)))
+    print("legacy slip_reader: %8.1f ms/MB" % (old / mb * 1000))
+    print("slip_reader:        %8.1f ms/MB" % (new / mb * 1000))
+    print("speedup:            %8.1fx" % (old / new))
+
+
+if __name__ == "__main__":
+    main()
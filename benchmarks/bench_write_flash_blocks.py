@@ -0,0 +1,120 @@
+# SPDX-FileCopyrightText: 2014-2022 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""Host CPU cost of the write_flash block pipeline versus image size.
+
+Runs the block loop of write_flash (compressed and uncompressed) against a
+loader that discards every block, so only host-side work is measured, and
+compares it with the previous loop that re-sliced the remaining image on
+every block. The current pipeline should stay flat in ms/MB as the image
+grows, the previous one grows linearly (quadratic in total).
+
+Usage: python benchmarks/bench_write_flash_blocks.py [--sizes 1,2,4,8,16]
+"""
+
+import argparse
+import os
+import sys
+import time
+import zlib
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from esptool.cmds import _flash_block_table  # noqa: E402
+from esptool.loader import (  # noqa: E402
+    DEFAULT_TIMEOUT,
+    ERASE_WRITE_TIMEOUT_PER_MB,
+    timeout_per_mb,
+)
+from esptool.util import pad_to  # noqa: E402
+
+
+class NullLoader(object):
+    """Accepts and discards blocks, like a loader on an infinitely fast link"""
+
+    IS_STUB = True
+    FLASH_WRITE_SIZE = 0x4000
+
+    def __init__(self):
+        self.received = 0
+
+    def flash_block(self, data, seq, timeout=DEFAULT_TIMEOUT):
+        self.received += len(data)
+
+    flash_defl_block = flash_block
+
+
+def legacy_loop(esp, image, compress):
+    """The block loop write_flash used before memoryview slicing"""
+    if compress:
+        decompress = zlib.decompressobj()
+    timeout = DEFAULT_TIMEOUT
+    seq = 0
+    while len(image) > 0:
+        block = image[0 : esp.FLASH_WRITE_SIZE]
+        if compress:
+            block_uncompressed = len(decompress.decompress(block))
+            block_timeout = max(
+                DEFAULT_TIMEOUT,
+                timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, block_uncompressed),
+            )
+            esp.flash_defl_block(block, seq, timeout=timeout)
+            timeout = block_timeout
+        else:
+            block = block + b"\xff" * (esp.FLASH_WRITE_SIZE - len(block))
+            esp.flash_block(block, seq)
+        image = image[esp.FLASH_WRITE_SIZE :]
+        seq += 1
+
+
+def current_loop(esp, image, compress):
+    """The block loop of write_flash"""
+    if not compress:
+        image = pad_to(image, esp.FLASH_WRITE_SIZE)
+    image = memoryview(image)
+    table, timeout = _flash_block_table(esp, image, compress)
+    for seq, (offset, length, _, block_timeout) in enumerate(table):
+        block = image[offset : offset + length]
+        if compress:
+            esp.flash_defl_block(block, seq, timeout=block_timeout)
+        else:
+            esp.flash_block(block, seq)
+
+
+def measure(loop, image, compress, repeat):
+    best = None
+    for _ in range(repeat):
+        esp = NullLoader()
+        t = time.process_time()
+        loop(esp, image, compress)
+        t = time.process_time() - t
+        best = t if best is None else min(best, t)
+    return best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", default="1,2,4,8,16", help="image sizes in MB")
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    print("%8s %6s %14s %14s" % ("size", "mode", "legacy ms/MB", "current ms/MB"))
+    for mb in [int(x) for x in args.sizes.split(",")]:
+        # Half random, half erased: realistic compression ratio and
+        # blocks of different uncompressed sizes
+        raw = os.urandom(mb * 1024 * 1024 // 2) + b"\xff" * (mb * 1024 * 1024 // 2)
+        images = {"raw": raw, "zlib": zlib.compress(raw, 1)}
+        for mode, image in images.items():
+            compress = mode == "zlib"
+            legacy = measure(legacy_loop, image, compress, args.repeat)
+            current = measure(current_loop, image, compress, args.repeat)
+            print(
+                "%6d MB %6s %14.2f %14.2f"
+                % (mb, mode, legacy / mb * 1000, current / mb * 1000)
+            )
+
+
+if __name__ == "__main__":
+    main()
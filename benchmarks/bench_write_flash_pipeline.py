@@ -0,0 +1,147 @@
+# SPDX-FileCopyrightText: 2014-2022 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+"""write_flash throughput with and without pipelined block preparation.
+
+Runs write_flash through the real ESPLoader command path against a
+simulated stub on a serial link: writing a frame blocks for the time the
+frame takes on the wire at the given baud rate (releasing the GIL, as a
+real serial write does) and every command is ACKed at once. Prints the
+effective wire utilisation with and without write_flash --pipeline. Unless
+the host frames blocks slower than the link sends them, both keep the link
+close to 100% busy, which is why the pipeline is opt-in.
+
+Usage: python benchmarks/bench_write_flash_pipeline.py [--mb 2] [--baud ...]
+"""
+
+import argparse
+import hashlib
+import io
+import os
+import struct
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from esptool.cmds import write_flash  # noqa: E402
+from esptool.loader import slip_encode, slip_reader  # noqa: E402
+from esptool.targets import ESP32ROM  # noqa: E402
+
+
+class SimulatedLink(object):
+    """Serial port whose writes take as long as the bytes need on the wire"""
+
+    def __init__(self, baud, image):
+        self.baudrate = baud
+        self.md5 = hashlib.md5(image).digest()
+        self.timeout = 3
+        self.wire_time = 0.0
+        self._replies = bytearray()
+
+    def flushInput(self):
+        self._replies.clear()
+
+    def inWaiting(self):
+        return len(self._replies)
+
+    def read(self, size=1):
+        data = bytes(self._replies[:size])
+        del self._replies[:size]
+        return data
+
+    def write(self, frame):
+        wire_time = len(frame) * 10.0 / self.baudrate  # 8N1
+        self.wire_time += wire_time
+        time.sleep(wire_time)
+        # Answer every command in the write, READ_REG requests come in bursts
+        for packet in bytes(frame).split(b"\xc0"):
+            if not packet:
+                continue
+            op = packet[1]
+            data = b""
+            if op == ESP32ROM.ESP_SPI_FLASH_MD5:
+                data = self.md5  # the data is not kept, report what was sent
+            self._replies += slip_encode(
+                struct.pack("<BBHI", 1, op, len(data) + 2, 0) + data + b"\x00\x00"
+            )
+
+
+def simulated_stub(link):
+    esp = ESP32ROM.__new__(ESP32ROM)
+    esp._port = link
+    esp._trace_enabled = False
+    esp._slip_reader = slip_reader(link, esp.trace)
+    esp.IS_STUB = True
+    esp.STATUS_BYTES_LENGTH = 2
+    esp.FLASH_WRITE_SIZE = 0x4000
+    esp.secure_download_mode = False
+    return esp
+
+
+def run(image, baud, compress, pipeline):
+    link = SimulatedLink(baud, image)
+    argfile = io.BytesIO(image)
+    argfile.name = "<image>"
+    args = argparse.Namespace(
+        addr_filename=[(0x10000, argfile)],
+        compress=compress,
+        no_compress=not compress,
+        no_stub=False,
+        pipeline=pipeline,
+        no_cache=True,
+        flash_mode="keep",
+        flash_freq="keep",
+        flash_size="4MB",
+        erase_all=False,
+        force=True,
+        encrypt=False,
+        encrypt_files=None,
+        ignore_flash_encryption_efuse_setting=True,
+        verify=False,
+        no_progress=True,
+        progress_callback=lambda event: None,
+        chip="esp32",
+    )
+    stdout = sys.stdout
+    sys.stdout = io.StringIO()  # write_flash status lines
+    try:
+        t = time.perf_counter()
+        write_flash(simulated_stub(link), args)
+        t = time.perf_counter() - t
+    finally:
+        sys.stdout = stdout
+    return t, link.wire_time
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--mb", type=int, default=2, help="image size in MB")
+    parser.add_argument("--baud", default="921600,2000000,4000000")
+    args = parser.parse_args()
+
+    # Incompressible half and erased half, like a typical app partition
+    size = args.mb * 1024 * 1024
+    image = os.urandom(size // 2) + b"\xff" * (size // 2)
+
+    print("%8s %6s %10s %10s %10s" % ("baud", "mode", "pipeline", "time s", "wire %"))
+    for baud in [int(b) for b in args.baud.split(",")]:
+        for compress in (True, False):
+            for pipeline in (False, True):
+                t, wire_time = run(image, baud, compress, pipeline)
+                print(
+                    "%8d %6s %10s %10.2f %10.1f"
+                    % (
+                        baud,
+                        "zlib" if compress else "raw",
+                        "on" if pipeline else "off",
+                        t,
+                        wire_time / t * 100,
+                    )
+                )
+
+
+if __name__ == "__main__":
+    main()
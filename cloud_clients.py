@@ -0,0 +1,197 @@
+import base64
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+import requests
+from google.auth.transport.requests import Request
+from google.cloud import firestore, storage
+from google.oauth2.service_account import Credentials
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+# Segundos antes del vencimiento en que se renueva el token de acceso
+TOKEN_REFRESH_MARGIN = 300
+# Reintentos para errores transitorios de las APIs REST de Google
+HTTP_RETRIES = 3
+
+_lock = threading.Lock()
+_service_account_info = None
+_credentials = None
+_firestore_client = None
+_storage_client = None
+_http_session = None
+_token_provider = None
+
+
+def get_credentials_path():
+    """Ruta de cibtron.txt, compatible con PyInstaller."""
+    base_dir = getattr(sys, "_MEIPASS", os.path.dirname(os.path.abspath(__file__)))
+    return os.path.join(base_dir, "cibtron.txt")
+
+
+def get_service_account_info():
+    """Lee y decodifica las credenciales Base64 una sola vez."""
+    global _service_account_info
+    with _lock:
+        if _service_account_info is None:
+            credentials_path = get_credentials_path()
+            if not os.path.isfile(credentials_path):
+                raise FileNotFoundError(
+                    f"El archivo Base64 no se encontró en {credentials_path}"
+                )
+            with open(credentials_path, "r") as f:
+                _service_account_info = json.loads(base64.b64decode(f.read()))
+        return _service_account_info
+
+
+def get_credentials():
+    """Credenciales de la cuenta de servicio, compartidas por todos los clientes."""
+    global _credentials
+    info = get_service_account_info()
+    with _lock:
+        if _credentials is None:
+            _credentials = Credentials.from_service_account_info(info, scopes=SCOPES)
+        return _credentials
+
+
+def get_firestore_client():
+    global _firestore_client
+    credentials = get_credentials()
+    with _lock:
+        if _firestore_client is None:
+            _firestore_client = firestore.Client(
+                credentials=credentials, project=credentials.project_id
+            )
+        return _firestore_client
+
+
+def get_storage_client():
+    global _storage_client
+    credentials = get_credentials()
+    with _lock:
+        if _storage_client is None:
+            _storage_client = storage.Client(
+                credentials=credentials, project=credentials.project_id
+            )
+        return _storage_client
+
+
+def get_http_session():
+    """
+    Sesión HTTP persistente (keep-alive) para las APIs REST de Google, con
+    reintentos y espera exponencial solo cuando la petición seguro no se
+    ejecutó: errores al conectar, 429 y 503. Un timeout de lectura, un 500,
+    502 o 504 pueden llegar con el trabajo ya lanzado (el POST `:run` no es
+    idempotente), así que no se reintentan.
+    """
+    global _http_session
+    with _lock:
+        if _http_session is None:
+            retry = Retry(
+                total=HTTP_RETRIES,
+                connect=HTTP_RETRIES,
+                read=0,
+                other=0,
+                backoff_factor=0.5,
+                status_forcelist=(429, 503),
+                allowed_methods=None,  # También POST
+                respect_retry_after_header=True,
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            _http_session = session
+        return _http_session
+
+
+class TokenProvider:
+    """
+    Token de acceso OAuth de la cuenta de servicio. Se guarda hasta poco
+    antes de vencer y un hilo lo renueva en segundo plano, así pedir el
+    token no hace una firma ni una petición a Google.
+    """
+
+    def __init__(self, credentials, session, margin=TOKEN_REFRESH_MARGIN):
+        self.credentials = credentials
+        self.margin = margin
+        self._lock = threading.Lock()
+        self._request = Request(session=session)
+        self._thread = None
+
+    def _seconds_left(self):
+        expiry = self.credentials.expiry  # UTC sin zona horaria
+        if not self.credentials.token or expiry is None:
+            return 0
+        return (expiry - datetime.datetime.utcnow()).total_seconds()
+
+    def _refresh(self):
+        with self._lock:
+            # Otro hilo pudo haberlo renovado mientras se esperaba el lock
+            if self._seconds_left() <= self.margin:
+                self.credentials.refresh(self._request)
+            return self.credentials.token
+
+    def get_token(self):
+        if self._seconds_left() > self.margin:
+            return self.credentials.token
+        return self._refresh()
+
+    def _run(self):
+        while True:
+            try:
+                self._refresh()
+                espera = self._seconds_left() - self.margin
+            except Exception as e:
+                print(f"Error renovando el token de acceso: {e}")
+                espera = 30
+            time.sleep(max(espera, 30))
+
+    def start(self):
+        """Inicia la renovación en segundo plano (solo la primera vez)."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, daemon=True)
+                self._thread.start()
+        return self
+
+
+def get_token_provider():
+    global _token_provider
+    credentials = get_credentials()
+    session = get_http_session()
+    with _lock:
+        if _token_provider is None:
+            _token_provider = TokenProvider(credentials, session)
+    return _token_provider
+
+
+def _warm_up():
+    try:
+        # Obtiene el token de acceso una vez para todos los clientes y lo
+        # mantiene renovado
+        get_token_provider().start()
+
+        # Abre el canal gRPC de Firestore con una lectura mínima
+        get_firestore_client().document("logs/_warmup").get()
+
+        # Abre la conexión HTTP de Storage (FIRMWARE_BUCKET es opcional)
+        storage_client = get_storage_client()
+        bucket_name = os.getenv("FIRMWARE_BUCKET")
+        if bucket_name:
+            storage_client.lookup_bucket(bucket_name)
+        print("Clientes de Firestore y Storage listos.")
+    except Exception as e:
+        # No es fatal: los clientes se conectan en la primera petición
+        print(f"Error precalentando clientes de Google Cloud: {e}")
+
+
+def warm_up_clients():
+    """Crea los clientes y abre sus conexiones en segundo plano."""
+    thread = threading.Thread(target=_warm_up, daemon=True)
+    thread.start()
+    return thread
@@ -4,6 +4,7 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 __all__ = [
+    "FlashSession",
     "chip_id",
     "detect_chip",
     "dump_mem",
@@ -25,6 +26,7 @@ __all__ = [
     "version",
     "write_flash",
     "write_flash_status",
+    "write_flash_stream",
     "write_mem",
 ]
 
@@ -54,6 +56,7 @@ from esptool.cmds import (
     load_ram,
     make_image,
     merge_bin,
+    negotiate_baud,
     read_flash,
     read_flash_status,
     read_mac,
@@ -63,10 +66,12 @@ from esptool.cmds import (
     version,
     write_flash,
     write_flash_status,
+    write_flash_stream,
     write_mem,
 )
 from esptool.config import load_config_file
 from esptool.loader import DEFAULT_CONNECT_ATTEMPTS, ESPLoader, list_ports
+from esptool.session import FlashSession
 from esptool.targets import CHIP_DEFS, CHIP_LIST, ESP32ROM
 from esptool.util import (
     FatalError,
@@ -118,8 +123,9 @@ def main(argv=None, esp=None):
     parser.add_argument(
         "--baud",
         "-b",
-        help="Serial port baud rate used when flashing/reading",
-        type=arg_auto_int,
+        help="Serial port baud rate used when flashing/reading, "
+        "or auto for the highest rate the adapter handles reliably",
+        type=arg_baud,
         default=os.environ.get("ESPTOOL_BAUD", ESPLoader.ESP_ROM_BAUD),
     )
 
@@ -361,6 +367,52 @@ def main(argv=None, esp=None):
         "(default if --no-stub is specified)",
         action="store_true",
     )
+    parser_write_flash.add_argument(
+        "--compress-level",
+        help="zlib compression level 1-9 for compressed transfers (default: 9), "
+        "or auto to pick the fastest one for the measured link speed",
+        choices=["auto"] + [str(level) for level in range(1, 10)],
+        metavar="LEVEL",
+        default=None,
+    )
+    parser_write_flash.add_argument(
+        "--compress-workers",
+        help="Number of threads compressing data in parallel "
+        "(default: number of CPUs, 1 compresses in a single stream)",
+        type=int,
+        metavar="N",
+        default=None,
+    )
+    parser_write_flash.add_argument(
+        "--diff",
+        help="Compare the flash with the files first (MD5 on the chip), "
+        "erase and write only the sectors which differ",
+        action="store_true",
+    )
+    parser_write_flash.add_argument(
+        "--skip-identical",
+        help="Compare each file with the flash first (MD5 on the chip) "
+        "and leave out the files which the flash already holds",
+        action="store_true",
+    )
+    parser_write_flash.add_argument(
+        "--rewrite",
+        help="If a file doesn't verify after writing, erase and write again "
+        "the flash sectors which differ (once) instead of failing",
+        action="store_true",
+    )
+    parser_write_flash.add_argument(
+        "--no-cache",
+        help="Do not reuse or store compressed images in the image cache",
+        action="store_true",
+    )
+    parser_write_flash.add_argument(
+        "--pipeline",
+        help="Prepare blocks ahead of time in a worker thread instead of after "
+        "the previous one is acknowledged. Only helps if the host is too slow "
+        "to frame blocks as fast as the link sends them",
+        action="store_true",
+    )
 
     subparsers.add_parser("run", help="Run application code in flash")
 
@@ -572,6 +624,11 @@ def main(argv=None, esp=None):
     parser_verify_flash.add_argument(
         "--diff", "-d", help="Show differences", choices=["no", "yes"], default="no"
     )
+    parser_verify_flash.add_argument(
+        "--rewrite",
+        help="Erase and write again the flash sectors which differ",
+        action="store_true",
+    )
     add_spi_flash_subparsers(parser_verify_flash, allow_keep=True, auto_detect=True)
 
     parser_erase_flash = subparsers.add_parser(
@@ -706,7 +763,9 @@ def main(argv=None, esp=None):
     if (
         operation_args[0] == "esp"
     ):  # operation function takes an ESPLoader connection object
-        if args.before != "no_reset_no_sync":
+        if args.baud == "auto":
+            initial_baud = ESPLoader.ESP_ROM_BAUD
+        elif args.before != "no_reset_no_sync":
             initial_baud = min(
                 ESPLoader.ESP_ROM_BAUD, args.baud
             )  # don't sync faster than the default baud rate
@@ -737,10 +796,11 @@ def main(argv=None, esp=None):
         if esp.secure_download_mode:
             print("Chip is %s in Secure Download Mode" % esp.CHIP_NAME)
         else:
-            print("Chip is %s" % (esp.get_chip_description()))
-            print("Features: %s" % ", ".join(esp.get_chip_features()))
-            print("Crystal is %dMHz" % esp.get_crystal_freq())
-            read_mac(esp, args)
+            with esp.prefetched_regs(esp.get_identification_regs()):
+                print("Chip is %s" % (esp.get_chip_description()))
+                print("Features: %s" % ", ".join(esp.get_chip_features()))
+                print("Crystal is %dMHz" % esp.get_crystal_freq())
+                read_mac(esp, args)
 
         if not args.no_stub:
             if esp.secure_download_mode:
@@ -770,7 +830,9 @@ def main(argv=None, esp=None):
         if args.override_vddsdio:
             esp.override_vddsdio(args.override_vddsdio)
 
-        if args.baud > initial_baud:
+        if args.baud == "auto":
+            negotiate_baud(esp)
+        elif args.baud > initial_baud:
             try:
                 esp.change_baud(args.baud)
             except NotImplementedInROMError:
@@ -987,6 +1049,10 @@ def arg_auto_int(x):
     return int(x, 0)
 
 
+def arg_baud(x):
+    return x if x == "auto" else arg_auto_int(x)
+
+
 def arg_auto_size(x):
     x = x.lower()
     return x if x == "all" else arg_auto_int(x)
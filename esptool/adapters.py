@@ -0,0 +1,96 @@
+# SPDX-FileCopyrightText: 2014-2023 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import json
+import os
+import tempfile
+import threading
+import time
+
+from .loader import ADAPTER_PROFILES_FILE, list_ports
+
+
+def adapter_key(port):
+    """Identify a USB-serial adapter and the port it is on, as "VID:PID@port".
+
+    Falls back to "unknown@port" when the port has no USB IDs (or ports can't
+    be listed), so settings are still kept per port.
+    """
+    device = port
+    if device.startswith("/dev/") and os.path.islink(device):
+        device = os.path.realpath(device)
+    if list_ports is not None:
+        for p in list_ports.comports():
+            if p.device == device and p.vid is not None:
+                return "%04X:%04X@%s" % (p.vid, p.pid, port)
+    return "unknown@%s" % port
+
+
+class AdapterProfiles(object):
+    """Settings learned per USB-serial adapter (see adapter_key()), on disk.
+
+    A JSON object of {adapter key: {setting: value}}, e.g. the highest stable
+    baud rate. Every update re-reads the file and replaces it atomically, so
+    several esptool processes can share it. I/O errors are reported, never
+    fatal: the worst case is learning the settings again.
+    """
+
+    def __init__(self, path=ADAPTER_PROFILES_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def _load(self):
+        try:
+            with open(self.path, "r") as f:
+                profiles = json.load(f)
+            if isinstance(profiles, dict):
+                return profiles
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as e:
+            print("WARNING: Ignoring adapter profiles in %s: %s" % (self.path, e))
+        return {}
+
+    def get(self, key):
+        """Return the settings of an adapter, an empty dict if none"""
+        with self._lock:
+            return dict(self._load().get(key) or {})
+
+    def update(self, key, **settings):
+        """Set (or, with None, remove) settings of an adapter"""
+        with self._lock:
+            profiles = self._load()
+            profile = profiles.setdefault(key, {})
+            for name, value in settings.items():
+                if value is None:
+                    profile.pop(name, None)
+                else:
+                    profile[name] = value
+            profile["updated"] = int(time.time())
+            tmp_path = None
+            try:
+                directory = os.path.dirname(self.path) or "."
+                os.makedirs(directory, exist_ok=True)
+                fd, tmp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+                with os.fdopen(fd, "w") as f:
+                    json.dump(profiles, f, indent=2, sort_keys=True)
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                print(
+                    "WARNING: Cannot save adapter profiles to %s: %s" % (self.path, e)
+                )
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+
+_profiles = None
+
+
+def get_adapter_profiles():
+    """Shared AdapterProfiles for the configured file"""
+    global _profiles
+    if _profiles is None:
+        _profiles = AdapterProfiles()
+    return _profiles
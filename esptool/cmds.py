@@ -3,18 +3,23 @@
 #
 # SPDX-License-Identifier: GPL-2.0-or-later
 
+import contextlib
 import hashlib
 import io
 import os
+import queue
 import struct
 import sys
+import threading
 import time
 import zlib
 import itertools
 
 from intelhex import IntelHex
 
+from .adapters import adapter_key, get_adapter_profiles
 from .bin_image import ELFFile, ImageSegment, LoadFirmwareImage
+from .image_cache import CompressedImageCache
 from .bin_image import (
     ESP8266ROMFirmwareImage,
     ESP8266V2FirmwareImage,
@@ -30,9 +35,12 @@ from .loader import (
 from .targets import CHIP_DEFS, CHIP_LIST, ROM_LIST
 from .uf2_writer import UF2Writer
 from .util import (
+    DEFLATE_CHUNK_SIZE,
     FatalError,
     NotImplementedInROMError,
     NotSupportedError,
+    ProgressEvent,
+    ProgressReporter,
     UnsupportedCommandError,
 )
 from .util import (
@@ -41,7 +49,9 @@ from .util import (
     get_file_size,
     hexify,
     pad_to,
+    parallel_compress,
     print_overwrite,
+    print_progress,
 )
 
 DETECTED_FLASH_SIZES = {
@@ -151,7 +161,7 @@ def detect_chip(
         if inst is not None:
             print(" %s" % inst.CHIP_NAME, end="")
             if detect_port.sync_stub_detected:
-                inst = inst.STUB_CLASS(inst)
+                inst = inst._stub_loader()
                 inst.sync_stub_detected = True
             print("")  # end line
             return inst
@@ -179,11 +189,9 @@ def load_ram(esp, args):
             size, div_roundup(size, esp.ESP_RAM_BLOCK), esp.ESP_RAM_BLOCK, seg.addr
         )
 
-        seq = 0
-        while len(seg.data) > 0:
-            esp.mem_block(seg.data[0 : esp.ESP_RAM_BLOCK], seq)
-            seg.data = seg.data[esp.ESP_RAM_BLOCK :]
-            seq += 1
+        data = memoryview(seg.data)
+        for seq, offset in enumerate(range(0, size, esp.ESP_RAM_BLOCK)):
+            esp.mem_block(data[offset : offset + esp.ESP_RAM_BLOCK], seq)
         print("done!")
 
     print("All segments done, executing at %08x" % image.entrypoint)
@@ -239,6 +247,106 @@ def detect_flash_size(esp, args=None):
     return flash_size
 
 
+# Baud rates tried in order by --baud auto
+AUTO_BAUD_LADDER = (460800, 921600, 1500000, 2000000)
+# Flash read back at every step of the ladder to check the link
+BAUD_PROBE_SIZE = 0x1000
+
+
+def _probe_link(esp, expected_md5):
+    """Short round trip in both directions: MD5 command, then a flash read"""
+    if esp.flash_md5sum(0, BAUD_PROBE_SIZE) != expected_md5:
+        raise FatalError("MD5 of probe region does not match")
+    # read_flash also checks the data against the stub's digest
+    t = time.time()
+    data = esp.read_flash(0, BAUD_PROBE_SIZE)
+    # A sample of the link at this baud rate, see ESPLoader.link_throughput()
+    esp._link_sample(BAUD_PROBE_SIZE, time.time() - t)
+    if hashlib.md5(data).hexdigest() != expected_md5:
+        raise FatalError("Probe region read back does not match")
+
+
+def _link_efficiency(esp):
+    """Measured link efficiency to remember for the adapter, None if unknown"""
+    efficiency = esp.link_efficiency()
+    return None if efficiency is None else round(efficiency, 3)
+
+
+def _fall_back_baud(esp, baud, expected_md5):
+    """Return to a baud rate known to work after a failed step up"""
+    esp.flush_input()  # also restarts the SLIP reader after an error
+    try:
+        esp.change_baud(baud)
+    except (FatalError, OSError):
+        # The request may still have arrived, the reply was garbled
+        esp._set_port_baudrate(baud)
+        time.sleep(0.05)
+        esp.flush_input()
+    try:
+        _probe_link(esp, expected_md5)
+    except (FatalError, OSError) as e:
+        raise FatalError(
+            "Lost the connection while negotiating the baud rate (%s), "
+            "reconnect to continue at %d baud" % (e, baud)
+        )
+
+
+def negotiate_baud(esp, ladder=AUTO_BAUD_LADDER, profiles=None):
+    """Switch to the highest baud rate of 'ladder' the link handles reliably.
+
+    Steps up the ladder and checks every rate with _probe_link(), going back
+    to the last good rate on the first error. The result is remembered per
+    adapter (see adapters.adapter_key()), so later sessions switch to it
+    directly after a single check, and probe again only if it fails. The
+    probes are link samples (see ESPLoader.link_throughput()), their
+    efficiency is remembered too, for sessions which don't measure the link.
+    Requires the stub. Returns the baud rate in use.
+
+    Raises FatalError if the connection could not be recovered after a
+    failed step; the best rate found so far is already remembered then, so
+    reconnecting and calling this again does not repeat the failing step.
+    """
+    base = esp._port.baudrate
+    if not esp.IS_STUB:
+        print("WARNING: Baud rate negotiation needs the stub, keeping %d" % base)
+        return base
+    if profiles is None:
+        profiles = get_adapter_profiles()
+    key = adapter_key(esp._port.port)
+    reference = esp.flash_md5sum(0, BAUD_PROBE_SIZE)
+
+    remembered = profiles.get(key).get("baud")
+    if remembered and remembered != base:
+        try:
+            esp.change_baud(remembered)
+            _probe_link(esp, reference)
+            print("Using baud rate %d remembered for %s" % (remembered, key))
+            profiles.update(key, link_efficiency=_link_efficiency(esp))
+            return remembered
+        except (FatalError, OSError) as e:
+            print(
+                "Remembered baud rate %d failed (%s), probing again" % (remembered, e)
+            )
+            profiles.update(key, baud=base)
+            _fall_back_baud(esp, base, reference)
+
+    best = base
+    for baud in ladder:
+        if baud <= best:
+            continue
+        try:
+            esp.change_baud(baud)
+            _probe_link(esp, reference)
+            best = baud
+        except (FatalError, OSError) as e:
+            print("Baud rate %d is not stable (%s), using %d" % (baud, e, best))
+            profiles.update(key, baud=best, link_efficiency=_link_efficiency(esp))
+            _fall_back_baud(esp, best, reference)
+            return best
+    profiles.update(key, baud=best, link_efficiency=_link_efficiency(esp))
+    return best
+
+
 def _update_image_flash_params(esp, address, args, image):
     """
     Modify the flash mode & size bytes if this looks like an executable bootloader image
@@ -334,13 +442,298 @@ def _update_image_flash_params(esp, address, args, image):
     return image
 
 
-def write_flash(esp, args):
-    # set args.compress based on default behaviour:
-    # -> if either --compress or --no-compress is set, honour that
-    # -> otherwise, set --compress unless --no-stub is set
-    if args.compress is None and not args.no_compress:
-        args.compress = not args.no_stub
+def _flash_block_table(esp, image, compress, block_sizes=None):
+    """Split an image (compressed or padded to FLASH_WRITE_SIZE) into blocks.
+
+    Returns a list of (offset, length, uncompressed length, timeout) tuples,
+    where timeout is the one to use when sending that block, and the timeout
+    for the final operation that waits for the last block to be written.
+    block_sizes optionally gives the uncompressed length of every compressed
+    block (e.g. from the image cache), which saves decompressing the image.
+    """
+    table = []
+    timeout = DEFAULT_TIMEOUT
+    if compress and block_sizes is None:
+        # Decompress the compressed binary a block at a time,
+        # to dynamically calculate the timeout based on the real write size
+        decompress = zlib.decompressobj()
+    for offset in range(0, len(image), esp.FLASH_WRITE_SIZE):
+        length = min(esp.FLASH_WRITE_SIZE, len(image) - offset)
+        if not compress:
+            table.append((offset, length, length, DEFAULT_TIMEOUT))
+            continue
+        if block_sizes is not None:
+            block_uncompressed = block_sizes[len(table)]
+        else:
+            block_uncompressed = len(
+                decompress.decompress(image[offset : offset + length])
+            )
+        block_timeout = max(
+            DEFAULT_TIMEOUT,
+            timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, block_uncompressed),
+        )
+        if not esp.IS_STUB:
+            timeout = block_timeout  # ROM code writes block to flash before ACKing
+        table.append((offset, length, block_uncompressed, timeout))
+        # Stub ACKs when block is received,
+        # then writes to flash while receiving the block after it
+        timeout = block_timeout
+    return table, timeout
+
+
+# zlib levels considered by --compress-level auto
+AUTO_COMPRESS_LEVELS = range(1, 10)
+# Slices of the image compressed at every level to estimate speed and ratio
+AUTO_COMPRESS_SAMPLES = 4
+AUTO_COMPRESS_SAMPLE_SIZE = 32 * 1024
+
+
+def _choose_compress_level(esp, image, md5, workers=None, cache=None):
+    """Pick the zlib level with the shortest estimated compress + send time.
+
+    Compresses evenly spaced slices of the image at every level to estimate
+    each level's ratio and (parallel) compression time, and divides the
+    estimated compressed size by the measured link throughput. A level with
+    an image cache entry costs no compression time.
+
+    Returns (level, detail) with detail as reported in the "compress"
+    progress event.
+    """
+    throughput = esp.link_throughput()
+    step = max(AUTO_COMPRESS_SAMPLE_SIZE, len(image) // AUTO_COMPRESS_SAMPLES)
+    sample = b"".join(
+        image[offset : offset + AUTO_COMPRESS_SAMPLE_SIZE]
+        for offset in range(0, len(image), step)
+    )
+    scale = len(image) / float(len(sample))
+    if workers is None:
+        workers = os.cpu_count() or 1
+    parallel = max(1, min(workers, div_roundup(len(image), DEFLATE_CHUNK_SIZE)))
+
+    estimates = {}
+    for level in AUTO_COMPRESS_LEVELS:
+        t = time.perf_counter()
+        compressed = len(zlib.compress(sample, level)) * scale
+        compress_time = (time.perf_counter() - t) * scale / parallel
+        if cache is not None and cache.contains(md5, level, esp.FLASH_WRITE_SIZE):
+            compress_time = 0.0
+        estimates[level] = (compress_time, compressed / throughput)
+    # On a tie prefer the higher level, less data on the wire
+    level = min(estimates, key=lambda lvl: (sum(estimates[lvl]), -lvl))
+
+    compress_time, send_time = estimates[level]
+    reason = "link %.0f kB/s: ~%.2f s compressing + ~%.2f s sending" % (
+        throughput / 1000,
+        compress_time,
+        send_time,
+    )
+    best_ratio = max(AUTO_COMPRESS_LEVELS)
+    if level != best_ratio:
+        reason += " (level %d: ~%.2f s + ~%.2f s)" % (
+            (best_ratio,) + estimates[best_ratio]
+        )
+    detail = {
+        "level": level,
+        "reason": reason,
+        "link_bytes_per_s": throughput,
+        "estimates": {lvl: sum(times) for lvl, times in estimates.items()},
+    }
+    return level, detail
+
+
+# Blocks framed ahead of the one being sent when pipelining write_flash
+PIPELINE_DEPTH = 8
+
+
+def _block_op(esp, compress, encrypted):
+    """Command used to send write_flash blocks, see ESPLoader.flash_block_frame"""
+    if compress:
+        return esp.ESP_FLASH_DEFL_DATA
+    if encrypted and (esp.IS_STUB or not esp.SUPPORTS_ENCRYPTED_FLASH):
+        return esp.ESP_FLASH_ENCRYPT_DATA
+    return esp.ESP_FLASH_DATA
+
 
+def _pipelined_frames(esp, op, image, table, depth=PIPELINE_DEPTH):
+    """Generator yielding the SLIP frame of every block in a block table.
+
+    A worker thread checksums, packs and SLIP-encodes blocks up to 'depth'
+    ahead, so the caller only writes frames and waits for ACKs. Close the
+    generator when done, the worker stops at the next block.
+    """
+    frames = queue.Queue(depth)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                frames.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def prepare():
+        try:
+            for seq, (offset, length, _, _) in enumerate(table):
+                frame = esp.flash_block_frame(op, image[offset : offset + length], seq)
+                if not put(frame):
+                    return
+        except Exception as e:
+            put(e)
+
+    worker = threading.Thread(target=prepare, name="esptool-frames", daemon=True)
+    worker.start()
+    try:
+        for _ in table:
+            frame = frames.get()
+            if isinstance(frame, Exception):
+                raise frame
+            yield frame
+    finally:
+        stop.set()
+        worker.join()
+
+
+# write_flash --diff compares the image with flash in granules of this size
+# first, then the granules that differ sector by sector
+DIFF_GRANULE_SIZE = 0x10000
+# Above this fraction of changed granules the whole image is rewritten
+DIFF_REWRITE_FRACTION = 0.5
+# verify_flash --diff shows at most this many bytes of each differing range
+DIFF_SHOW_BYTES = 16
+
+
+def _diff_regions(esp, address, image):
+    """Find the parts of the image that differ from the flash at address.
+
+    Compares MD5 digests of the flash, computed on the chip, with those of the
+    image: per DIFF_GRANULE_SIZE granule, then per flash sector within each
+    granule that differs. Returns the changed runs of sectors as sorted
+    (offset, length) pairs, empty if the flash already holds the image. If
+    most granules differ, the whole image is one run: finding the unchanged
+    sectors would take longer than it saves.
+    """
+    size = len(image)
+    view = memoryview(image)
+
+    def changed(start, end, step):
+        return [
+            offset
+            for offset in range(start, min(end, size), step)
+            if esp.flash_md5sum(address + offset, min(step, size - offset))
+            != hashlib.md5(view[offset : offset + step]).hexdigest()
+        ]
+
+    granules = changed(0, size, DIFF_GRANULE_SIZE)
+    if len(granules) > DIFF_REWRITE_FRACTION * div_roundup(size, DIFF_GRANULE_SIZE):
+        return [(0, size)]
+
+    regions = []
+    for granule in granules:
+        for offset in changed(
+            granule, granule + DIFF_GRANULE_SIZE, esp.FLASH_SECTOR_SIZE
+        ):
+            length = min(esp.FLASH_SECTOR_SIZE, size - offset)
+            if regions and sum(regions[-1]) == offset:
+                regions[-1] = (regions[-1][0], regions[-1][1] + length)
+            else:
+                regions.append((offset, length))
+    return regions
+
+
+def _bisect_mismatches(esp, address, image):
+    """Find the flash sectors which differ from the image at address.
+
+    The flash at address is known not to hold the image. Halves of the
+    mismatched range are compared by MD5 digests computed on the chip, down to
+    single flash sectors; when the first half matches, the second one must
+    differ and isn't compared. Returns the differing runs of sectors as sorted
+    (offset, length) pairs. A few bad sectors cost a few round trips each,
+    instead of reading back the whole image.
+    """
+    sector = esp.FLASH_SECTOR_SIZE
+    view = memoryview(image)
+    regions = []
+
+    def differs(start, end):
+        return (
+            esp.flash_md5sum(address + start, end - start)
+            != hashlib.md5(view[start:end]).hexdigest()
+        )
+
+    def bisect(start, end):
+        if end - start <= sector:
+            if regions and sum(regions[-1]) == start:
+                regions[-1] = (regions[-1][0], regions[-1][1] + end - start)
+            else:
+                regions.append((start, end - start))
+            return
+        middle = start + div_roundup(end - start, sector) // 2 * sector
+        if differs(start, middle):
+            bisect(start, middle)
+            if differs(middle, end):
+                bisect(middle, end)
+        else:
+            bisect(middle, end)
+
+    bisect(0, len(image))
+    return regions
+
+
+def _differing_ranges(esp, address, image, regions):
+    """Read back the given (offset, length) regions of the flash at address.
+
+    Returns the runs of bytes which differ from the image, as sorted
+    (offset, flash bytes, image bytes) triples.
+    """
+    ranges = []
+    for offset, length in regions:
+        flash = esp.read_flash(address + offset, length)
+        start = None
+        for i in range(length + 1):
+            same = i == length or flash[i] == image[offset + i]
+            if not same and start is None:
+                start = i
+            elif same and start is not None:
+                ranges.append(
+                    (offset + start, flash[start:i], image[offset + start : offset + i])
+                )
+                start = None
+    return ranges
+
+
+def _rewrite_regions(esp, address, image, regions):
+    """Erase and write again the given (offset, length) regions of the image.
+
+    The data is sent uncompressed, the address must be aligned to a sector.
+    """
+    for offset, length in regions:
+        data = pad_to(image[offset : offset + length], esp.FLASH_WRITE_SIZE)
+        esp.flash_begin(length, address + offset)
+        for seq, block in enumerate(range(0, len(data), esp.FLASH_WRITE_SIZE)):
+            esp.flash_block(data[block : block + esp.FLASH_WRITE_SIZE], seq)
+    if esp.IS_STUB:
+        # Wait for the stub to write out the last block, see write_flash()
+        esp.read_reg(ESPLoader.CHIP_DETECT_MAGIC_REG_ADDR)
+
+
+def _print_regions(regions, address):
+    print(
+        "%d bytes in %d regions differ: %s"
+        % (
+            sum(length for _, length in regions),
+            len(regions),
+            ", ".join(
+                "0x%08x-0x%08x" % (address + offset, address + offset + length - 1)
+                for offset, length in regions
+            ),
+        )
+    )
+
+
+def _check_write_flash(esp, args):
+    """Check the images and the chip's security settings allow writing them"""
     if not args.force and esp.CHIP_NAME != "ESP8266" and not esp.secure_download_mode:
         # Check if secure boot is active
         if esp.get_secure_boot_enabled():
@@ -477,6 +870,56 @@ def write_flash(esp, args):
                     "Use --force to override the warning."
                 )
 
+
+def _print_erase_range(esp, address, write_end):
+    # Print the address range of to-be-erased flash memory region
+    print(
+        "Flash will be erased from {:#010x} to {:#010x}...".format(
+            address - address % esp.FLASH_SECTOR_SIZE,
+            div_roundup(write_end, esp.FLASH_SECTOR_SIZE) * esp.FLASH_SECTOR_SIZE
+            - 1,
+        )
+    )
+
+
+def _flash_holds(esp, address, size, md5):
+    """Return True if the flash at address already holds data with this MD5"""
+    if esp.secure_download_mode:
+        return False
+    try:
+        return esp.flash_md5sum(address, size) == md5
+    except NotImplementedInROMError:
+        return False  # ESP8266 ROM, can't tell
+
+
+def write_flash(esp, args):
+    # args.progress_callback (optional) receives a ProgressEvent per block,
+    # rate-limited. The default renders a progress line on the console.
+    progress = ProgressReporter(
+        getattr(args, "progress_callback", None) or print_progress
+    )
+
+    # set args.compress based on default behaviour:
+    # -> if either --compress or --no-compress is set, honour that
+    # -> otherwise, set --compress unless --no-stub is set
+    if args.compress is None and not args.no_compress:
+        args.compress = not args.no_stub
+
+    # --diff: only write the sectors which differ from the flash contents
+    diff = getattr(args, "diff", False) and not args.erase_all
+    # --skip-identical: leave out files which the flash already holds
+    skip_identical = getattr(args, "skip_identical", False) and not args.erase_all
+    # --rewrite: rewrite the sectors which don't verify instead of failing
+    rewrite = getattr(args, "rewrite", False)
+    skipped = []
+
+    if esp.secure_download_mode or esp.CHIP_NAME == "ESP8266":
+        _check_write_flash(esp, args)
+    else:
+        # The checks read the same eFuses over and over, get them in one batch
+        with esp.prefetched_regs(esp.get_identification_regs()):
+            _check_write_flash(esp, args)
+
     # verify file sizes fit in flash
     flash_end = flash_size_bytes(
         detect_flash_size(esp) if args.flash_size == "keep" else args.flash_size
@@ -509,15 +952,11 @@ def write_flash(esp, args):
                         address, esp.FLASH_SECTOR_SIZE, bytes_over
                     )
                 )
-            # Print the address range of to-be-erased flash memory region
-            print(
-                "Flash will be erased from {:#010x} to {:#010x}...".format(
-                    address - bytes_over,
-                    div_roundup(write_end, esp.FLASH_SECTOR_SIZE)
-                    * esp.FLASH_SECTOR_SIZE
-                    - 1,
-                )
-            )
+            if diff and not bytes_over:
+                continue  # only the sectors which differ will be erased
+            if skip_identical and not bytes_over:
+                continue  # printed once we know the file is going to be written
+            _print_erase_range(esp, address, write_end)
 
     """ Create a list describing all the files we have to flash.
     Each entry holds an "encrypt" flag marking whether the file needs encryption or not.
@@ -550,6 +989,9 @@ def write_flash(esp, args):
         # let's use sorted.
         all_files = sorted(all_files + encrypted_files_flag, key=lambda x: x[0])
 
+    # Compressed images (and their block sizes) are reused across runs
+    cache = None if getattr(args, "no_cache", False) else CompressedImageCache()
+
     for address, argfile, encrypted in all_files:
         compress = args.compress
 
@@ -576,74 +1018,154 @@ def write_flash(esp, args):
             )
         calcmd5 = hashlib.md5(image).hexdigest()
         uncsize = len(image)
+        if skip_identical and not encrypted and not address % esp.FLASH_SECTOR_SIZE:
+            if _flash_holds(esp, address, uncsize, calcmd5):
+                print(
+                    "Flash at 0x%08x already holds %s, skipping it"
+                    % (address, argfile.name)
+                )
+                skipped.append((address, argfile.name))
+                argfile.seek(0)  # in case we need it again
+                progress(
+                    ProgressEvent("skipped", address, 0, 0, 0, uncsize, uncsize, 0.0)
+                )
+                continue
+            if not diff:
+                _print_erase_range(esp, address, address + uncsize)
+        regions = [(0, uncsize)]
+        if diff:
+            if encrypted:
+                print("WARNING: Cannot compare encrypted flash, writing it all")
+            elif address % esp.FLASH_SECTOR_SIZE:
+                print("WARNING: Unaligned address, writing the whole file")
+            else:
+                try:
+                    regions = _diff_regions(esp, address, image)
+                except NotImplementedInROMError:
+                    print("WARNING: ROM can't compute MD5, writing the whole file")
+                else:
+                    print(
+                        "%d of %d bytes differ from flash, in %d regions"
+                        % (sum(size for _, size in regions), uncsize, len(regions))
+                    )
+        total = sum(size for _, size in regions)
         if compress:
-            uncimage = image
-            image = zlib.compress(uncimage, 9)
-            # Decompress the compressed binary a block at a time,
-            # to dynamically calculate the timeout based on the real write size
-            decompress = zlib.decompressobj()
-            blocks = esp.flash_defl_begin(uncsize, len(image), address)
-        else:
-            blocks = esp.flash_begin(uncsize, address, begin_rom_encrypted=encrypted)
+            level = getattr(args, "compress_level", None) or 9
+            if level == "auto" and total:
+                changed = image
+                if total != uncsize:
+                    changed = b"".join(image[o : o + n] for o, n in regions)
+                level, detail = _choose_compress_level(
+                    esp,
+                    changed,
+                    calcmd5,
+                    getattr(args, "compress_workers", None),
+                    cache if total == uncsize else None,
+                )
+                print("Compression level %d, %s" % (level, detail["reason"]))
+                progress(
+                    ProgressEvent("compress", address, 0, 0, 0, 0, total, 0.0, detail)
+                )
+            if level == "auto":
+                level = 9
+            level = int(level)
         argfile.seek(0)  # in case we need it again
-        seq = 0
         bytes_sent = 0  # bytes sent on wire
         bytes_written = 0  # bytes written to flash
-        t = time.time()
-
+        blocks = seq = 0
+        cache_used = []  # (md5, level) of the image cache entries sent
         timeout = DEFAULT_TIMEOUT
+        t = time.time()
 
-        while len(image) > 0:
-            print_overwrite(
-                "Writing at 0x%08x... (%d %%)"
-                % (address + bytes_written, 100 * (seq + 1) // blocks)
-            )
-            sys.stdout.flush()
-            block = image[0 : esp.FLASH_WRITE_SIZE]
+        for region_offset, region_size in regions:
+            region_address = address + region_offset
+            # Progress events report address + bytes_written as the position
+            event_address = region_address - bytes_written
+            data = image[region_offset : region_offset + region_size]
+            md5 = calcmd5 if region_size == uncsize else hashlib.md5(data).hexdigest()
+            cached = block_sizes = None
             if compress:
-                # feeding each compressed block into the decompressor lets us
-                # see block-by-block how much will be written
-                block_uncompressed = len(decompress.decompress(block))
-                bytes_written += block_uncompressed
-                block_timeout = max(
-                    DEFAULT_TIMEOUT,
-                    timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, block_uncompressed),
-                )
-                if not esp.IS_STUB:
-                    timeout = (
-                        block_timeout  # ROM code writes block to flash before ACKing
+                if cache is not None:
+                    cached = cache.get(md5, level, esp.FLASH_WRITE_SIZE, region_size)
+                if cached is not None:
+                    data, block_sizes = cached
+                    cache_used.append((md5, level))
+                    print("Using cached compressed data for %s" % argfile.name)
+                else:
+                    data = parallel_compress(
+                        data, level, getattr(args, "compress_workers", None)
                     )
-                esp.flash_defl_block(block, seq, timeout=timeout)
-                if esp.IS_STUB:
-                    # Stub ACKs when block is received,
-                    # then writes to flash while receiving the block after it
-                    timeout = block_timeout
+                blocks += esp.flash_defl_begin(region_size, len(data), region_address)
             else:
-                # Pad the last block
-                block = block + b"\xff" * (esp.FLASH_WRITE_SIZE - len(block))
-                if encrypted:
-                    esp.flash_encrypt_block(block, seq)
-                else:
-                    esp.flash_block(block, seq)
-                bytes_written += len(block)
-            bytes_sent += len(block)
-            image = image[esp.FLASH_WRITE_SIZE :]
-            seq += 1
+                # Pad the last block once here, so every block is a plain slice
+                data = pad_to(data, esp.FLASH_WRITE_SIZE)
+                blocks += esp.flash_begin(
+                    region_size, region_address, begin_rom_encrypted=encrypted
+                )
 
-        if esp.IS_STUB:
+            # Blocks are memoryview slices of the data: no copy of the
+            # remaining data per block
+            data = memoryview(data)
+            table, timeout = _flash_block_table(esp, data, compress, block_sizes)
+            if compress and cache is not None and cached is None:
+                cache.put(
+                    md5,
+                    level,
+                    esp.FLASH_WRITE_SIZE,
+                    data,
+                    [entry[2] for entry in table],
+                )
+            if not getattr(args, "pipeline", False) or len(table) < 2:
+                frames = contextlib.nullcontext(itertools.repeat(None))
+            else:
+                # Frame blocks ahead in a worker thread while this one is sent
+                op = _block_op(esp, compress, encrypted)
+                frames = contextlib.closing(_pipelined_frames(esp, op, data, table))
+            with frames as frames:
+                for (block_seq, entry), frame in zip(enumerate(table), frames):
+                    offset, length, block_uncompressed, block_timeout = entry
+                    block = data[offset : offset + length]
+                    if compress:
+                        esp.flash_defl_block(
+                            block, block_seq, timeout=block_timeout, frame=frame
+                        )
+                    elif encrypted:
+                        esp.flash_encrypt_block(block, block_seq, frame=frame)
+                    else:
+                        esp.flash_block(block, block_seq, frame=frame)
+                    bytes_written += block_uncompressed
+                    bytes_sent += length
+                    progress(
+                        ProgressEvent(
+                            "write",
+                            event_address,
+                            seq,
+                            blocks,
+                            bytes_sent,
+                            bytes_written,
+                            total,
+                            time.time() - t,
+                        )
+                    )
+                    seq += 1
+
+        if esp.IS_STUB and regions:
             # Stub only writes each block to flash after 'ack'ing the receive,
             # so do a final dummy operation which will not be 'ack'ed
             # until the last block has actually been written out to flash
             esp.read_reg(ESPLoader.CHIP_DETECT_MAGIC_REG_ADDR, timeout=timeout)
 
         t = time.time() - t
+        progress(
+            ProgressEvent("done", address, seq, blocks, bytes_sent, total, total, t)
+        )
         speed_msg = ""
         if compress:
             if t > 0.0:
-                speed_msg = " (effective %.1f kbit/s)" % (uncsize / t * 8 / 1000)
+                speed_msg = " (effective %.1f kbit/s)" % (total / t * 8 / 1000)
             print_overwrite(
                 "Wrote %d bytes (%d compressed) at 0x%08x in %.1f seconds%s..."
-                % (uncsize, bytes_sent, address, t, speed_msg),
+                % (total, bytes_sent, address, t, speed_msg),
                 last_line=True,
             )
         else:
@@ -665,12 +1187,48 @@ def write_flash(esp, args):
                         "MD5 of 0xFF is %s"
                         % (hashlib.md5(b"\xFF" * uncsize).hexdigest())
                     )
-                    raise FatalError("MD5 of file does not match data in flash!")
+                    for entry_md5, entry_level in cache_used:
+                        # Don't send the same data to the next device
+                        print("Dropping the cached compressed data used")
+                        cache.remove(entry_md5, entry_level, esp.FLASH_WRITE_SIZE)
+                    regions = _bisect_mismatches(esp, address, image)
+                    _print_regions(regions, address)
+                    if not rewrite or address % esp.FLASH_SECTOR_SIZE:
+                        raise FatalError("MD5 of file does not match data in flash!")
+                    print("Rewriting them...")
+                    rewrite_size = sum(length for _, length in regions)
+                    progress(
+                        ProgressEvent(
+                            "rewrite",
+                            address,
+                            0,
+                            0,
+                            0,
+                            0,
+                            rewrite_size,
+                            0.0,
+                            {"regions": [[address + o, n] for o, n in regions]},
+                        )
+                    )
+                    _rewrite_regions(esp, address, image, regions)
+                    if esp.flash_md5sum(address, uncsize) != calcmd5:
+                        raise FatalError("MD5 of file does not match data in flash!")
+                    print("Hash of data verified after rewriting.")
                 else:
                     print("Hash of data verified.")
             except NotImplementedInROMError:
                 pass
 
+    if skipped:
+        print(
+            "Skipped %d of %d files already in flash: %s"
+            % (
+                len(skipped),
+                len(all_files),
+                ", ".join("%s at 0x%08x" % (name, a) for a, name in skipped),
+            )
+        )
+
     print("\nLeaving...")
 
     if esp.IS_STUB:
@@ -705,6 +1263,131 @@ def write_flash(esp, args):
             verify_flash(esp, args)
 
 
+def write_flash_stream(
+    esp, address, size, chunks, compress_level=9, progress_callback=None
+):
+    """
+    Write data to flash while it is still being received.
+
+    'chunks' is an iterable of bytes objects adding up to exactly 'size' bytes
+    (e.g. a download in progress). Data is compressed incrementally and every
+    full compressed block is sent as soon as it is available, so the transfer
+    overlaps with whatever produces the chunks. Requires the flasher stub.
+
+    progress_callback, if given, receives rate-limited ProgressEvent objects
+    (see write_flash()); total_bytes is the padded size.
+
+    Returns the MD5 hex digest of the written (padded) data, already verified
+    against the flash contents.
+    """
+    progress = ProgressReporter(progress_callback or print_progress)
+    if not esp.IS_STUB:
+        raise FatalError("Streaming flash writes require the flasher stub")
+
+    padded_size = size + (-size % 4)
+    # The total compressed size is not known until the last chunk arrives.
+    # The stub only uses it as an upper bound, so announce zlib's worst case.
+    max_compsize = (
+        padded_size
+        + (padded_size >> 12)
+        + (padded_size >> 14)
+        + (padded_size >> 25)
+        + 13
+    )
+    esp.flash_defl_begin(padded_size, max_compsize, address)
+
+    compressor = zlib.compressobj(compress_level)
+    decompress = zlib.decompressobj()
+    md5 = hashlib.md5()
+    pending = bytearray()
+    seq = 0
+    received = 0
+    bytes_sent = 0
+    bytes_written = 0
+    timeout = DEFAULT_TIMEOUT
+    t = time.time()
+
+    def send_block(block):
+        nonlocal seq, bytes_sent, bytes_written, timeout
+        block_uncompressed = len(decompress.decompress(block))
+        bytes_written += block_uncompressed
+        block_timeout = max(
+            DEFAULT_TIMEOUT,
+            timeout_per_mb(ERASE_WRITE_TIMEOUT_PER_MB, block_uncompressed),
+        )
+        esp.flash_defl_block(block, seq, timeout=timeout)
+        # Stub ACKs when block is received,
+        # then writes to flash while receiving the block after it
+        timeout = block_timeout
+        bytes_sent += len(block)
+        progress(
+            ProgressEvent(
+                "write",
+                address,
+                seq,
+                div_roundup(max_compsize, esp.FLASH_WRITE_SIZE),
+                bytes_sent,
+                bytes_written,
+                padded_size,
+                time.time() - t,
+            )
+        )
+        seq += 1
+
+    def send_full_blocks():
+        while len(pending) >= esp.FLASH_WRITE_SIZE:
+            send_block(bytes(pending[: esp.FLASH_WRITE_SIZE]))
+            del pending[: esp.FLASH_WRITE_SIZE]
+
+    for chunk in chunks:
+        received += len(chunk)
+        if received > size:
+            raise FatalError(
+                "Received more data than announced (%d bytes expected)" % size
+            )
+        md5.update(chunk)
+        pending += compressor.compress(chunk)
+        send_full_blocks()
+
+    if received != size:
+        raise FatalError(
+            "Data stream ended after %d bytes, %d bytes expected" % (received, size)
+        )
+    tail = b"\xFF" * (padded_size - size)
+    md5.update(tail)
+    pending += compressor.compress(tail) + compressor.flush()
+    send_full_blocks()
+    if pending:
+        send_block(bytes(pending))
+
+    # Wait until the last block has actually been written out to flash
+    esp.read_reg(ESPLoader.CHIP_DETECT_MAGIC_REG_ADDR, timeout=timeout)
+
+    t = time.time() - t
+    progress(
+        ProgressEvent(
+            "done", address, seq, seq, bytes_sent, padded_size, padded_size, t
+        )
+    )
+    speed_msg = ""
+    if t > 0.0:
+        speed_msg = " (effective %.1f kbit/s)" % (padded_size / t * 8 / 1000)
+    print_overwrite(
+        "Wrote %d bytes (%d compressed) at 0x%08x in %.1f seconds%s..."
+        % (padded_size, bytes_sent, address, t, speed_msg),
+        last_line=True,
+    )
+
+    calcmd5 = md5.hexdigest()
+    res = esp.flash_md5sum(address, padded_size)
+    if res != calcmd5:
+        print("File  md5: %s" % calcmd5)
+        print("Flash md5: %s" % res)
+        raise FatalError("MD5 of file does not match data in flash!")
+    print("Hash of data verified.")
+    return calcmd5
+
+
 def image_info(args):
     def v2():
         def get_key_from_value(dict, val):
@@ -1157,7 +1840,7 @@ def read_flash(esp, args):
 
 
 def verify_flash(esp, args):
-    differences = False
+    differences = rewritten = 0
 
     for address, argfile in args.addr_filename:
         image = pad_to(argfile.read(), 4)
@@ -1177,23 +1860,60 @@ def verify_flash(esp, args):
             print("-- verify OK (digest matched)")
             continue
         else:
-            differences = True
-            if getattr(args, "diff", "no") != "yes":
+            differences += 1
+            show_diff = getattr(args, "diff", "no") == "yes"
+            rewrite = getattr(args, "rewrite", False)
+            if not show_diff and not rewrite:
                 print("-- verify FAILED (digest mismatch)")
                 continue
 
-        flash = esp.read_flash(address, image_size)
-        assert flash != image
-        diff = [i for i in range(image_size) if flash[i] != image[i]]
-        print(
-            "-- verify FAILED: %d differences, first @ 0x%08x"
-            % (len(diff), address + diff[0])
-        )
-        for d in diff:
-            flash_byte = flash[d]
-            image_byte = image[d]
-            print("   %08x %02x %02x" % (address + d, flash_byte, image_byte))
-    if differences:
+        # Narrow the mismatch down to sectors by digest, only read those back
+        regions = _bisect_mismatches(esp, address, image)
+        if show_diff:
+            ranges = _differing_ranges(esp, address, image, regions)
+        if show_diff and not ranges:
+            # e.g. a bad digest read, or the flash changed in between
+            if esp.flash_md5sum(address, image_size) == expected_digest:
+                print("-- verify OK (no differences on read-back, digest matched)")
+                differences -= 1
+                continue
+            print("-- verify FAILED (digest mismatch, no differences on read-back)")
+        elif show_diff:
+            print(
+                "-- verify FAILED: %d differences in %d ranges, first @ 0x%08x"
+                % (
+                    sum(len(flash_run) for _, flash_run, _ in ranges),
+                    len(ranges),
+                    address + ranges[0][0],
+                )
+            )
+            for offset, flash_run, image_run in ranges:
+                print(
+                    "   %08x-%08x flash %s%s image %s%s"
+                    % (
+                        address + offset,
+                        address + offset + len(flash_run) - 1,
+                        flash_run[:DIFF_SHOW_BYTES].hex(),
+                        "..." if len(flash_run) > DIFF_SHOW_BYTES else "",
+                        image_run[:DIFF_SHOW_BYTES].hex(),
+                        "..." if len(image_run) > DIFF_SHOW_BYTES else "",
+                    )
+                )
+        else:
+            print("-- verify FAILED (digest mismatch)")
+            _print_regions(regions, address)
+        if rewrite:
+            if address % esp.FLASH_SECTOR_SIZE:
+                print("-- cannot rewrite, address is not aligned to a flash sector")
+                continue
+            print("-- rewriting the differing sectors...")
+            _rewrite_regions(esp, address, image, regions)
+            if esp.flash_md5sum(address, image_size) == expected_digest:
+                print("-- verify OK after rewriting (digest matched)")
+                rewritten += 1
+            else:
+                print("-- verify FAILED after rewriting (digest mismatch)")
+    if differences > rewritten:
         raise FatalError("Verify failed.")
 
 
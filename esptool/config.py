@@ -20,6 +20,9 @@ CONFIG_OPTIONS = [
     "write_block_attempts",
     "reset_delay",
     "custom_reset_sequence",
+    "image_cache_dir",
+    "image_cache_size_mb",
+    "adapter_profiles_file",
 ]
 
 
@@ -0,0 +1,145 @@
+# SPDX-FileCopyrightText: 2014-2023 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import hashlib
+import os
+import struct
+import tempfile
+
+from .loader import IMAGE_CACHE_DIR, IMAGE_CACHE_SIZE_MB
+
+# Entry layout: header, one uint32 uncompressed size per block, zlib stream
+ENTRY_MAGIC = b"EZC2"
+# magic, uncompressed size, blocks, MD5 of the zlib stream
+ENTRY_HEADER = struct.Struct("<4sII16s")
+ENTRY_SUFFIX = ".ezc"
+
+
+class CompressedImageCache(object):
+    """On-disk cache of compressed write_flash payloads.
+
+    Entries are keyed by the MD5 of the (patched) image, the compression level
+    and the loader's FLASH_WRITE_SIZE. Each holds the zlib stream and the
+    uncompressed size of every FLASH_WRITE_SIZE block of it, so a cached image
+    needs neither compressing nor decompressing before it is sent. The MD5 of
+    the zlib stream is checked on every hit, a damaged entry is a miss.
+
+    Total size is bounded, least recently used entries (by file modification
+    time, refreshed on every hit) are evicted first. Entries are written
+    atomically, so several esptool processes can share a cache directory.
+    Cache errors are never fatal: they are reported and treated as a miss.
+    """
+
+    def __init__(self, directory=IMAGE_CACHE_DIR, max_size=IMAGE_CACHE_SIZE_MB):
+        self.directory = directory
+        self.max_bytes = int(max_size * 1024 * 1024)
+
+    def _path(self, md5, level, write_size):
+        return os.path.join(
+            self.directory, "%s-%d-%x%s" % (md5, level, write_size, ENTRY_SUFFIX)
+        )
+
+    def contains(self, md5, level, write_size):
+        return self.max_bytes > 0 and os.path.isfile(
+            self._path(md5, level, write_size)
+        )
+
+    def get(self, md5, level, write_size, uncompressed_size):
+        """Return (compressed image, block uncompressed sizes) or None"""
+        if self.max_bytes <= 0:
+            return None
+        path = self._path(md5, level, write_size)
+        try:
+            with open(path, "rb") as f:
+                entry = f.read()
+            os.utime(path)  # most recently used
+        except FileNotFoundError:
+            return None
+        except OSError as e:
+            print("WARNING: Cannot read image cache entry %s: %s" % (path, e))
+            return None
+
+        try:
+            magic, size, blocks, digest = ENTRY_HEADER.unpack_from(entry)
+            table_end = ENTRY_HEADER.size + blocks * 4
+            block_sizes = list(
+                struct.unpack_from("<%dI" % blocks, entry, ENTRY_HEADER.size)
+            )
+            image = entry[table_end:]
+        except struct.error:
+            magic = None
+        if (
+            magic != ENTRY_MAGIC
+            or size != uncompressed_size
+            or sum(block_sizes) != size
+            or blocks != (len(image) + write_size - 1) // write_size
+            or hashlib.md5(image).digest() != digest
+        ):
+            print("WARNING: Discarding invalid image cache entry %s" % path)
+            self._remove(path)
+            return None
+        return image, block_sizes
+
+    def put(self, md5, level, write_size, image, block_sizes):
+        """Store a compressed image and its block uncompressed sizes"""
+        entry_size = ENTRY_HEADER.size + len(block_sizes) * 4 + len(image)
+        if entry_size > self.max_bytes:
+            return
+        path = self._path(md5, level, write_size)
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(
+                dir=self.directory, suffix=ENTRY_SUFFIX + ".tmp"
+            )
+            try:
+                with os.fdopen(fd, "wb") as f:
+                    f.write(
+                        ENTRY_HEADER.pack(
+                            ENTRY_MAGIC,
+                            sum(block_sizes),
+                            len(block_sizes),
+                            hashlib.md5(image).digest(),
+                        )
+                    )
+                    f.write(struct.pack("<%dI" % len(block_sizes), *block_sizes))
+                    f.write(image)
+                os.replace(tmp_path, path)
+            except BaseException:
+                self._remove(tmp_path)
+                raise
+            self._evict(keep=path)
+        except OSError as e:
+            print("WARNING: Cannot write image cache entry %s: %s" % (path, e))
+
+    def remove(self, md5, level, write_size):
+        """Drop an entry, e.g. one whose image didn't verify after writing"""
+        self._remove(self._path(md5, level, write_size))
+
+    def _evict(self, keep):
+        """Remove least recently used entries until the cache fits max_bytes"""
+        entries = []
+        with os.scandir(self.directory) as it:
+            for dir_entry in it:
+                if not dir_entry.name.endswith(ENTRY_SUFFIX):
+                    continue
+                try:
+                    stat = dir_entry.stat()
+                except FileNotFoundError:  # evicted by another process
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, dir_entry.path))
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            if path != keep:
+                self._remove(path)
+                total -= size
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
@@ -4,6 +4,7 @@
 # SPDX-License-Identifier: GPL-2.0-or-later
 
 import base64
+import contextlib
 import hashlib
 import itertools
 import json
@@ -98,6 +99,31 @@ DEFAULT_SERIAL_WRITE_TIMEOUT = cfg.getfloat("serial_write_timeout", 10)
 DEFAULT_CONNECT_ATTEMPTS = cfg.getint("connect_attempts", 7)
 # Number of times to try writing a data block
 WRITE_BLOCK_ATTEMPTS = cfg.getint("write_block_attempts", 3)
+# Smaller blobs are checksummed byte by byte, larger ones by XOR-folding
+CHECKSUM_FOLD_MIN_SIZE = 64
+# Bytes of READ_REG requests read_regs() sends before it collects the replies,
+# so a burst fits the 128 byte UART receive FIFO of the chip
+READ_REG_BATCH_BYTES = 96
+# Data commands this long or longer are timed to estimate the link throughput
+LINK_SAMPLE_MIN_SIZE = 1024
+# Per-user directory for data esptool learns or can recreate
+CACHE_DIR = os.path.join(
+    os.path.expanduser("~"),
+    ".cache/esptool" if os.name == "posix" else "AppData/Local/esptool/cache",
+)
+# Where write_flash keeps compressed images for reuse, and the cache size limit
+# (0 disables the cache)
+IMAGE_CACHE_DIR = cfg.get("image_cache_dir", CACHE_DIR)
+IMAGE_CACHE_SIZE_MB = cfg.getfloat("image_cache_size_mb", 64)
+# Settings learned per USB-serial adapter, e.g. the highest stable baud rate
+# or the reset strategy that connects
+ADAPTER_PROFILES_FILE = cfg.get(
+    "adapter_profiles_file", os.path.join(CACHE_DIR, "adapters.json")
+)
+# Successful first-try connects with a learned reset delay before a shorter
+# one is tried, and the resolution of that search (in seconds)
+RESET_TUNE_AFTER = 3
+RESET_DELAY_STEP = 0.005
 
 STUBS_DIR = os.path.join(os.path.dirname(__file__), "targets", "stub_flasher")
 
@@ -244,6 +270,13 @@ class ESPLoader(object):
     # Initial state for the checksum routine
     ESP_CHECKSUM_MAGIC = 0xEF
 
+    # Data commands timed to estimate the link throughput, see link_throughput()
+    LINK_SAMPLE_OPS = (ESP_MEM_DATA, ESP_FLASH_DATA, ESP_FLASH_DEFL_DATA)
+    _link_wire_time = 0.0
+    _link_elapsed = 0.0
+    # Register values answered by read_reg() meanwhile, see prefetched_regs()
+    _prefetched_regs = None
+
     # Flash sector size, minimum unit of erase.
     FLASH_SECTOR_SIZE = 0x1000
 
@@ -384,11 +417,10 @@ class ESPLoader(object):
 
     def write(self, packet):
         """Write bytes to the serial port while performing SLIP escaping"""
-        buf = (
-            b"\xc0"
-            + (packet.replace(b"\xdb", b"\xdb\xdd").replace(b"\xc0", b"\xdb\xdc"))
-            + b"\xc0"
-        )
+        self.write_frame(slip_encode(packet))
+
+    def write_frame(self, buf):
+        """Write an already SLIP-encoded frame to the serial port"""
         self.trace("Write %d bytes: %s", len(buf), HexFormatter(buf))
         self._port.write(buf)
 
@@ -405,11 +437,80 @@ class ESPLoader(object):
 
     @staticmethod
     def checksum(data, state=ESP_CHECKSUM_MAGIC):
-        """Calculate checksum of a blob, as it is defined by the ROM"""
-        for b in data:
-            state ^= b
+        """Calculate checksum of a blob, as it is defined by the ROM
+
+        The ROM XORs every byte into the state. Except for tiny blobs, the
+        bytes are XOR-folded as one wide integer, halving its width each
+        round, which leaves the XOR of all bytes in the lowest byte.
+        """
+        if len(data) < CHECKSUM_FOLD_MIN_SIZE:
+            for b in data:
+                state ^= b
+            return state
+
+        folded = int.from_bytes(data, "little")
+        size = len(data)
+        while size > 1:
+            size = (size + 1) // 2
+            bits = size * 8
+            folded = (folded >> bits) ^ (folded & ((1 << bits) - 1))
+        return state ^ folded
+
+    def _link_sample(self, sent, elapsed):
+        """Record the round trip of a large command, see link_throughput()"""
+        self._link_wire_time += sent * 10.0 / self._port.baudrate  # 8N1
+        self._link_elapsed += elapsed
+
+    def link_efficiency(self):
+        """Time on the wire / round trip time of the data commands so far, or None"""
+        if self._link_elapsed > 0:
+            return min(1.0, self._link_wire_time / self._link_elapsed)
+        return None
+
+    def link_throughput(self):
+        """Estimated effective bytes/s of large commands at the current baud rate.
+
+        Scales the wire speed by the efficiency (time on the wire / round
+        trip time) measured on data commands so far, e.g. during stub upload,
+        so a measurement at one baud rate carries over to the next one.
+        Without measurements, the efficiency last measured through the same
+        adapter (see cmds.negotiate_baud()) is used, else the wire speed.
+        """
+        efficiency = self.link_efficiency()
+        if efficiency is None:
+            efficiency = self._remembered_link_efficiency()
+        return self._port.baudrate / 10.0 * (efficiency or 1.0)
+
+    def _remembered_link_efficiency(self):
+        from .adapters import adapter_key, get_adapter_profiles
 
-        return state
+        port = getattr(self._port, "port", None)
+        if port is None:
+            return None
+        return get_adapter_profiles().get(adapter_key(port)).get("link_efficiency")
+
+    def _stub_loader(self):
+        """The STUB_CLASS instance taking over from this loader"""
+        stub_loader = self.STUB_CLASS(self)
+        # Same link: keep what was measured on it, e.g. during the upload
+        stub_loader._link_wire_time = self._link_wire_time
+        stub_loader._link_elapsed = self._link_elapsed
+        return stub_loader
+
+    def frame_command(self, op, data=b"", chk=0):
+        """Pack a request and SLIP-encode it, ready for command(frame=...)"""
+        return slip_encode(struct.pack(b"<BBHI", 0x00, op, len(data), chk) + data)
+
+    def flash_block_frame(self, op, data, seq):
+        """Frame a flash data block (ESP_FLASH_DATA, ESP_FLASH_DEFL_DATA or
+        ESP_FLASH_ENCRYPT_DATA) for sending with the matching *_block method.
+
+        Pure host-side work, safe to run in another thread while a
+        previous block is in flight.
+        """
+        return self.frame_command(
+            op, struct.pack("<IIII", len(data), seq, 0, 0) + data, self.checksum(data)
+        )
 
     def command(
         self,
@@ -418,15 +519,32 @@ class ESPLoader(object):
         chk=0,
         wait_response=True,
         timeout=DEFAULT_TIMEOUT,
+        frame=None,
     ):
-        """Send a request and read the response"""
+        """Send a request and read the response
+
+        If frame is given, it is the request already packed and SLIP-encoded
+        by frame_command() and is written as-is; data and chk are ignored.
+        """
         saved_timeout = self._port.timeout
         new_timeout = min(timeout, MAX_TIMEOUT)
         if new_timeout != saved_timeout:
             self._port.timeout = new_timeout
 
+        started = time.time()
+        sent = 0
         try:
-            if op is not None:
+            if op is not None and frame is not None:
+                self.trace(
+                    "command op=0x%02x frame len=%s wait_response=%d timeout=%.3f",
+                    op,
+                    len(frame),
+                    1 if wait_response else 0,
+                    timeout,
+                )
+                self.write_frame(frame)
+                sent = len(frame)
+            elif op is not None:
                 self.trace(
                     "command op=0x%02x data len=%s wait_response=%d "
                     "timeout=%.3f data=%s",
@@ -438,39 +556,52 @@ class ESPLoader(object):
                 )
                 pkt = struct.pack(b"<BBHI", 0x00, op, len(data), chk) + data
                 self.write(pkt)
+                sent = len(pkt) + 2
 
             if not wait_response:
                 return
 
-            # tries to get a response until that response has the
-            # same operation as the request or a retries limit has
-            # exceeded. This is needed for some esp8266s that
-            # reply with more sync responses than expected.
-            for retry in range(100):
-                p = self.read()
-                if len(p) < 8:
-                    continue
-                (resp, op_ret, len_ret, val) = struct.unpack("<BBHI", p[:8])
-                if resp != 1:
-                    continue
-                data = p[8:]
-
-                if op is None or op_ret == op:
-                    return val, data
-                if byte(data, 0) != 0 and byte(data, 1) == self.ROM_INVALID_RECV_MSG:
-                    # Unsupported read_reg can result in
-                    # more than one error response for some reason
-                    self.flush_input()
-                    raise UnsupportedCommandError(self, op)
-
+            val, data = self.read_response(op)
+            if op in self.LINK_SAMPLE_OPS and sent >= LINK_SAMPLE_MIN_SIZE:
+                self._link_sample(sent, time.time() - started)
+            return val, data
         finally:
             if new_timeout != saved_timeout:
                 self._port.timeout = saved_timeout
 
+    def read_response(self, op=None):
+        """Read the response to a request already sent, return (val, data)"""
+        # tries to get a response until that response has the
+        # same operation as the request or a retries limit has
+        # exceeded. This is needed for some esp8266s that
+        # reply with more sync responses than expected.
+        for retry in range(100):
+            p = self.read()
+            if len(p) < 8:
+                continue
+            (resp, op_ret, len_ret, val) = struct.unpack("<BBHI", p[:8])
+            if resp != 1:
+                continue
+            data = p[8:]
+
+            if op is None or op_ret == op:
+                return val, data
+            if byte(data, 0) != 0 and byte(data, 1) == self.ROM_INVALID_RECV_MSG:
+                # Unsupported read_reg can result in
+                # more than one error response for some reason
+                self.flush_input()
+                raise UnsupportedCommandError(self, op)
+
         raise FatalError("Response doesn't match request")
 
     def check_command(
-        self, op_description, op=None, data=b"", chk=0, timeout=DEFAULT_TIMEOUT
+        self,
+        op_description,
+        op=None,
+        data=b"",
+        chk=0,
+        timeout=DEFAULT_TIMEOUT,
+        frame=None,
     ):
         """
         Execute a command with 'command', check the result code and throw an appropriate
@@ -478,7 +609,7 @@ class ESPLoader(object):
 
         Returns the "result" of a successful command.
         """
-        val, data = self.command(op, data, chk, timeout=timeout)
+        val, data = self.command(op, data, chk, timeout=timeout, frame=frame)
 
         # things are a bit weird here, bear with us
 
@@ -629,6 +760,7 @@ class ESPLoader(object):
         used ESP chip, external settings, and environment variables.
         Returns a tuple of one or more reset strategies to be tried sequentially.
         """
+        self._reset_profile = None
         cfg_custom_reset_sequence = cfg.get("custom_reset_sequence")
         if cfg_custom_reset_sequence is not None:
             return (CustomReset(self._port, cfg_custom_reset_sequence),)
@@ -641,10 +773,11 @@ class ESPLoader(object):
             extra_delay = DEFAULT_RESET_DELAY + 0.5
 
         # This FPGA delay is for Espressif internal use
-        if (
+        fpga = (
             self.CHIP_NAME == "ESP32"
             and os.environ.get("ESPTOOL_ENV_FPGA", "").strip() == "1"
-        ):
+        )
+        if fpga:
             delay = extra_delay = 7
 
         # USB-JTAG/Serial mode
@@ -653,17 +786,97 @@ class ESPLoader(object):
 
         # USB-to-Serial bridge
         if os.name != "nt" and not self._port.name.startswith("rfc2217:"):
-            return (
+            sequence = (
                 UnixTightReset(self._port, delay),
                 UnixTightReset(self._port, extra_delay),
                 ClassicReset(self._port, delay),
                 ClassicReset(self._port, extra_delay),
             )
+        else:
+            sequence = (
+                ClassicReset(self._port, delay),
+                ClassicReset(self._port, extra_delay),
+            )
+
+        # Delays set by the user or for the FPGA are used as they are
+        if mode == "default_reset" and cfg_reset_delay is None and not fpga:
+            sequence = self._with_learned_reset(sequence)
+        return sequence
+
+    def _with_learned_reset(self, sequence):
+        """
+        Puts the reset strategy and delay that last connected through this adapter
+        (see _learn_reset()) in front of the sequence.
+
+        Once that delay has connected at the first try RESET_TUNE_AFTER times in
+        a row, a shorter one is tried before it, halfway to the longest delay
+        known to fail with the same strategy. So the delay is bisected down to
+        the shortest one which still connects reliably.
+        """
+        from .adapters import adapter_key, get_adapter_profiles
+
+        self._reset_profile = adapter_key(self._port.port)
+        profile = get_adapter_profiles().get(self._reset_profile)
+        strategies = {type(s).__name__: type(s) for s in sequence}
+        strategy = strategies.get(profile.get("reset_strategy"))
+        delay = profile.get("reset_delay")
+        if strategy is None or not isinstance(delay, (int, float)):
+            return sequence
+
+        learned = [strategy(self._port, delay)]
+        shortest_failed = profile.get("reset_delay_failed", 0)
+        if (
+            profile.get("reset_successes", 0) >= RESET_TUNE_AFTER
+            and delay - shortest_failed >= 2 * RESET_DELAY_STEP
+        ):
+            learned.insert(
+                0, strategy(self._port, round((delay + shortest_failed) / 2, 3))
+            )
+        return tuple(learned) + tuple(
+            s for s in sequence if type(s) is not strategy or s.reset_delay != delay
+        )
+
+    def _learn_reset(self, tried):
+        """
+        Remembers which reset strategy and delay connected through this adapter,
+        after trying the strategies in the 'tried' list (the last one connected).
+        Shorter delays of the same strategy which failed on the way bound the
+        delay search of _with_learned_reset().
+        """
+        from .adapters import get_adapter_profiles
+
+        profiles = get_adapter_profiles()
+        profile = profiles.get(self._reset_profile)
+        worked = tried[-1]
+        name = type(worked).__name__
+        known = (
+            name == profile.get("reset_strategy")
+            and worked.reset_delay == profile.get("reset_delay")
+        )
 
-        return (
-            ClassicReset(self._port, delay),
-            ClassicReset(self._port, extra_delay),
+        shortest_failed = (
+            profile.get("reset_delay_failed")
+            if name == profile.get("reset_strategy")
+            else None
         )
+        for s in tried[:-1]:
+            if type(s) is type(worked) and s.reset_delay < worked.reset_delay:
+                shortest_failed = max(shortest_failed or 0, s.reset_delay)
+        if shortest_failed is not None and shortest_failed >= worked.reset_delay:
+            shortest_failed = None
+
+        settings = {
+            "reset_strategy": name,
+            "reset_delay": worked.reset_delay,
+            "reset_delay_failed": shortest_failed,
+            "reset_successes": (
+                min(profile.get("reset_successes", 0) + 1, RESET_TUNE_AFTER)
+                if known
+                else 1
+            ),
+        }
+        if any(profile.get(k) != v for k, v in settings.items()):
+            profiles.update(self._reset_profile, **settings)
 
     def connect(
         self,
@@ -684,17 +897,22 @@ class ESPLoader(object):
         last_error = None
 
         reset_sequence = self._construct_reset_strategy_sequence(mode)
+        tried = []
         try:
             for _, reset_strategy in zip(
                 range(attempts) if attempts > 0 else itertools.count(),
                 itertools.cycle(reset_sequence),
             ):
+                tried.append(reset_strategy)
                 last_error = self._connect_attempt(reset_strategy, mode)
                 if last_error is None:
                     break
         finally:
             print("")  # end 'Connecting...' line
 
+        if last_error is None and self._reset_profile is not None:
+            self._learn_reset(tried)
+
         if last_error is not None:
             additional_msg = ""
             if self.CHIP_NAME == "ESP32-C2" and self._port.baudrate < 115200:
@@ -763,6 +981,8 @@ class ESPLoader(object):
         # we don't call check_command here because read_reg() function is called
         # when detecting chip type, and the way we check for success
         # (STATUS_BYTES_LENGTH) is different for different chip types (!)
+        if self._prefetched_regs is not None and addr in self._prefetched_regs:
+            return self._prefetched_regs[addr]
         val, data = self.command(
             self.ESP_READ_REG, struct.pack("<I", addr), timeout=timeout
         )
@@ -772,6 +992,106 @@ class ESPLoader(object):
             )
         return val
 
+    def read_regs(self, addrs, timeout=DEFAULT_TIMEOUT):
+        """Read several memory addresses in target, return their values in order
+
+        The READ_REG requests are sent back-to-back without waiting for the
+        replies, in bursts of up to READ_REG_BATCH_BYTES, and the replies are
+        collected in order. This saves a serial round trip per address over
+        calling read_reg() for each. As with read_reg(), addresses held by
+        prefetched_regs() are not read again.
+        """
+        addrs = list(addrs)
+        known = dict(self._prefetched_regs or {})
+        missing = list(dict.fromkeys(addr for addr in addrs if addr not in known))
+        if missing:
+            try:
+                values = self._read_regs(missing, timeout)
+            except (FatalError, UnsupportedCommandError):
+                # e.g. a reply got lost, read them one at a time instead
+                values = [self.read_reg(addr, timeout) for addr in missing]
+            known.update(zip(missing, values))
+        return [known[addr] for addr in addrs]
+
+    def _read_regs(self, addrs, timeout):
+        frames = [
+            self.frame_command(self.ESP_READ_REG, struct.pack("<I", addr), 0)
+            for addr in addrs
+        ]
+        values = []
+        saved_timeout = self._port.timeout
+        new_timeout = min(timeout, MAX_TIMEOUT)
+        if new_timeout != saved_timeout:
+            self._port.timeout = new_timeout
+        try:
+            start = 0
+            while start < len(frames):
+                end = start + 1
+                burst = len(frames[start])
+                while (
+                    end < len(frames)
+                    and burst + len(frames[end]) <= READ_REG_BATCH_BYTES
+                ):
+                    burst += len(frames[end])
+                    end += 1
+                self.trace("read_regs burst of %d requests", end - start)
+                self.write_frame(b"".join(frames[start:end]))
+                for i in range(start, end):
+                    try:
+                        val, data = self.read_response(self.ESP_READ_REG)
+                    except (FatalError, UnsupportedCommandError):
+                        # The reader has failed (e.g. timed out on a dropped
+                        # reply) and can't be read from anymore, start afresh
+                        self.flush_input()
+                        raise
+                    if byte(data, 0) != 0:
+                        # Discard the replies still due, they would be taken
+                        # for replies to later requests
+                        for _ in range(end - i - 1):
+                            try:
+                                self.read_response(self.ESP_READ_REG)
+                            except (FatalError, UnsupportedCommandError):
+                                break
+                        self.flush_input()
+                        raise FatalError.WithResult(
+                            "Failed to read register address %08x" % addrs[i], data
+                        )
+                    values.append(val)
+                start = end
+        finally:
+            if new_timeout != saved_timeout:
+                self._port.timeout = saved_timeout
+        return values
+
+    @contextlib.contextmanager
+    def prefetched_regs(self, addrs):
+        """
+        Reads the registers at addrs with one read_regs() batch, and answers
+        read_reg() of any of them from it until the with block ends. Only for
+        registers which cannot change meanwhile, such as eFuses. If the batch
+        fails (e.g. READ_REG is unsupported), read_reg() reads them as usual.
+        """
+        saved = self._prefetched_regs
+        prefetched = dict(saved or {})
+        addrs = list(dict.fromkeys(addr for addr in addrs if addr not in prefetched))
+        try:
+            prefetched.update(zip(addrs, self._read_regs(addrs, DEFAULT_TIMEOUT)))
+        except (FatalError, UnsupportedCommandError):
+            pass
+        self._prefetched_regs = prefetched
+        try:
+            yield
+        finally:
+            self._prefetched_regs = saved
+
+    def get_identification_regs(self):
+        """
+        Registers read by the chip identification and eFuse helpers
+        (get_chip_description(), read_mac(), get_secure_boot_enabled(), ...),
+        for prefetched_regs()
+        """
+        return []
+
     def write_reg(self, addr, value, mask=0xFFFFFFFF, delay_us=0, delay_after_us=0):
         """Write to memory address in target"""
         command = struct.pack("<IIII", addr, value, mask, delay_us)
@@ -879,16 +1199,20 @@ class ESPLoader(object):
             print("Took %.2fs to erase flash block" % (time.time() - t))
         return num_blocks
 
-    def flash_block(self, data, seq, timeout=DEFAULT_TIMEOUT):
-        """Write block to flash, retry if fail"""
+    def flash_block(self, data, seq, timeout=DEFAULT_TIMEOUT, frame=None):
+        """Write block to flash, retry if fail
+
+        frame optionally holds the block pre-framed by flash_block_frame().
+        """
+        if frame is None:
+            frame = self.flash_block_frame(self.ESP_FLASH_DATA, data, seq)
         for attempts_left in range(WRITE_BLOCK_ATTEMPTS - 1, -1, -1):
             try:
                 self.check_command(
                     "write to target Flash after seq %d" % seq,
                     self.ESP_FLASH_DATA,
-                    struct.pack("<IIII", len(data), seq, 0, 0) + data,
-                    self.checksum(data),
                     timeout=timeout,
+                    frame=frame,
                 )
                 break
             except FatalError:
@@ -900,21 +1224,22 @@ class ESPLoader(object):
                 else:
                     raise
 
-    def flash_encrypt_block(self, data, seq, timeout=DEFAULT_TIMEOUT):
+    def flash_encrypt_block(self, data, seq, timeout=DEFAULT_TIMEOUT, frame=None):
         """Encrypt, write block to flash, retry if fail"""
         if self.SUPPORTS_ENCRYPTED_FLASH and not self.IS_STUB:
             # ROM support performs the encrypted writes via the normal write command,
             # triggered by flash_begin(begin_rom_encrypted=True)
-            return self.flash_block(data, seq, timeout)
+            return self.flash_block(data, seq, timeout, frame)
 
+        if frame is None:
+            frame = self.flash_block_frame(self.ESP_FLASH_ENCRYPT_DATA, data, seq)
         for attempts_left in range(WRITE_BLOCK_ATTEMPTS - 1, -1, -1):
             try:
                 self.check_command(
                     "Write encrypted to target Flash after seq %d" % seq,
                     self.ESP_FLASH_ENCRYPT_DATA,
-                    struct.pack("<IIII", len(data), seq, 0, 0) + data,
-                    self.checksum(data),
                     timeout=timeout,
+                    frame=frame,
                 )
                 break
             except FatalError:
@@ -1011,7 +1336,7 @@ class ESPLoader(object):
 
         if self.sync_stub_detected:
             print("Stub is already running. No upload is necessary.")
-            return self.STUB_CLASS(self)
+            return self._stub_loader()
 
         # Upload
         print("Uploading stub...")
@@ -1039,7 +1364,7 @@ class ESPLoader(object):
         if p != b"OHAI":
             raise FatalError(f"Failed to start stub. Unexpected response: {p}")
         print("Stub running...")
-        return self.STUB_CLASS(self)
+        return self._stub_loader()
 
     @stub_and_esp32_function_only
     def flash_defl_begin(self, size, compsize, offset):
@@ -1084,16 +1409,17 @@ class ESPLoader(object):
         return num_blocks
 
     @stub_and_esp32_function_only
-    def flash_defl_block(self, data, seq, timeout=DEFAULT_TIMEOUT):
+    def flash_defl_block(self, data, seq, timeout=DEFAULT_TIMEOUT, frame=None):
         """Write block to flash, send compressed, retry if fail"""
+        if frame is None:
+            frame = self.flash_block_frame(self.ESP_FLASH_DEFL_DATA, data, seq)
         for attempts_left in range(WRITE_BLOCK_ATTEMPTS - 1, -1, -1):
             try:
                 self.check_command(
                     "write compressed data to flash after seq %d" % seq,
                     self.ESP_FLASH_DEFL_DATA,
-                    struct.pack("<IIII", len(data), seq, 0, 0) + data,
-                    self.checksum(data),
                     timeout=timeout,
+                    frame=frame,
                 )
                 break
             except FatalError:
@@ -1527,6 +1853,19 @@ class ESPLoader(object):
             pass
 
 
+def slip_encode(packet):
+    """SLIP-encode a packet into a frame, delimiters included"""
+    return (
+        b"\xc0"
+        + (packet.replace(b"\xdb", b"\xdb\xdd").replace(b"\xc0", b"\xdb\xdc"))
+        + b"\xc0"
+    )
+
+
+# Second byte of a SLIP escape sequence (after 0xdb) -> decoded byte
+SLIP_UNESCAPE = {0xDC: b"\xc0", 0xDD: b"\xdb"}
+
+
 def slip_reader(port, trace_function):
     """Generator to read SLIP packets from a serial port.
     Yields one full SLIP packet at a time, raises exception on timeout or invalid data.
@@ -1564,6 +1903,42 @@ def slip_reader(port, trace_function):
             msg = f"Guru Meditation Error detected{cause}"
             raise FatalError(msg)
 
+    def invalid_data(read_bytes):
+        trace_function("Read invalid data: %s", HexFormatter(read_bytes))
+        remaining_data = port.read(port.inWaiting())
+        trace_function(
+            "Remaining data in serial buffer: %s",
+            HexFormatter(remaining_data),
+        )
+        detect_panic_handler(read_bytes + remaining_data)
+
+    def invalid_escape(read_bytes, b):
+        invalid_data(read_bytes)
+        raise FatalError("Invalid SLIP escape (0xdb, 0x%s)" % (hexify(b)))
+
+    def unescape_into(packet, data, read_bytes):
+        """Append SLIP-unescaped 'data' (no 0xC0 in it) to 'packet'.
+
+        Returns True if 'data' ends in the middle of an escape sequence.
+        """
+        if b"\xdb" not in data:
+            packet += data
+            return False
+        parts = data.split(b"\xdb")
+        packet += parts[0]
+        last = len(parts) - 1
+        for n, part in enumerate(parts[1:], 1):
+            if not part:
+                if n == last:
+                    return True  # escape continues in the next read
+                invalid_escape(read_bytes, b"\xdb")
+            escaped = SLIP_UNESCAPE.get(part[0])
+            if escaped is None:
+                invalid_escape(read_bytes, part[0:1])
+            packet += escaped
+            packet += part[1:]
+        return False
+
     partial_packet = None
     in_escape = False
     successful_slip = False
@@ -1584,47 +1959,43 @@ def slip_reader(port, trace_function):
             trace_function(msg)
             raise FatalError(msg)
         trace_function("Read %d bytes: %s", len(read_bytes), HexFormatter(read_bytes))
-        for b in read_bytes:
-            b = bytes([b])
+        # Work on whole runs of bytes between frame delimiters instead of
+        # looping over every byte in Python
+        pos = 0
+        length = len(read_bytes)
+        while pos < length:
             if partial_packet is None:  # waiting for packet header
-                if b == b"\xc0":
-                    partial_packet = b""
-                else:
-                    trace_function("Read invalid data: %s", HexFormatter(read_bytes))
-                    remaining_data = port.read(port.inWaiting())
-                    trace_function(
-                        "Remaining data in serial buffer: %s",
-                        HexFormatter(remaining_data),
-                    )
-                    detect_panic_handler(read_bytes + remaining_data)
+                if read_bytes[pos] != 0xC0:
+                    invalid_data(read_bytes)
                     raise FatalError(
                         "Invalid head of packet (0x%s): "
-                        "Possible serial noise or corruption." % hexify(b)
+                        "Possible serial noise or corruption."
+                        % hexify(read_bytes[pos : pos + 1])
                     )
-            elif in_escape:  # part-way through escape sequence
+                partial_packet = bytearray()
+                pos += 1
+                continue
+            if in_escape:  # part-way through escape sequence
                 in_escape = False
-                if b == b"\xdc":
-                    partial_packet += b"\xc0"
-                elif b == b"\xdd":
-                    partial_packet += b"\xdb"
-                else:
-                    trace_function("Read invalid data: %s", HexFormatter(read_bytes))
-                    remaining_data = port.read(port.inWaiting())
-                    trace_function(
-                        "Remaining data in serial buffer: %s",
-                        HexFormatter(remaining_data),
-                    )
-                    detect_panic_handler(read_bytes + remaining_data)
-                    raise FatalError("Invalid SLIP escape (0xdb, 0x%s)" % (hexify(b)))
-            elif b == b"\xdb":  # start of escape sequence
-                in_escape = True
-            elif b == b"\xc0":  # end of packet
-                trace_function("Received full packet: %s", HexFormatter(partial_packet))
-                yield partial_packet
-                partial_packet = None
-                successful_slip = True
-            else:  # normal byte in packet
-                partial_packet += b
+                escaped = SLIP_UNESCAPE.get(read_bytes[pos])
+                if escaped is None:
+                    invalid_escape(read_bytes, read_bytes[pos : pos + 1])
+                partial_packet += escaped
+                pos += 1
+                continue
+            end = read_bytes.find(b"\xc0", pos)
+            run = read_bytes[pos:] if end < 0 else read_bytes[pos:end]
+            in_escape = unescape_into(partial_packet, run, read_bytes)
+            if end < 0:
+                break
+            if in_escape:  # 0xdb followed by end of packet
+                invalid_escape(read_bytes, b"\xc0")
+            pos = end + 1
+            packet = bytes(partial_packet)
+            trace_function("Received full packet: %s", HexFormatter(packet))
+            yield packet
+            partial_packet = None
+            successful_slip = True
 
 
 class HexFormatter(object):
@@ -0,0 +1,350 @@
+# SPDX-FileCopyrightText: 2014-2022 Fredrik Ahlberg, Angus Gratton,
+# Espressif Systems (Shanghai) CO LTD, other contributors as noted.
+#
+# SPDX-License-Identifier: GPL-2.0-or-later
+
+import argparse
+import io
+import threading
+import time
+
+from .adapters import adapter_key, get_adapter_profiles
+from .cmds import (
+    detect_chip,
+    detect_flash_size,
+    erase_flash,
+    erase_region,
+    negotiate_baud,
+    verify_flash,
+    write_flash,
+    write_flash_stream,
+)
+from .loader import DEFAULT_CONNECT_ATTEMPTS, ESPLoader
+from .reset import HardReset
+from .targets import CHIP_DEFS
+from .util import (
+    FatalError,
+    NotImplementedInROMError,
+    flash_size_bytes,
+    strip_chip_name,
+)
+
+
+class FlashSession(object):
+    """Programmatic esptool session over a single open serial port.
+
+    The chip is detected, the flasher stub is uploaded and the baud rate is
+    negotiated once, on the first operation that needs the bootloader. Later
+    operations reuse the same connection until the chip is reset into the
+    application (hard_reset() or read_serial_monitor()), after which the next
+    bootloader operation reconnects over the same, still open, port.
+
+    baud is the rate used after connecting, or "auto" to use the highest one
+    the adapter handles reliably, see connect().
+
+    No global state (sys.argv, module variables) is touched, so sessions on
+    different ports can be used from different threads. Operations on one
+    session are serialized by its lock.
+    """
+
+    def __init__(
+        self,
+        port,
+        baud=ESPLoader.ESP_ROM_BAUD,
+        chip="auto",
+        before="default_reset",
+        connect_attempts=DEFAULT_CONNECT_ATTEMPTS,
+        no_stub=False,
+        trace=False,
+    ):
+        self.port = port
+        self.baud = baud
+        self.chip = strip_chip_name(chip)
+        self.before = before
+        self.connect_attempts = connect_attempts
+        self.no_stub = no_stub
+        self.trace = trace
+        self.esp = None  # loader instance, None while the application runs
+        self.lock = threading.RLock()
+        self._serial = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close(reset=exc_type is None)
+
+    def _open_serial(self):
+        if self._serial is None:
+            # Let ESPLoader open the port, it knows how to explain the failures
+            loader = ESPLoader(
+                self.port, self._initial_baud(), trace_enabled=self.trace
+            )
+            self._serial = loader._port
+        return self._serial
+
+    def _initial_baud(self):
+        if self.baud == "auto":
+            return ESPLoader.ESP_ROM_BAUD
+        return min(ESPLoader.ESP_ROM_BAUD, self.baud)
+
+    def _start_loader(self):
+        """Connect to the bootloader and upload the stub"""
+        serial_port = self._open_serial()
+        initial_baud = self._initial_baud()
+        if self.chip == "auto":
+            esp = detect_chip(
+                serial_port,
+                initial_baud,
+                self.before,
+                self.trace,
+                self.connect_attempts,
+            )
+        else:
+            esp = CHIP_DEFS[self.chip](serial_port, initial_baud, self.trace)
+            esp.connect(self.before, self.connect_attempts)
+
+        if not self.no_stub and not esp.secure_download_mode:
+            if not esp.IS_STUB and esp.stub_is_disabled:
+                print("WARNING: Stub loader has been disabled for compatibility")
+            else:
+                esp = esp.run_stub()
+        return esp
+
+    def _change_baud(self, esp, baud):
+        try:
+            esp.change_baud(baud)
+        except NotImplementedInROMError:
+            print(
+                "WARNING: ROM doesn't support changing baud rate. "
+                "Keeping initial baud rate %d" % self._initial_baud()
+            )
+
+    def connect(self):
+        """Return the loader, connecting and uploading the stub if needed
+
+        With baud="auto" the highest stable baud rate is negotiated (see
+        cmds.negotiate_baud()). If the link is lost while doing so, the chip
+        is reset and the session continues at the last rate that worked.
+        """
+        with self.lock:
+            if self.esp is not None:
+                return self.esp
+            esp = self._start_loader()
+
+            if self.baud == "auto":
+                try:
+                    negotiate_baud(esp)
+                except FatalError as e:
+                    print("WARNING: %s" % e)
+                    esp = self._start_loader()
+                    profile = get_adapter_profiles().get(adapter_key(self.port))
+                    baud = profile.get("baud", self._initial_baud())
+                    if baud > self._initial_baud():
+                        self._change_baud(esp, baud)
+            elif self.baud > self._initial_baud():
+                self._change_baud(esp, self.baud)
+
+            if not esp.IS_STUB:
+                # ROM loader doesn't enable flash unless we explicitly do it
+                esp.flash_spi_attach(0)
+
+            flash_size = detect_flash_size(esp)
+            if flash_size is not None:  # Secure download mode
+                esp.flash_set_parameters(flash_size_bytes(flash_size))
+            self.esp = esp
+            return esp
+
+    def _flash_args(self, esp, **kwargs):
+        args = argparse.Namespace(
+            chip=strip_chip_name(esp.CHIP_NAME),
+            flash_mode="keep",
+            flash_freq="keep",
+            flash_size="keep",
+            force=False,
+        )
+        for key, value in kwargs.items():
+            setattr(args, key, value)
+        return args
+
+    @staticmethod
+    def _open_files(addr_data):
+        """Accept (address, path or bytes) pairs, return (address, file) pairs"""
+        files = []
+        for address, data in sorted(addr_data, key=lambda x: x[0]):
+            if isinstance(data, (bytes, bytearray, memoryview)):
+                argfile = io.BytesIO(bytes(data))
+                argfile.name = "<data at 0x%x>" % address
+            else:
+                argfile = open(data, "rb")
+            files.append((address, argfile))
+        return files
+
+    def write(
+        self,
+        addr_data,
+        compress=True,
+        flash_mode="keep",
+        flash_freq="keep",
+        flash_size="keep",
+        erase_all=False,
+        force=False,
+        progress_callback=None,
+        compress_level="auto",
+        diff=False,
+        skip_identical=False,
+        rewrite=False,
+    ):
+        """Write (address, path or bytes) pairs to flash, see cmds.write_flash()
+
+        progress_callback receives rate-limited util.ProgressEvent objects,
+        by default progress is printed to the console. compress_level is a
+        zlib level or "auto", which picks the fastest for the measured link.
+        With diff, only the flash sectors which differ are written. With
+        skip_identical, files which the flash already holds are left out.
+        With rewrite, sectors which don't verify are written again once.
+        """
+        with self.lock:
+            esp = self.connect()
+            if flash_size not in ("keep", "detect"):
+                esp.flash_set_parameters(flash_size_bytes(flash_size))
+            files = self._open_files(addr_data)
+            try:
+                write_flash(
+                    esp,
+                    self._flash_args(
+                        esp,
+                        addr_filename=files,
+                        compress=compress if esp.IS_STUB else False,
+                        no_compress=not compress,
+                        compress_level=compress_level,
+                        diff=diff,
+                        skip_identical=skip_identical,
+                        rewrite=rewrite,
+                        no_stub=not esp.IS_STUB,
+                        flash_mode=flash_mode,
+                        flash_freq=flash_freq,
+                        flash_size=flash_size,
+                        erase_all=erase_all,
+                        force=force,
+                        encrypt=False,
+                        encrypt_files=None,
+                        ignore_flash_encryption_efuse_setting=False,
+                        verify=False,
+                        no_progress=False,
+                        progress_callback=progress_callback,
+                    ),
+                )
+            finally:
+                for _, argfile in files:
+                    argfile.close()
+
+    def write_stream(
+        self, address, size, chunks, compress_level=9, progress_callback=None
+    ):
+        """Write data while it is still arriving, see cmds.write_flash_stream()"""
+        with self.lock:
+            esp = self.connect()
+            calcmd5 = write_flash_stream(
+                esp, address, size, chunks, compress_level, progress_callback
+            )
+            print("\nLeaving...")
+            esp.flash_begin(0, 0)
+            esp.flash_defl_finish(False)
+            return calcmd5
+
+    def verify(self, addr_data, diff=False, rewrite=False):
+        """Compare flash against (address, path or bytes) pairs.
+
+        With rewrite, the flash sectors which differ are written again.
+        Raises FatalError if any of them still doesn't match.
+        """
+        with self.lock:
+            esp = self.connect()
+            files = self._open_files(addr_data)
+            try:
+                verify_flash(
+                    esp,
+                    self._flash_args(
+                        esp,
+                        addr_filename=files,
+                        diff="yes" if diff else "no",
+                        rewrite=rewrite,
+                    ),
+                )
+            finally:
+                for _, argfile in files:
+                    argfile.close()
+
+    def read(self, address, size, progress_fn=None):
+        """Read 'size' bytes of flash starting at 'address'"""
+        with self.lock:
+            return self.connect().read_flash(address, size, progress_fn)
+
+    def erase(self, address=None, size=None, force=False):
+        """Erase the whole flash, or a region if address and size are given"""
+        with self.lock:
+            esp = self.connect()
+            if address is None:
+                erase_flash(esp, self._flash_args(esp, force=force))
+            else:
+                erase_region(
+                    esp,
+                    self._flash_args(esp, address=address, size=size, force=force),
+                )
+
+    def hard_reset(self):
+        """Reset the chip into the application, dropping the loader connection"""
+        with self.lock:
+            if self.esp is not None:
+                self.esp.hard_reset()
+                self.esp = None
+            else:
+                serial_port = self._open_serial()
+                serial_port.dtr = False  # IO0=HIGH, boot the application
+                HardReset(serial_port)()
+
+    def read_serial_monitor(self, keyword=None, timeout=5, baud=115200, reset=True):
+        """Read the application's serial output.
+
+        If 'keyword' is given, return the first line containing it (or None
+        after 'timeout' seconds). Otherwise return all lines read in 'timeout'
+        seconds. The chip is reset into the application first unless 'reset'
+        is False.
+        """
+        with self.lock:
+            serial_port = self._open_serial()
+            serial_port.reset_input_buffer()
+            if reset:
+                self.hard_reset()
+            serial_port.baudrate = baud
+            saved_timeout = serial_port.timeout
+            serial_port.timeout = min(timeout, 0.5)
+            lines = []
+            try:
+                end = time.time() + timeout
+                while time.time() < end:
+                    line = serial_port.readline().decode("utf-8", "replace").strip()
+                    if not line:
+                        continue
+                    if keyword is None:
+                        lines.append(line)
+                    elif keyword in line:
+                        return line
+            finally:
+                serial_port.timeout = saved_timeout
+            return lines if keyword is None else None
+
+    def close(self, reset=True):
+        """Close the port, resetting into the application if still connected"""
+        with self.lock:
+            try:
+                if reset and self.esp is not None:
+                    self.esp.hard_reset()
+            except (FatalError, OSError) as e:
+                print("WARNING: Could not reset the chip: %s" % e)
+            finally:
+                self.esp = None
+                if self._serial is not None:
+                    self._serial.close()
+                    self._serial = None
@@ -141,14 +141,11 @@ class ESP32ROM(ESPLoader):
             # When ESP32 has not generated AES/encryption key in BLOCK1,
             # the contents will be readable and 0.
             # If the flash encryption is enabled it is expected to have a valid
-            # non-zero key. We break out on first occurrence of non-zero value
-            key_word = [0] * 7
-            for i in range(len(key_word)):
-                key_word[i] = self.read_efuse(14 + i)
-                # key is non-zero so break & return
-                if key_word[i] != 0:
-                    return True
-            return False
+            # non-zero key.
+            key_words = self.read_regs(
+                self.EFUSE_RD_REG_BASE + (4 * n) for n in range(14, 21)
+            )
+            return any(key_words)
 
     def get_flash_crypt_config(self):
         """For flash encryption related commands we need to make sure
@@ -317,6 +314,13 @@ class ESP32ROM(ESPLoader):
         """Read the nth word of the ESP3x EFUSE region."""
         return self.read_reg(self.EFUSE_RD_REG_BASE + (4 * n))
 
+    def get_identification_regs(self):
+        # eFuse BLOCK0 words 0-6, the chip revision and the UART divider
+        return [self.EFUSE_RD_REG_BASE + (4 * n) for n in range(7)] + [
+            self.APB_CTL_DATE_ADDR,
+            self.UART_CLKDIV_REG,
+        ]
+
     def chip_id(self):
         raise NotSupportedError(self, "Function chip_id")
 
@@ -324,7 +328,9 @@ class ESP32ROM(ESPLoader):
         """Read MAC from EFUSE region"""
         if mac_type != "BASE_MAC":
             return None
-        words = [self.read_efuse(2), self.read_efuse(1)]
+        words = self.read_regs(
+            [self.EFUSE_RD_REG_BASE + (4 * 2), self.EFUSE_RD_REG_BASE + (4 * 1)]
+        )
         bitstring = struct.pack(">II", *words)
         bitstring = bitstring[2:8]  # trim the 2 byte CRC
         return tuple(bitstring)
@@ -99,6 +99,16 @@ class ESP32C2ROM(ESP32C3ROM):
         # The crystal detection algorithm of ESP32/ESP8266 works for ESP32-C2 as well.
         return ESPLoader.get_crystal_freq(self)
 
+    def get_identification_regs(self):
+        # Security flags in BLOCK0, MAC in BLOCK2, versions in BLOCK1
+        return [
+            self.EFUSE_RD_REG_BASE,
+            self.EFUSE_BLOCK2_ADDR,
+            self.EFUSE_BLOCK1_ADDR,
+            self.EFUSE_BLOCK1_ADDR + 4,
+            self.UART_CLKDIV_REG,
+        ]
+
     def change_baud(self, baud):
         rom_with_26M_XTAL = not self.IS_STUB and self.get_crystal_freq() == 26
         if rom_with_26M_XTAL:
@@ -146,14 +156,12 @@ class ESP32C2ROM(ESP32C3ROM):
             # When chip has not generated AES/encryption key in BLOCK3,
             # the contents will be readable and 0.
             # If the flash encryption is enabled it is expected to have a valid
-            # non-zero key. We break out on first occurrence of non-zero value
-            key_word = [0] * 7 if key_len_256 else [0] * 3
-            for i in range(len(key_word)):
-                key_word[i] = self.read_reg(self.EFUSE_BLOCK_KEY0_REG + i * 4)
-                # key is non-zero so break & return
-                if key_word[i] != 0:
-                    return True
-            return False
+            # non-zero key.
+            num_words = 7 if key_len_256 else 3
+            key_words = self.read_regs(
+                self.EFUSE_BLOCK_KEY0_REG + i * 4 for i in range(num_words)
+            )
+            return any(key_words)
 
     def check_spi_connection(self, spi_connection):
         if not set(spi_connection).issubset(set(range(0, 21))):
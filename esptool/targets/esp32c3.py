@@ -160,12 +160,18 @@ class ESP32C3ROM(ESP32ROM):
             "VDD_SDIO overrides are not supported for ESP32-C3"
         )
 
+    def get_identification_regs(self):
+        # Security flags in BLOCK0, MAC, versions and package in BLOCK1
+        return [self.EFUSE_RD_REG_BASE + (4 * n) for n in range(3)] + [
+            self.EFUSE_BLOCK1_ADDR + (4 * n) for n in (0, 1, 3, 5)
+        ]
+
     def read_mac(self, mac_type="BASE_MAC"):
         """Read MAC from EFUSE region"""
         if mac_type != "BASE_MAC":
             return None
-        mac0 = self.read_reg(self.MAC_EFUSE_REG)
-        mac1 = self.read_reg(self.MAC_EFUSE_REG + 4)  # only bottom 16 bits are MAC
+        # only bottom 16 bits of mac1 are MAC
+        mac0, mac1 = self.read_regs([self.MAC_EFUSE_REG, self.MAC_EFUSE_REG + 4])
         bitstring = struct.pack(">II", mac1, mac0)[2:]
         return tuple(bitstring)
 
@@ -136,8 +136,8 @@ class ESP32C6ROM(ESP32C3ROM):
 
     def read_mac(self, mac_type="BASE_MAC"):
         """Read MAC from EFUSE region"""
-        mac0 = self.read_reg(self.MAC_EFUSE_REG)
-        mac1 = self.read_reg(self.MAC_EFUSE_REG + 4)  # only bottom 16 bits are MAC
+        # only bottom 16 bits of mac1 are MAC
+        mac0, mac1 = self.read_regs([self.MAC_EFUSE_REG, self.MAC_EFUSE_REG + 4])
         base_mac = struct.pack(">II", mac1, mac0)[2:]
         ext_mac = struct.pack(">H", (mac1 >> 16) & 0xFFFF)
         eui64 = base_mac[0:3] + ext_mac + base_mac[3:6]
@@ -73,8 +73,8 @@ class ESP32C61ROM(ESP32C6ROM):
 
     def read_mac(self, mac_type="BASE_MAC"):
         """Read MAC from EFUSE region"""
-        mac0 = self.read_reg(self.MAC_EFUSE_REG)
-        mac1 = self.read_reg(self.MAC_EFUSE_REG + 4)  # only bottom 16 bits are MAC
+        # only bottom 16 bits of mac1 are MAC
+        mac0, mac1 = self.read_regs([self.MAC_EFUSE_REG, self.MAC_EFUSE_REG + 4])
         base_mac = struct.pack(">II", mac1, mac0)[2:]
         # BASE MAC: 60:55:f9:f7:2c:a2
         macs = {
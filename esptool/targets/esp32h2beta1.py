@@ -112,8 +112,8 @@ class ESP32H2BETA1ROM(ESP32C3ROM):
         """Read MAC from EFUSE region"""
         if mac_type != "BASE_MAC":
             return None
-        mac0 = self.read_reg(self.MAC_EFUSE_REG)
-        mac1 = self.read_reg(self.MAC_EFUSE_REG + 4)  # only bottom 16 bits are MAC
+        # only bottom 16 bits of mac1 are MAC
+        mac0, mac1 = self.read_regs([self.MAC_EFUSE_REG, self.MAC_EFUSE_REG + 4])
         bitstring = struct.pack(">II", mac1, mac0)[2:]
         return tuple(bitstring)
 
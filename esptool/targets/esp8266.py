@@ -64,11 +64,11 @@ class ESP8266ROM(ESPLoader):
 
     def get_efuses(self):
         # Return the 128 bits of ESP8266 efuse as a single Python integer
-        result = self.read_reg(0x3FF0005C) << 96
-        result |= self.read_reg(0x3FF00058) << 64
-        result |= self.read_reg(0x3FF00054) << 32
-        result |= self.read_reg(0x3FF00050)
-        return result
+        words = self.read_regs([0x3FF00050, 0x3FF00054, 0x3FF00058, 0x3FF0005C])
+        return sum(word << (32 * i) for i, word in enumerate(words))
+
+    def get_identification_regs(self):
+        return [0x3FF00050, 0x3FF00054, 0x3FF00058, 0x3FF0005C, self.UART_CLKDIV_REG]
 
     def _get_flash_size(self, efuses):
         # rX_Y = EFUSE_DATA_OUTX[Y]
@@ -129,17 +129,16 @@ class ESP8266ROM(ESPLoader):
         """
         Read Chip ID from efuse - the equivalent of the SDK system_get_chip_id() func
         """
-        id0 = self.read_reg(self.ESP_OTP_MAC0)
-        id1 = self.read_reg(self.ESP_OTP_MAC1)
+        id0, id1 = self.read_regs([self.ESP_OTP_MAC0, self.ESP_OTP_MAC1])
         return (id0 >> 24) | ((id1 & 0xFFFFFF) << 8)
 
     def read_mac(self, mac_type="BASE_MAC"):
         """Read MAC from OTP ROM"""
         if mac_type != "BASE_MAC":
             return None
-        mac0 = self.read_reg(self.ESP_OTP_MAC0)
-        mac1 = self.read_reg(self.ESP_OTP_MAC1)
-        mac3 = self.read_reg(self.ESP_OTP_MAC3)
+        mac0, mac1, mac3 = self.read_regs(
+            [self.ESP_OTP_MAC0, self.ESP_OTP_MAC1, self.ESP_OTP_MAC3]
+        )
         if mac3 != 0:
             oui = ((mac3 >> 16) & 0xFF, (mac3 >> 8) & 0xFF, mac3 & 0xFF)
         elif ((mac1 >> 16) & 0xFF) == 0:
@@ -7,6 +7,14 @@ import os
 import re
 import struct
 import sys
+import time
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+
+# Uncompressed bytes per independently compressed chunk in parallel_compress()
+DEFLATE_CHUNK_SIZE = 128 * 1024
+# Deflate window: each chunk is primed with this much of the preceding data
+DEFLATE_WINDOW_SIZE = 32 * 1024
 
 
 def byte(bitstr, index):
@@ -57,6 +65,57 @@ def pad_to(data, alignment, pad_character=b"\xFF"):
     return data
 
 
+def _deflate_chunk(data, start, end, level):
+    """Raw deflate data[start:end], using the preceding window as dictionary.
+
+    All chunks but the last end in a full flush, so the output is byte aligned
+    and the chunks can be concatenated into one deflate stream.
+    """
+    if start > 0:
+        window = data[max(0, start - DEFLATE_WINDOW_SIZE) : start]
+        compressor = zlib.compressobj(
+            level, zlib.DEFLATED, -zlib.MAX_WBITS, zdict=window
+        )
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -zlib.MAX_WBITS)
+    last = end >= len(data)
+    return compressor.compress(data[start:end]) + compressor.flush(
+        zlib.Z_FINISH if last else zlib.Z_FULL_FLUSH
+    )
+
+
+def parallel_compress(data, level=9, workers=None, chunk_size=DEFLATE_CHUNK_SIZE):
+    """zlib-compress data on several threads (pigz style).
+
+    The data is cut into chunk_size pieces, each raw-deflated by a worker
+    with the preceding 32 KB as preset dictionary, and the pieces are joined
+    into a single zlib stream that any inflater (including the flasher stub)
+    accepts. The output only depends on level and chunk_size, not on the
+    number of workers. zlib releases the GIL while compressing, so threads
+    run in parallel. With one worker or a single chunk this is zlib.compress().
+    """
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers <= 1 or len(data) <= chunk_size:
+        return zlib.compress(data, level)
+
+    data = memoryview(data)
+    bounds = [
+        (start, min(start + chunk_size, len(data)))
+        for start in range(0, len(data), chunk_size)
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks = list(
+            executor.map(
+                lambda bound: _deflate_chunk(data, bound[0], bound[1], level), bounds
+            )
+        )
+    header = zlib.compress(b"", level)[:2]  # CMF/FLG for this level
+    return b"".join(
+        [header] + chunks + [struct.pack(">I", zlib.adler32(data) & 0xFFFFFFFF)]
+    )
+
+
 def print_overwrite(message, last_line=False):
     """Print a message, overwriting the currently printed line.
 
@@ -74,6 +133,123 @@ def print_overwrite(message, last_line=False):
         print(message)
 
 
+# Minimum time between two "write" progress callbacks, in seconds
+DEFAULT_PROGRESS_INTERVAL = 0.1
+
+
+class ProgressEvent(object):
+    """Progress of a flash write, as passed to progress callbacks.
+
+    phase is "write" while blocks are being sent and "done" once the last block
+    has been written to flash. address is the start address of the image,
+    seq the sequence number of the last block sent (of 'blocks' in total),
+    bytes_sent the bytes sent over the wire (compressed, if compression is used)
+    and bytes_written the uncompressed bytes written so far (of total_bytes).
+    When write_flash --diff only writes the changed regions of an image,
+    total_bytes is their size and address is shifted so that address +
+    bytes_written is still the flash address being written.
+    A "rewrite" event precedes rewriting the sectors of an image which didn't
+    verify (write_flash --rewrite); total_bytes is their size and detail holds
+    their [address, length] "regions".
+    A "skipped" event, with bytes_written == total_bytes, replaces the others
+    for an image which write_flash --skip-identical found already in flash.
+    A "compress" event precedes the writing of an image whose compression
+    level was chosen automatically; its detail dict holds the level and the
+    reason for choosing it.
+    """
+
+    __slots__ = (
+        "phase",
+        "address",
+        "seq",
+        "blocks",
+        "bytes_sent",
+        "bytes_written",
+        "total_bytes",
+        "elapsed",
+        "detail",
+    )
+
+    def __init__(
+        self,
+        phase,
+        address,
+        seq,
+        blocks,
+        bytes_sent,
+        bytes_written,
+        total_bytes,
+        elapsed,
+        detail=None,
+    ):
+        self.phase = phase
+        self.address = address
+        self.seq = seq
+        self.blocks = blocks
+        self.bytes_sent = bytes_sent
+        self.bytes_written = bytes_written
+        self.total_bytes = total_bytes
+        self.elapsed = elapsed
+        self.detail = detail
+
+    @property
+    def percent(self):
+        if not self.total_bytes:
+            return 100
+        return min(100, 100 * self.bytes_written // self.total_bytes)
+
+    @property
+    def kbps(self):
+        """Effective (uncompressed) write speed in kbit/s"""
+        if self.elapsed <= 0:
+            return 0.0
+        return self.bytes_written / self.elapsed * 8 / 1000
+
+    @property
+    def eta(self):
+        """Estimated seconds left, None until the speed is known"""
+        if self.bytes_written <= 0 or self.elapsed <= 0:
+            return None
+        remaining = max(0, self.total_bytes - self.bytes_written)
+        return remaining * self.elapsed / self.bytes_written
+
+    def to_dict(self):
+        data = {name: getattr(self, name) for name in self.__slots__}
+        data.update(percent=self.percent, kbps=self.kbps, eta=self.eta)
+        return data
+
+
+class ProgressReporter(object):
+    """Rate-limit a progress callback.
+
+    "write" events are forwarded at most once every 'interval' seconds,
+    any other phase is always forwarded.
+    """
+
+    def __init__(self, callback, interval=DEFAULT_PROGRESS_INTERVAL):
+        self.callback = callback
+        self.interval = interval
+        self._last = None
+
+    def __call__(self, event):
+        if event.phase == "write":
+            now = time.time()
+            if self._last is not None and now - self._last < self.interval:
+                return
+            self._last = now
+        self.callback(event)
+
+
+def print_progress(event):
+    """Default progress renderer for the command line"""
+    if event.phase == "write":
+        print_overwrite(
+            "Writing at 0x%08x... (%d %%)"
+            % (event.address + event.bytes_written, event.percent)
+        )
+        sys.stdout.flush()
+
+
 def expand_chip_name(chip_name):
     """Change chip name to official form, e.g. `esp32s3beta2` -> `ESP32-S3(beta2)`"""
     # Put "-" after "esp32"
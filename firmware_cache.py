@@ -0,0 +1,175 @@
+import base64
+import hashlib
+import json
+import os
+import threading
+import time
+import uuid
+
+# Tamaño máximo por defecto de la caché de firmware (en MB)
+DEFAULT_MAX_MB = 256
+
+
+def get_cache_dir():
+    """Directorio persistente de la caché (el de PyInstaller se borra al cerrar)."""
+    home_dir = os.path.expanduser("~")
+    if os.name == "nt":
+        return os.path.join(home_dir, "AppData", "Local", "wavesbyte-programmer", "firmware")
+    return os.path.join(home_dir, ".cache", "wavesbyte-programmer", "firmware")
+
+
+def md5_file(path):
+    digest = hashlib.md5()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest
+
+
+class FirmwareCache:
+    """
+    Caché en disco de binarios descargados desde GCS, direccionada por la ruta
+    del objeto y su generación. Cada entrada guarda el MD5 del contenido, que se
+    verifica al leer. Cuando se supera el tamaño máximo se eliminan las
+    entradas usadas hace más tiempo (LRU).
+    """
+
+    def __init__(self, cache_dir=None, max_bytes=None):
+        self.cache_dir = cache_dir or get_cache_dir()
+        if max_bytes is None:
+            max_bytes = int(os.getenv("FIRMWARE_CACHE_MAX_MB", DEFAULT_MAX_MB)) * 1024 * 1024
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0, "corrupt": 0}
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._index = self._load_index()
+        self._remove_stale_temps()
+
+    @staticmethod
+    def make_key(object_path, generation):
+        return hashlib.sha256(f"{object_path}#{generation}".encode("utf-8")).hexdigest()
+
+    def _entry_path(self, key):
+        return os.path.join(self.cache_dir, f"{key}.bin")
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        # Descartar entradas cuyo archivo ya no existe
+        return {k: v for k, v in index.items() if os.path.isfile(self._entry_path(k))}
+
+    def _remove_stale_temps(self):
+        # Descargas a medias de una ejecución anterior que terminó de golpe
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".part"):
+                self.discard_temp(os.path.join(self.cache_dir, name))
+
+    def _save_index(self):
+        tmp_path = f"{self.index_path}.{uuid.uuid4().hex}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self._index, f)
+        os.replace(tmp_path, self.index_path)
+
+    def _drop(self, key):
+        self._index.pop(key, None)
+        try:
+            os.remove(self._entry_path(key))
+        except FileNotFoundError:
+            pass
+
+    def lookup(self, object_path, generation):
+        """
+        Devuelve la ruta del binario en caché o None. Las entradas cuyo MD5 no
+        coincide se eliminan y cuentan como fallo.
+        """
+        if generation is None:
+            return None
+        key = self.make_key(object_path, generation)
+        with self._lock:
+            entry = self._index.get(key)
+            if entry is None:
+                self.stats["misses"] += 1
+                return None
+            path = self._entry_path(key)
+            try:
+                md5_hex = md5_file(path).hexdigest()
+            except OSError:
+                md5_hex = None
+            if md5_hex != entry["md5"]:
+                print(f"Entrada de caché corrupta para {object_path}, se descarta.")
+                self._drop(key)
+                self.stats["corrupt"] += 1
+                self.stats["misses"] += 1
+                self._save_index()
+                return None
+            entry["last_access"] = time.time()
+            self.stats["hits"] += 1
+            self._save_index()
+            return path
+
+    def new_temp_path(self):
+        """Ruta temporal dentro de la caché para descargar antes de guardar."""
+        return os.path.join(self.cache_dir, f"{uuid.uuid4().hex}.part")
+
+    @staticmethod
+    def discard_temp(path):
+        """Elimina una ruta temporal que no llegó a guardarse, si existe."""
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            print(f"Error eliminando el temporal {path}: {e}")
+
+    def store(self, object_path, generation, source_path, expected_md5_b64=None):
+        """
+        Mueve source_path a la caché y devuelve la ruta de la entrada.
+        expected_md5_b64 es el md5_hash de GCS (base64) para validar la descarga.
+        Si falla por otra causa, quien creó source_path debe eliminarlo con
+        discard_temp().
+        """
+        digest = md5_file(source_path)
+        if expected_md5_b64 is not None:
+            if base64.b64encode(digest.digest()).decode("ascii") != expected_md5_b64:
+                self.discard_temp(source_path)
+                raise ValueError(f"El MD5 de {object_path} no coincide con el de GCS.")
+
+        key = self.make_key(object_path, generation)
+        path = self._entry_path(key)
+        with self._lock:
+            os.replace(source_path, path)
+            self._index[key] = {
+                "object_path": object_path,
+                "generation": str(generation),
+                "md5": digest.hexdigest(),
+                "size": os.path.getsize(path),
+                "last_access": time.time(),
+            }
+            self._evict(keep=key)
+            self._save_index()
+        return path
+
+    def _evict(self, keep=None):
+        total = sum(entry["size"] for entry in self._index.values())
+        for key, entry in sorted(self._index.items(), key=lambda kv: kv[1]["last_access"]):
+            if total <= self.max_bytes:
+                break
+            if key == keep:
+                continue
+            total -= entry["size"]
+            self._drop(key)
+            self.stats["evictions"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(
+                self.stats,
+                entries=len(self._index),
+                size_bytes=sum(entry["size"] for entry in self._index.values()),
+                max_bytes=self.max_bytes,
+            )
+
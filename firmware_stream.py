@@ -0,0 +1,120 @@
+import os
+import queue
+import threading
+
+from esptool.util import flash_size_bytes
+
+# Tamaño de cada bloque leído desde GCS
+CHUNK_SIZE = 256 * 1024
+# Bloques que pueden esperar en la cola antes de frenar la descarga
+MAX_CHUNKS_EN_COLA = 8
+# Cada cuánto el consumidor comprueba que la descarga sigue viva
+INTERVALO_PRODUCTOR = 0.5
+
+_FIN = object()
+
+
+class ChunkPipe:
+    """
+    Cola acotada entre la descarga y la escritura en flash. Cuando está llena,
+    la descarga espera a que el flasheo consuma bloques (back-pressure).
+    Si se indica el hilo productor, el consumidor falla en lugar de esperar
+    para siempre cuando ese hilo termina sin cerrar la cola.
+    """
+
+    def __init__(self, maxsize=MAX_CHUNKS_EN_COLA):
+        self._queue = queue.Queue(maxsize=maxsize)
+        self._cancelled = threading.Event()
+        self.producer = None
+
+    def put(self, item):
+        """Encola un elemento. Devuelve False si el consumidor canceló."""
+        while not self._cancelled.is_set():
+            try:
+                self._queue.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def close(self, error=None):
+        """Marca el fin del flujo, o lo termina con un error."""
+        self.put(error if error is not None else _FIN)
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def __iter__(self):
+        while True:
+            try:
+                item = self._queue.get(timeout=INTERVALO_PRODUCTOR)
+            except queue.Empty:
+                # Lo último que encoló un productor ya terminado sigue en la cola
+                if (
+                    self.producer is not None
+                    and not self.producer.is_alive()
+                    and self._queue.empty()
+                ):
+                    raise RuntimeError("La descarga terminó sin completar el binario.")
+                continue
+            if item is _FIN:
+                return
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+
+
+def iter_file_chunks(path, chunk_size=CHUNK_SIZE):
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            yield chunk
+
+
+def start_blob_download(blob, pipe, cache=None, object_path=None):
+    """
+    Descarga el blob en un hilo aparte entregando cada bloque a la cola.
+    Si se pasa una caché, el binario completo se guarda en ella al terminar.
+    """
+
+    def run():
+        temp_path = cache.new_temp_path() if cache else None
+        temp_file = open(temp_path, "wb") if temp_path else None
+        try:
+            with blob.open("rb", chunk_size=CHUNK_SIZE) as reader:
+                for chunk in iter(lambda: reader.read(CHUNK_SIZE), b""):
+                    if temp_file:
+                        temp_file.write(chunk)
+                    if not pipe.put(chunk):
+                        return  # El flasheo se canceló
+            if temp_file:
+                temp_file.close()
+                # Se guarda antes de cerrar la cola: si el MD5 no coincide con
+                # el de GCS, el flasheo termina con ese error
+                cache.store(object_path, blob.generation, temp_path, blob.md5_hash)
+            pipe.close()
+        except Exception as e:
+            print(f"Error descargando binario desde GCS: {e}")
+            pipe.close(e)
+        finally:
+            if temp_file and not temp_file.closed:
+                temp_file.close()
+            if temp_path and os.path.isfile(temp_path):
+                os.remove(temp_path)
+
+    thread = threading.Thread(target=run, daemon=True)
+    pipe.producer = thread
+    thread.start()
+    return thread
+
+
+def flash_stream(session, address, size, chunks, flash_size="4MB", progress_callback=None):
+    """
+    Escribe en flash los bloques de 'chunks' a medida que llegan, usando la
+    sesión de esptool del puerto. La conexión y la subida del stub ocurren
+    mientras la descarga sigue llenando la cola.
+    """
+    with session.lock:
+        esp = session.connect()
+        esp.flash_set_parameters(flash_size_bytes(flash_size))
+        session.write_stream(address, size, chunks, progress_callback=progress_callback)
+        session.hard_reset()
@@ -0,0 +1,185 @@
+import os
+import threading
+import time
+import uuid
+
+# Estados del ciclo de vida de un trabajo de programación
+ESTADO_LISTO = "listo"
+ESTADO_COMPILANDO = "compilando"
+ESTADO_DESCARGANDO = "descargando"
+ESTADO_PROGRAMANDO = "programando"
+ESTADO_FINALIZADO = "finalizado"
+ESTADO_ERROR = "error"
+
+# Transiciones permitidas entre estados
+TRANSICIONES = {
+    ESTADO_LISTO: {ESTADO_COMPILANDO, ESTADO_ERROR},
+    ESTADO_COMPILANDO: {ESTADO_DESCARGANDO, ESTADO_PROGRAMANDO, ESTADO_ERROR},
+    ESTADO_DESCARGANDO: {ESTADO_PROGRAMANDO, ESTADO_ERROR},
+    ESTADO_PROGRAMANDO: {ESTADO_FINALIZADO, ESTADO_ERROR},
+    ESTADO_FINALIZADO: set(),
+    ESTADO_ERROR: set(),
+}
+
+ESTADOS_TERMINALES = {ESTADO_FINALIZADO, ESTADO_ERROR}
+
+# Cantidad de trabajos terminados que se conservan para consultar su estado
+MAX_TRABAJOS_TERMINADOS = 50
+
+
+class PuertoOcupadoError(Exception):
+    """Se lanza cuando ya hay un trabajo en curso en el puerto solicitado."""
+
+
+class ProgrammingJob:
+    """
+    Trabajo de programación de un taxímetro conectado a un puerto serie.
+    Cada trabajo tiene su propio estado, archivo de firmware, listener de
+    Firestore e historial de mensajes de estado.
+    """
+
+    def __init__(self, port, user, numero_serial, firmware_dir, job_id=None):
+        self.job_id = job_id or str(uuid.uuid4())
+        self.port = port
+        self.user = user
+        self.numero_serial = numero_serial
+        self.state = ESTADO_LISTO
+        self.status = "Listo"
+        # Cada mensaje de estado lleva un número de secuencia por trabajo para
+        # que el cliente detecte eventos perdidos y pida reenviarlos
+        self.seq = 0
+        self.history = []
+        self.listener = None
+        self.created_at = time.time()
+        self.finished_at = None
+        self.firmware_path = os.path.join(
+            firmware_dir, f"firmware_{self.job_id}.bin"
+        )
+        self._lock = threading.Lock()
+
+    def transition(self, new_state):
+        """
+        Cambia el estado del trabajo. Devuelve False si la transición no está
+        permitida (por ejemplo, un snapshot repetido de Firestore).
+        """
+        with self._lock:
+            if new_state not in TRANSICIONES[self.state]:
+                return False
+            self.state = new_state
+            if new_state in ESTADOS_TERMINALES:
+                self.finished_at = time.time()
+            return True
+
+    def set_status(self, status):
+        """Registra un mensaje de estado y devuelve el evento a emitir."""
+        with self._lock:
+            self.status = status
+            self.seq += 1
+            event = {
+                "job_id": self.job_id,
+                "port": self.port,
+                "seq": self.seq,
+                "state": self.state,
+                "status": status,
+                "timestamp": time.time(),
+            }
+            self.history.append(event)
+            return event
+
+    def events_since(self, seq):
+        """Eventos con número de secuencia mayor que 'seq', en orden."""
+        with self._lock:
+            return [event for event in self.history if event["seq"] > seq]
+
+    def is_active(self):
+        return self.state not in ESTADOS_TERMINALES
+
+    def cleanup(self):
+        """Cancela el listener de Firestore y elimina el firmware descargado."""
+        if self.listener is not None:
+            try:
+                self.listener.unsubscribe()
+            except Exception as e:
+                print(f"Error cancelando listener del trabajo {self.job_id}: {e}")
+            self.listener = None
+        if os.path.isfile(self.firmware_path):
+            os.remove(self.firmware_path)
+
+    def to_dict(self, include_history=False):
+        data = {
+            "job_id": self.job_id,
+            "port": self.port,
+            "numero_serial": self.numero_serial,
+            "state": self.state,
+            "status": self.status,
+            "seq": self.seq,
+        }
+        if include_history:
+            data["history"] = list(self.history)
+        return data
+
+
+class JobRegistry:
+    """
+    Registro de trabajos de programación indexado por id de trabajo y por
+    puerto. Permite un trabajo activo por puerto y varios puertos a la vez.
+    """
+
+    def __init__(self, firmware_dir):
+        self.firmware_dir = firmware_dir
+        self._jobs = {}
+        self._active_by_port = {}
+        self._lock = threading.Lock()
+
+    def create(self, port, user, numero_serial, job_id=None):
+        with self._lock:
+            active = self._jobs.get(self._active_by_port.get(port))
+            if active is not None and active.is_active():
+                raise PuertoOcupadoError(
+                    f"Ya hay un trabajo en curso en el puerto {port}."
+                )
+            job = ProgrammingJob(
+                port, user, numero_serial, self.firmware_dir, job_id=job_id
+            )
+            self._jobs[job.job_id] = job
+            self._active_by_port[port] = job.job_id
+            self._prune()
+            return job
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def get_by_port(self, port):
+        with self._lock:
+            job_id = self._active_by_port.get(port)
+            return self._jobs.get(job_id) if job_id else None
+
+    def latest(self):
+        with self._lock:
+            if not self._jobs:
+                return None
+            return max(self._jobs.values(), key=lambda job: job.created_at)
+
+    def active_jobs(self):
+        with self._lock:
+            return [job for job in self._jobs.values() if job.is_active()]
+
+    def all_jobs(self):
+        with self._lock:
+            return sorted(self._jobs.values(), key=lambda job: job.created_at)
+
+    def finish(self, job):
+        """Libera el puerto del trabajo y limpia sus recursos."""
+        job.cleanup()
+        with self._lock:
+            if self._active_by_port.get(job.port) == job.job_id:
+                del self._active_by_port[job.port]
+
+    def _prune(self):
+        terminados = sorted(
+            (job for job in self._jobs.values() if not job.is_active()),
+            key=lambda job: job.finished_at or job.created_at,
+        )
+        for job in terminados[: max(0, len(terminados) - MAX_TRABAJOS_TERMINADOS)]:
+            del self._jobs[job.job_id]
@@ -1,74 +1,131 @@
-import os
-import sys
-import json
 import base64
+import heapq
+import itertools
+import json
 from google.cloud import firestore
-from google.oauth2.service_account import Credentials
+from cloud_clients import get_firestore_client
+
+# Documentos por página del historial de certificados
+DEFAULT_PAGE_SIZE = 20
+MAX_PAGE_SIZE = 100
 
 def initialize_firestore_with_service_account():
     """
-    Inicializa Firestore utilizando credenciales decodificadas desde un archivo Base64.
-    Este método es compatible con PyInstaller.
+    Devuelve el cliente Firestore compartido. Las credenciales se leen de
+    cibtron.txt y el cliente se crea una sola vez (ver cloud_clients).
     """
     try:
-        # Asegúrate de que el archivo Base64 esté en el mismo directorio que el script
-        base_dir = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
-        base64_credentials_path = os.path.join(base_dir, "cibtron.txt")
+        return get_firestore_client()
+    except Exception as e:
+        print(f"Error inicializando: {e}")
+        return None
+
+def encode_cursor(doc_data):
+    """Cursor opaco que identifica el último documento entregado."""
+    raw = json.dumps([doc_data["subcollection_name"], doc_data["document_id"]])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii")
 
-        if not os.path.exists(base64_credentials_path):
-            raise FileNotFoundError(f"El archivo Base64 no se encontró en {base64_credentials_path}")
 
-        # Leer y decodificar las credenciales en Base64
-        with open(base64_credentials_path, "r") as f:
-            base64_credentials = f.read()
+def decode_cursor(cursor):
+    try:
+        subcollection_name, document_id = json.loads(
+            base64.urlsafe_b64decode(cursor.encode("ascii"))
+        )
+        return subcollection_name, document_id
+    except (ValueError, TypeError):
+        raise ValueError("Cursor de paginación inválido.")
 
-        decoded_credentials = json.loads(base64.b64decode(base64_credentials))
 
-        # Crear credenciales a partir de los datos decodificados
-        credentials = Credentials.from_service_account_info(decoded_credentials)
-        project = credentials.project_id
+def _sort_key(doc_data):
+    return (
+        doc_data["document_data"]["timestamp"],
+        doc_data["subcollection_name"],
+        doc_data["document_id"],
+    )
+
+
+def _iter_subcollection(subcollection, batch_size, start_timestamp=None):
+    """
+    Documentos de una subcolección del más reciente al más antiguo, leídos en
+    bloques de batch_size con el orden hecho por Firestore.
+    """
+    query = subcollection.order_by("timestamp", direction=firestore.Query.DESCENDING)
+    if start_timestamp is not None:
+        query = query.start_at({"timestamp": start_timestamp})
+    last_doc = None
+    while True:
+        page = query.start_after(last_doc) if last_doc else query
+        docs = list(page.limit(batch_size).stream())
+        for doc in docs:
+            yield {
+                "subcollection_name": subcollection.id,
+                "document_id": doc.id,
+                "document_data": doc.to_dict(),
+            }
+        if len(docs) < batch_size:
+            return
+        last_doc = docs[-1]
+
+
+def iter_documents_by_serial(serial_number, cursor=None, batch_size=DEFAULT_PAGE_SIZE):
+    """
+    Recorre los documentos de todas las subcolecciones de logs/{serial_number}
+    ordenados por 'timestamp' (el más reciente primero), combinando las
+    subcolecciones sin cargarlas completas en memoria. Si se indica un cursor,
+    empieza después del documento que identifica.
+    """
+    db = initialize_firestore_with_service_account()
+    if not db:
+        raise Exception("No se pudo inicializar Firestore.")
+
+    document_ref = db.document(f"logs/{serial_number}")
+    start_timestamp = None
+    cursor_key = None
+    if cursor:
+        subcollection_name, document_id = decode_cursor(cursor)
+        snapshot = document_ref.collection(subcollection_name).document(document_id).get()
+        if not snapshot.exists:
+            raise ValueError("El documento del cursor ya no existe.")
+        start_timestamp = snapshot.get("timestamp")
+        cursor_key = (start_timestamp, subcollection_name, document_id)
+
+    streams = [
+        _iter_subcollection(subcollection, batch_size, start_timestamp)
+        for subcollection in document_ref.collections()
+    ]
+    for doc_data in heapq.merge(*streams, key=_sort_key, reverse=True):
+        # start_at incluye los documentos con el mismo timestamp que el cursor
+        if cursor_key is not None and _sort_key(doc_data) >= cursor_key:
+            continue
+        yield doc_data
+
+
+def get_documents_page(serial_number, page_size=DEFAULT_PAGE_SIZE, cursor=None):
+    """
+    Devuelve (documentos, siguiente_cursor). siguiente_cursor es None cuando
+    no hay más documentos.
+    """
+    page_size = max(1, min(page_size, MAX_PAGE_SIZE))
+    documents = list(
+        itertools.islice(
+            iter_documents_by_serial(serial_number, cursor, batch_size=page_size + 1),
+            page_size + 1,
+        )
+    )
+    if len(documents) > page_size:
+        return documents[:page_size], encode_cursor(documents[page_size - 1])
+    return documents, None
 
-        # Inicializar cliente Firestore
-        db = firestore.Client(credentials=credentials, project=project)
-        return db
-    except Exception as e:
-        print(f"Error inicializando: {e}")
-        return None
 
 def get_all_documents_by_serial(serial_number):
     """
     Obtiene todos los documentos de todas las subcolecciones dinámicas bajo un documento principal identificado por su serial_number.
     Devuelve un array con todos los documentos ordenados por el campo 'timestamp'.
+    Para historiales largos conviene usar get_documents_page o iter_documents_by_serial.
     """
     try:
         print(f"Obteniendo todos los documentos para el número serial {serial_number}...")
-        db = initialize_firestore_with_service_account()
-        if not db:
-            raise Exception("No se pudo inicializar Firestore.")
-        
-        document_path = f"logs/{serial_number}"
-        document_ref = db.document(document_path)
-        subcollections = document_ref.collections()
-        all_documents = []
-
-        for subcollection in subcollections:
-            print(f"Procesando subcolección: {subcollection.id}")
-            docs = subcollection.stream()
-            for doc in docs:
-                doc_data = {
-                    "subcollection_name": subcollection.id,
-                    "document_id": doc.id,
-                    "document_data": doc.to_dict()
-                }
-                all_documents.append(doc_data)
-
-        # Ordenar los documentos por el campo 'timestamp'
-        sorted_documents = sorted(
-            all_documents,
-            key=lambda x: x["document_data"].get("timestamp"),
-            reverse=True  # Orden descendente, el más reciente primero
-        )
-        return sorted_documents
+        return list(iter_documents_by_serial(serial_number))
     except Exception as e:
         print(f"Error al obtener todos los documentos: {e}")
         return []
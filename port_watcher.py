@@ -0,0 +1,144 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import sys
+import threading
+import time
+
+import serial.tools.list_ports
+
+# VID:PID de los adaptadores USB-serie usados por los taxímetros
+# (CH340, CP210x y FTDI)
+IDS_CONOCIDOS = ["1A86:7523", "10C4:EA60", "0403:6001"]
+# Intervalo de escaneo cuando no hay notificaciones del sistema
+POLL_INTERVAL = 2.0
+# Con inotify igual se re-escanea cada tanto por si se pierde un evento
+SLOW_POLL_INTERVAL = 30.0
+# Espera tras un evento para que udev termine de crear el dispositivo
+DEBOUNCE = 0.3
+
+_IN_CREATE = 0x00000100
+_IN_DELETE = 0x00000200
+_IN_ATTRIB = 0x00000004
+_IN_NONBLOCK = 0o4000
+_IN_CLOEXEC = 0o2000000
+
+
+def scan_ports():
+    """Escanea los puertos serie y devuelve los de adaptadores conocidos."""
+    return sorted(
+        (
+            {"device": port.device, "description": port.description, "hwid": port.hwid}
+            for port in serial.tools.list_ports.comports()
+            if any(id_conocido in port.hwid for id_conocido in IDS_CONOCIDOS)
+        ),
+        key=lambda port: port["device"],
+    )
+
+
+class _DevNotifier:
+    """Avisa cuando se crean o eliminan nodos en /dev (inotify, solo Linux)."""
+
+    def __init__(self):
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        self.fd = libc.inotify_init1(_IN_NONBLOCK | _IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 falló")
+        mask = _IN_CREATE | _IN_DELETE | _IN_ATTRIB
+        if libc.inotify_add_watch(self.fd, b"/dev", mask) < 0:
+            errno = ctypes.get_errno()
+            os.close(self.fd)
+            raise OSError(errno, "inotify_add_watch falló")
+
+    def wait(self, timeout):
+        """Devuelve True si hubo cambios en /dev antes de 'timeout' segundos."""
+        readable, _, _ = select.select([self.fd], [], [], timeout)
+        if not readable:
+            return False
+        time.sleep(DEBOUNCE)
+        try:
+            while os.read(self.fd, 4096):
+                pass
+        except BlockingIOError:
+            pass
+        return True
+
+    def close(self):
+        os.close(self.fd)
+
+
+class PortWatcher:
+    """
+    Mantiene en memoria la lista de puertos de taxímetros conectados. Un hilo
+    la actualiza ante cada conexión o desconexión (inotify en Linux, escaneo
+    periódico en el resto) e incrementa la versión cuando cambia. Las rutas
+    leen la lista sin escanear los puertos.
+    """
+
+    def __init__(self, on_change=None, interval=POLL_INTERVAL):
+        self.on_change = on_change
+        self.interval = interval
+        self.version = 0
+        self._ports = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self._stop = threading.Event()
+
+    def snapshot(self):
+        """Devuelve (versión, puertos)."""
+        with self._lock:
+            return self.version, list(self._ports)
+
+    def get_ports(self):
+        return self.snapshot()[1]
+
+    def is_connected(self, device):
+        with self._lock:
+            return any(port["device"] == device for port in self._ports)
+
+    def refresh(self):
+        """Escanea los puertos; devuelve True si la lista cambió."""
+        try:
+            ports = scan_ports()
+        except Exception as e:
+            print(f"Error al listar puertos: {e}")
+            return False
+        with self._lock:
+            if ports == self._ports:
+                return False
+            self._ports = ports
+            self.version += 1
+            version = self.version
+        if self.on_change:
+            self.on_change(version, ports)
+        return True
+
+    def _make_waiter(self):
+        if sys.platform.startswith("linux"):
+            try:
+                notifier = _DevNotifier()
+                return notifier, lambda: notifier.wait(SLOW_POLL_INTERVAL)
+            except (OSError, AttributeError, TypeError) as e:
+                print(f"inotify no disponible, se escanearán los puertos: {e}")
+        return None, lambda: self._stop.wait(self.interval)
+
+    def _run(self):
+        notifier, wait = self._make_waiter()
+        try:
+            while not self._stop.is_set():
+                self.refresh()
+                wait()
+        finally:
+            if notifier:
+                notifier.close()
+
+    def start(self):
+        if self._thread is None:
+            self.refresh()
+            self._thread = threading.Thread(target=self._run, daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
@@ -15,6 +15,13 @@ a = Analysis(
         ('lector_firestore2.py', '.'),
         ('serial_reader.py', '.'),
         ('resetcibtron.py', '.'),
+        ('job_registry.py', '.'),
+        ('firmware_cache.py', '.'),
+        ('firmware_stream.py', '.'),
+        ('cloud_clients.py', '.'),
+        ('serial_lookup.py', '.'),
+        ('port_watcher.py', '.'),
+        ('worker_pool.py', '.'),
         ('leer_serial_memoria.ino.bin', '.'),
         ('leer_serial_memoria.ino.bootloader.bin', '.'),
         ('leer_serial_memoria.ino.partitions.bin', '.'),
@@ -18,33 +18,40 @@ except ImportError as e:
     sys.exit(1)
 
 
-def resetcibtron(port, firmware_path, baud_rate=115200):
+def resetcibtron(port, firmware_path, baud_rate="auto", session=None):
     """
     Programa un ESP32 utilizando esptool desde una carpeta local.
+    Si se pasa una sesión de esptool abierta en el puerto, se reutiliza;
+    si no, se abre una solo para esta programación. Con baud_rate="auto" se
+    usa la velocidad más alta estable del adaptador.
+    El bootloader y la tabla de particiones casi nunca cambian: los archivos
+    que ya están en la flash (mismo MD5) no se vuelven a escribir.
     """
-    # Construir argumentos como si fueran de línea de comandos
-    args = [
-        "--chip", "esp32",
-        "--port", port,
-        "--baud", str(baud_rate),
-        "write_flash", "-z",
-        "0x1000", firmware_path.replace(".ino.bin", ".ino.bootloader.bin"),
-        "0x8000", firmware_path.replace(".ino.bin", ".ino.partitions.bin"),
-        "0x10000", firmware_path,
+    archivos = [
+        (0x1000, firmware_path.replace(".ino.bin", ".ino.bootloader.bin")),
+        (0x8000, firmware_path.replace(".ino.bin", ".ino.partitions.bin")),
+        (0x10000, firmware_path),
     ]
 
-    # Ejecutar el comando de esptool
+    propia = session is None
+    if propia:
+        session = esptool.FlashSession(port, baud=baud_rate, chip="esp32")
     try:
-        esptool.main(args)
+        session.write(archivos, skip_identical=True)
+        session.hard_reset()
         print(f"ESP32 programado exitosamente en el puerto {port}.")
     except Exception as e:
         print(f"Error al programar el ESP32: {e}")
+        raise
+    finally:
+        if propia:
+            session.close()
 
 
 if __name__ == "__main__":
     # Valores predeterminados para pruebas
     port = "COM8"  # Cambia según tu configuración
     firmware_path = "leer_serial_memoria.ino.bin"  # Asegúrate de que este archivo exista
-    baud_rate = 115200
+    baud_rate = "auto"
 
     resetcibtron(port, firmware_path, baud_rate)
@@ -0,0 +1,141 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from google.cloud import firestore
+
+from cloud_clients import get_firestore_client
+
+# Consultas simultáneas a subcolecciones (una por usuario) de un serial
+MAX_WORKERS = 8
+# Seriales cuyo resultado se mantiene en memoria
+MAX_SERIALES_EN_CACHE = 64
+# Vigencia máxima de un resultado, en segundos: lo más viejo que puede ser lo
+# que se muestra de un log escrito por otra estación o un trabajo de Cloud Run
+# que no se lanzó desde esta aplicación. Menos de lo que dura un trabajo.
+CACHE_TTL = 30
+
+
+class _Entrada:
+    def __init__(self, result):
+        self.result = result
+        self.created_at = time.time()
+
+
+class SerialLookup:
+    """
+    Búsqueda del documento más reciente de un serial en logs/{serial}/{usuario}.
+    Las subcolecciones tienen el nombre del usuario, por lo que no se puede
+    usar una consulta de grupo de colecciones: se consulta cada subcolección
+    en paralelo con un pool acotado y se combinan los resultados por
+    'timestamp'. El resultado queda en caché hasta que vence CACHE_TTL o se
+    invalida: la aplicación lo hace cuando cambia el log de un trabajo del
+    serial. Así, un documento escrito desde otra estación puede tardar hasta
+    CACHE_TTL segundos en aparecer; los de trabajos propios aparecen en
+    seguida. No hay un listener por serial, así el costo no crece con la
+    cantidad de seriales consultados.
+    """
+
+    def __init__(
+        self,
+        client=None,
+        max_workers=MAX_WORKERS,
+        max_entries=MAX_SERIALES_EN_CACHE,
+        ttl=CACHE_TTL,
+    ):
+        self._client = client
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="serial-lookup"
+        )
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    @property
+    def client(self):
+        if self._client is None:
+            self._client = get_firestore_client()
+        return self._client
+
+    @staticmethod
+    def _latest_query(subcollection):
+        return subcollection.order_by(
+            "timestamp", direction=firestore.Query.DESCENDING
+        ).limit(1)
+
+    def _latest_in(self, subcollection):
+        for doc in self._latest_query(subcollection).stream():
+            return {
+                "subcollection_name": subcollection.id,
+                "document_id": doc.id,
+                "document_data": doc.to_dict(),
+            }
+        return None
+
+    def _cached(self, serial_number):
+        with self._lock:
+            entrada = self._cache.get(serial_number)
+            if entrada is None:
+                return False, None
+            if time.time() - entrada.created_at > self.ttl:
+                del self._cache[serial_number]
+                return False, None
+            self._cache.move_to_end(serial_number)
+            return True, entrada.result
+
+    def get_most_recent(self, serial_number):
+        """Devuelve el documento más reciente del serial con su subcolección, o None."""
+        found, result = self._cached(serial_number)
+        if found:
+            self.stats["hits"] += 1
+            return result
+        self.stats["misses"] += 1
+
+        subcollections = list(
+            self.client.document(f"logs/{serial_number}").collections()
+        )
+        most_recent_doc = None
+        for doc_data in self._executor.map(self._latest_in, subcollections):
+            if doc_data is None:
+                continue
+            if (
+                not most_recent_doc
+                or doc_data["document_data"]["timestamp"]
+                > most_recent_doc["document_data"]["timestamp"]
+            ):
+                most_recent_doc = doc_data
+
+        self._store(serial_number, most_recent_doc)
+        return most_recent_doc
+
+    def _store(self, serial_number, result):
+        with self._lock:
+            self._cache.pop(serial_number, None)
+            self._cache[serial_number] = _Entrada(result)
+            while len(self._cache) > self.max_entries:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, serial_number):
+        """Descarta el resultado en caché del serial."""
+        with self._lock:
+            if self._cache.pop(serial_number, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def get_stats(self):
+        with self._lock:
+            return dict(self.stats, entries=len(self._cache))
+
+
+_lookup = None
+_lookup_lock = threading.Lock()
+
+
+def get_serial_lookup():
+    global _lookup
+    with _lookup_lock:
+        if _lookup is None:
+            _lookup = SerialLookup()
+        return _lookup
@@ -3,6 +3,9 @@ const socket = io();
 let isProgramFinished = false;
 let isReloading = false;
 let lastStatus = null; // Para rastrear el ultimo estado.
+let currentJobId = null; // Trabajo en curso de esta estación.
+let lastSeq = 0; // Último evento de estado aplicado del trabajo en curso.
+let statusPollTimer = null; // Consulta de respaldo mientras no hay Socket.IO.
 
 async function initializeForm() {
   try {
@@ -64,10 +67,17 @@ function generateUUID() {
 socket.on("connect", () => {
   console.log("Conexión establecida con el servidor.");
   addLogMessage("Conexión establecida con el servidor.");
+  clearInterval(statusPollTimer);
+  statusPollTimer = null;
+  // Al reconectar, el servidor reenvía los eventos perdidos
+  subscribeToJob();
 });
 
 socket.on("disconnect", () => {
   console.log("Conexión perdida con el servidor.");
+  if (!statusPollTimer) {
+    statusPollTimer = setInterval(checkStatus, 1000);
+  }
 });
 
 socket.on("connect_error", (error) => {
@@ -93,8 +103,13 @@ function clearForm() {
     '<option value="" disabled selected>Esperando detección...</option>';
 }
 
-socket.on("update_ports", (ports) => {
-  console.log("Evento 'update_ports' recibido:", ports);
+let portsVersion = -1; // Versión de la lista de puertos mostrada.
+
+socket.on("update_ports", (payload) => {
+  console.log("Evento 'update_ports' recibido:", payload);
+  if (payload.version === portsVersion) return;
+  portsVersion = payload.version;
+  const ports = payload.ports;
 
   const portSelect = document.getElementById("port");
   if (portSelect) {
@@ -113,6 +128,19 @@ socket.on("update_ports", (ports) => {
       option.textContent = "No se detectó el taxímetro";
       portSelect.appendChild(option);
     }
+
+    if (selectedPort) {
+      portSelect.value = selectedPort;
+    }
+  }
+
+  // Estado del puerto seleccionado, antes consultado cada 5 segundos
+  if (selectedPort) {
+    const connected = ports.some((port) => port.device === selectedPort);
+    updatePortStatus(connected);
+    if (!connected) {
+      location.reload();
+    }
   }
 });
 
@@ -129,6 +157,8 @@ function restartProgram() {
   selectedPort = null;
   updateJobStatus("Listo");
   isProgramFinished = false;
+  currentJobId = null;
+  lastSeq = 0;
   initializeForm();
   isReloading = false; // Resetear el flag de recarga
 }
@@ -162,6 +192,9 @@ async function executeAndProgram(event) {
     const result = await response.json();
 
     if (result.status === "success") {
+      currentJobId = result.job_id;
+      lastSeq = 0;
+      subscribeToJob();
       addLogMessage(
         "Comenzó la ejecución del trabajo y la programación, espere unos minutos..."
       );
@@ -208,45 +241,98 @@ const executeButton = document.getElementById("executeButton");
 jobForm.addEventListener("input", checkFormValidity);
 jobForm.addEventListener("change", checkFormValidity);
 
+function subscribeToJob() {
+  if (!currentJobId || isProgramFinished || !socket.connected) return;
+  socket.emit(
+    "subscribe_job",
+    { job_id: currentJobId, last_seq: lastSeq },
+    (ack) => {
+      if (!ack || ack.status !== "success") {
+        console.error("No se pudo suscribir al trabajo:", ack);
+      }
+    }
+  );
+}
+
+function handleStatusEvent(event) {
+  if (isProgramFinished || event.job_id !== currentJobId) return;
+  if (event.seq <= lastSeq) return; // Evento ya aplicado
+  if (event.seq > lastSeq + 1) {
+    // Se perdieron eventos: el servidor los reenvía en orden
+    subscribeToJob();
+    return;
+  }
+  lastSeq = event.seq;
+  const currentStatus = event.status;
+  console.log("Estado actualizado desde el servidor:", currentStatus);
+
+  if (currentStatus !== lastStatus) { // Verificar si el estado ha cambiado
+    addLogMessage(`<strong>Status:</strong> ${currentStatus}`);
+    lastStatus = currentStatus; // Actualizar el último estado
+  }
+
+  if (currentStatus === "Finalizado") {
+    isProgramFinished = true;
+    if (!isReloading) {
+      alert(
+        "Programación completada para el numero serial " +
+          document.getElementById("NUMERO_SERIAL").value +
+          ". Desconecte el taxímetro."
+      );
+      isReloading = true;
+      location.reload();
+    }
+  } else if (event.state === "error") {
+    isProgramFinished = true;
+    executeButton.textContent = "Programar WavesByte Cibtron WB-001";
+    executeButton.disabled = false;
+  }
+}
+
+socket.on("job_status_update", handleStatusEvent);
+
+// Progreso del flasheo (bytes escritos, velocidad y tiempo restante)
+socket.on("job_progress", (progress) => {
+  if (isProgramFinished || progress.job_id !== currentJobId) return;
+  if (progress.phase === "write") {
+    const eta =
+      progress.eta === null ? "" : `, ${Math.ceil(progress.eta)} s restantes`;
+    executeButton.textContent = `Programando... ${progress.percent}% (${Math.round(
+      progress.kbps
+    )} kbit/s${eta})`;
+  } else if (progress.phase === "compress" && progress.detail) {
+    addLogMessage(
+      `Compresión nivel ${progress.detail.level} (${progress.detail.reason})`
+    );
+  } else if (progress.phase === "rewrite" && progress.detail) {
+    addLogMessage(
+      `Verificación fallida, reescribiendo ${progress.detail.regions.length} zonas (${progress.total_bytes} bytes)`
+    );
+  } else if (progress.phase === "skipped") {
+    addLogMessage(
+      `0x${progress.address.toString(16)} ya está en la flash, no se reescribe`
+    );
+  } else if (progress.phase === "done") {
+    executeButton.textContent = "Verificando...";
+  }
+});
+
+// Respaldo cuando Socket.IO está desconectado
 async function checkStatus() {
-  if (isProgramFinished) return;
+  if (isProgramFinished || !currentJobId) return;
 
   try {
-    const response = await fetch("/get_job_status");
+    const response = await fetch(
+      `/get_job_status?job_id=${encodeURIComponent(currentJobId)}&since=${lastSeq}`
+    );
     const data = await response.json();
-    const currentStatus = data.status;
-
-    if (currentStatus) {
-      console.log("Estado actualizado desde el servidor:", currentStatus);
-
-      if (currentStatus !== lastStatus) { // Verificar si el estado ha cambiado
-         addLogMessage(`<strong>Status:</strong> ${currentStatus}`);
-         lastStatus = currentStatus; // Actualizar el último estado
-        }
-
-      if (currentStatus === "Finalizado") {
-        isProgramFinished = true;
-        if (!isReloading) {
-          alert(
-            "Programación completada para el numero serial " +
-              document.getElementById("NUMERO_SERIAL").value +
-              ". Desconecte el taxímetro."
-          );
-          isReloading = true;
-          location.reload();
-        }
-      }
-    } else {
-      addLogMessage("No se pudo obtener el estado actual.");
-    }
+    (data.history || []).forEach(handleStatusEvent);
   } catch (error) {
     console.error("Error al obtener el estado actual:", error);
     addLogMessage("Error al obtener el estado actual.");
   }
 }
 
-setInterval(checkStatus, 1000);
-
 document
   .getElementById("searchSerialBtn")
   .addEventListener("click", async () => {
@@ -313,35 +399,12 @@ document
     }
   });
 
-document
-  .getElementById("searchCertificateBtn")
-  .addEventListener("click", async () => {
-    const serialNumber = document.getElementById("NUMERO_SERIAL").value;
-
-    if (!serialNumber) {
-      alert("Por favor, asegúrate de que el número serial esté presente.");
-      return;
-    }
+function renderCertificate(cert) {
+  const data = cert.document_data;
+  const card = document.createElement("div");
+  card.className = "card";
 
-    try {
-      const response = await fetch(
-        `/search_certificates?serial_number=${serialNumber}`
-      );
-      const result = await response.json();
-      const certificatesList = document.getElementById("certificatesList");
-      certificatesList.innerHTML = "";
-
-      if (
-        result.status === "success" &&
-        Array.isArray(result.data) &&
-        result.data.length > 0
-      ) {
-        result.data.forEach((cert) => {
-          const data = cert.document_data;
-          const card = document.createElement("div");
-          card.className = "card";
-
-          card.innerHTML = `
+  card.innerHTML = `
                     <div class="card-body">
                         <h5 class="card-title">ID: ${cert.document_id}</h5>
                         <p class="card-text">
@@ -365,20 +428,65 @@ document
                         </button>
                     </div>
                 `;
-          certificatesList.appendChild(card);
-        });
-      } else if (result.status === "success" && result.data.length === 0) {
+  return card;
+}
+
+// Carga una página del historial; cursor es null para la primera
+async function loadCertificates(serialNumber, cursor) {
+  const certificatesList = document.getElementById("certificatesList");
+  const params = new URLSearchParams({ serial_number: serialNumber });
+  if (cursor) {
+    params.set("cursor", cursor);
+  } else {
+    certificatesList.innerHTML = "";
+  }
+
+  try {
+    const response = await fetch(`/search_certificates?${params}`);
+    const result = await response.json();
+    document.getElementById("loadMoreCertificatesBtn")?.remove();
+
+    if (result.status === "success" && Array.isArray(result.data)) {
+      if (!cursor && result.data.length === 0) {
         certificatesList.innerHTML =
           "<p>No se encontraron programaciones previas para este número serial.</p>";
-      } else {
-        certificatesList.innerHTML = `<p>Error en la respuesta: ${JSON.stringify(
-          result
-        )}</p>`;
+        return;
       }
-    } catch (error) {
-      console.error("Error al buscar programaciones previas:", error);
-      certificatesList.innerHTML = `<p>Ocurrió un error: ${error.message}</p>`;
+      result.data.forEach((cert) => {
+        certificatesList.appendChild(renderCertificate(cert));
+      });
+      if (result.next_cursor) {
+        const loadMoreBtn = document.createElement("button");
+        loadMoreBtn.id = "loadMoreCertificatesBtn";
+        loadMoreBtn.className = "btn btn-secondary btn-sm";
+        loadMoreBtn.textContent = "Cargar más";
+        loadMoreBtn.addEventListener("click", () =>
+          loadCertificates(serialNumber, result.next_cursor)
+        );
+        certificatesList.appendChild(loadMoreBtn);
+      }
+    } else {
+      certificatesList.innerHTML = `<p>Error en la respuesta: ${JSON.stringify(
+        result
+      )}</p>`;
     }
+  } catch (error) {
+    console.error("Error al buscar programaciones previas:", error);
+    certificatesList.innerHTML = `<p>Ocurrió un error: ${error.message}</p>`;
+  }
+}
+
+document
+  .getElementById("searchCertificateBtn")
+  .addEventListener("click", async () => {
+    const serialNumber = document.getElementById("NUMERO_SERIAL").value;
+
+    if (!serialNumber) {
+      alert("Por favor, asegúrate de que el número serial esté presente.");
+      return;
+    }
+
+    await loadCertificates(serialNumber, null);
   });
 
 function showDetails(data) {
@@ -499,41 +607,10 @@ let selectedPort = null;
 
 document.getElementById("port").addEventListener("change", (event) => {
   selectedPort = event.target.value;
+  // La lista viene del watcher del servidor: el puerto elegido está conectado
+  updatePortStatus(Boolean(selectedPort));
 });
 
-setInterval(async () => {
-  if (!selectedPort) return;
-
-  try {
-    const response = await fetch("/check_port_status", {
-      method: "POST",
-      headers: {
-        "Content-Type": "application/json",
-      },
-      body: JSON.stringify({
-        port: selectedPort,
-      }),
-    });
-    const data = await response.json();
-
-    if (data.status === "success") {
-      const statusLabel = document.getElementById("port-status");
-      if (data.connected) {
-        statusLabel.textContent = "Conectado";
-        statusLabel.style.color = "green";
-      } else {
-        statusLabel.textContent = "Desconectado";
-        statusLabel.style.color = "red";
-        location.reload();
-      }
-    } else {
-      console.error("Error al verificar estado del puerto:", data.message);
-    }
-  } catch (error) {
-    console.error("Error al realizar la solicitud:", error);
-  }
-}, 5000);
-
 let lastLogMessage = null;
 
 function addLogMessage(message, isStatus = false) {
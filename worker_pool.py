@@ -0,0 +1,112 @@
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+# Cada cuánto el hub revisa las llamadas pendientes y los resultados
+HUB_POLL_INTERVAL = 0.05
+
+
+class HubDispatcher:
+    """
+    Cola de llamadas que deben ejecutarse en el hub de Socket.IO (por
+    ejemplo, socketio.emit) cuando se originan en hilos nativos. Los hilos
+    encolan con call_soon y un bucle del hub las ejecuta en orden.
+    """
+
+    def __init__(self, sleep=time.sleep, interval=HUB_POLL_INTERVAL):
+        self.sleep = sleep
+        self.interval = interval
+        self._calls = queue.Queue()
+        self._started = False
+        self._start_lock = threading.Lock()
+
+    def start(self, spawn):
+        """
+        Arranca run_forever con spawn (socketio.start_background_task). Las
+        llamadas siguientes no hacen nada: un segundo bucle desordenaría los
+        eventos.
+        """
+        with self._start_lock:
+            if self._started:
+                return
+            self._started = True
+        spawn(self.run_forever)
+
+    def call_soon(self, fn, *args, **kwargs):
+        """Encola fn para el hub; se puede llamar desde cualquier hilo."""
+        self._calls.put((fn, args, kwargs))
+
+    def run_pending(self):
+        while True:
+            try:
+                fn, args, kwargs = self._calls.get_nowait()
+            except queue.Empty:
+                return
+            try:
+                fn(*args, **kwargs)
+            except Exception as e:
+                print(f"Error ejecutando llamada en el hub: {e}")
+
+    def run_forever(self):
+        """Bucle del hub; iniciar con start()."""
+        while True:
+            self.run_pending()
+            self.sleep(self.interval)
+
+
+class WorkerPool:
+    """
+    Hilos nativos para el trabajo bloqueante de puerto serie y flasheo, fuera
+    del hub de eventlet. Mientras un equipo se programa, el hub sigue
+    atendiendo las rutas HTTP y los latidos de Socket.IO.
+
+    Cada puerto tiene su propio hilo, creado la primera vez que se usa: con
+    varios adaptadores ningún trabajo espera a que termine el de otro puerto,
+    y los de un mismo puerto (que no pueden ir a la vez) se ejecutan en orden.
+    """
+
+    def __init__(self, dispatcher):
+        self.dispatcher = dispatcher
+        self._executors = {}
+        self._lock = threading.Lock()
+
+    def _executor(self, port):
+        with self._lock:
+            executor = self._executors.get(port)
+            if executor is None:
+                executor = ThreadPoolExecutor(
+                    max_workers=1, thread_name_prefix=f"serial-worker-{port}"
+                )
+                self._executors[port] = executor
+            return executor
+
+    def submit(self, port, fn, *args, on_done=None, on_error=None):
+        """
+        Ejecuta fn en el hilo del puerto. on_done(resultado) u
+        on_error(excepción) se llaman en el hub al terminar.
+        """
+        future = self._executor(port).submit(fn, *args)
+
+        def done(future):
+            error = future.exception()
+            if error is not None:
+                if on_error:
+                    self.dispatcher.call_soon(on_error, error)
+                else:
+                    print(f"Error en trabajo del pool: {error}")
+            elif on_done:
+                self.dispatcher.call_soon(on_done, future.result())
+
+        future.add_done_callback(done)
+        return future
+
+    def run(self, port, fn, *args):
+        """
+        Ejecuta fn en el hilo del puerto y espera el resultado cediendo el hub
+        (para usar desde una ruta). Relanza la excepción de fn.
+        """
+        future = self._executor(port).submit(fn, *args)
+        while not future.done():
+            self.dispatcher.sleep(self.dispatcher.interval)
+        return future.result()